@@ -1,22 +1,325 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, g
 import pandas as pd
 import io
 import os
-import json
+import time
 import numpy as np
 from werkzeug.utils import secure_filename
+from sheet_cache import SheetCache
+import columnar_store
+import rollup_cube
+import compact_dtypes
+import upload_store
+import excel_reader
+import chart_image
+import metrics
+from ingest import IngestJobs
+from serving import RequestLimiter, ChartWorkers, ChartTimeout
+from response_cache import ResponseCache, compress_response, mark_cacheable
+from chart_export import render_chart_page
+from serializers import FastJSONProvider, dumps, wants_columnar, columnar_response
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # Writes NumPy arrays directly and NaN as null
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload
 app.config['ALLOWED_EXTENSIONS'] = {'xlsx', 'xls'}
+app.config['SHEET_CACHE_MAX_BYTES'] = int(os.environ.get('SHEET_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # 512 MB of parsed sheets
+app.config['INGEST_WORKERS'] = int(os.environ.get('INGEST_WORKERS', os.cpu_count() or 1))  # 0 ingests in the request
+app.config['ROLLUP_CUBE'] = os.environ.get('ROLLUP_CUBE', '1') != '0'  # Answer whole-sheet charts from stored rollups
+app.config['EXCEL_READER'] = os.environ.get('EXCEL_READER', 'auto')  # auto, stream, openpyxl or calamine
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 64 MB of chart responses, 0 disables
+app.config['CHART_WORKERS'] = int(os.environ.get('CHART_WORKERS', 0))  # Processes computing charts, 0 computes them in the request
+app.config['REQUEST_TIMEOUT'] = float(os.environ.get('REQUEST_TIMEOUT', 60))  # Seconds a chart worker may take
+app.config['MAX_CONCURRENT_REQUESTS'] = int(os.environ.get('MAX_CONCURRENT_REQUESTS', 0))  # Data requests run at once, 0 for no limit
+app.config['REQUEST_QUEUE_TIMEOUT'] = float(os.environ.get('REQUEST_QUEUE_TIMEOUT', 30))  # Seconds a data request waits for a slot
+app.config['PROFILE_SLOW_REQUESTS'] = float(os.environ.get('PROFILE_SLOW_REQUESTS', 0))  # Save cProfile stats of requests slower than this many seconds, 0 disables
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 1.0))  # Share of requests run under the profiler
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # 64 MB of rendered chart images, 0 disables
+app.config['EXPORT_COMPRESS_MIN_BYTES'] = int(os.environ.get('EXPORT_COMPRESS_MIN_BYTES', 512 * 1024))  # Chart data gzipped into exported pages from this size
 
 # Create uploads folder if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Engine used for every workbook read (see excel_reader.py)
+excel_reader.set_default_engine(app.config['EXCEL_READER'])
+
+# Parsed sheets shared by all data routes
+sheet_cache = SheetCache(app.config['SHEET_CACHE_MAX_BYTES'])
+
+# Background conversion of uploaded workbooks, one sheet per worker process
+ingest_jobs = IngestJobs(app.config['INGEST_WORKERS'])
+
+# Per-stage request timings (sent as Server-Timing, totalled for /metrics)
+request_metrics = metrics.Metrics()
+slow_request_profiler = metrics.SlowRequestProfiler(app.config['PROFILE_SLOW_REQUESTS'], app.config['PROFILE_SAMPLE_RATE'], app.config['PROFILE_DIR'])
+
+@app.before_request
+def start_request_timer():
+    metrics.start_request()
+    g.profiler = slow_request_profiler.start()
+
+# Runs after the other after_request hooks (they run in reverse order), so the
+# compressed size is counted
+@app.after_request
+def record_request_timings(response):
+    timer = metrics.current_timer()
+    if timer is None:
+        return response
+    
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    response.headers['Server-Timing'] = metrics.server_timing_header(timer)
+    nbytes = 0 if response.is_streamed else response.calculate_content_length() or 0
+    request_metrics.observe(route, request.method, response.status_code, timer, nbytes)
+    
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        slow_request_profiler.finish(profiler, route, timer.total)
+    return response
+
+@app.teardown_request
+def end_request_timer(exc=None):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    metrics.end_request()
+
+# Chart computations, in worker processes when CHART_WORKERS is set
+chart_workers = ChartWorkers(app.config['CHART_WORKERS'], app.config['REQUEST_TIMEOUT'])
+
+# Data requests (all POST routes) beyond MAX_CONCURRENT_REQUESTS wait for a free slot
+request_limiter = RequestLimiter(app.config['MAX_CONCURRENT_REQUESTS'], app.config['REQUEST_QUEUE_TIMEOUT'])
+
+@app.before_request
+def limit_concurrent_requests():
+    if request.method != 'POST':
+        return None
+    with metrics.stage('queue'):
+        acquired = request_limiter.acquire()
+    if not acquired:
+        response = jsonify({'success': False, 'error': 'Server is busy, please try again'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+    g.request_slot = True
+    return None
+
+@app.teardown_request
+def release_request_slot(exc=None):
+    if g.pop('request_slot', False):
+        request_limiter.release()
+
+# Helper function to send a chart route's result; the response cache keeps it only
+# if it succeeded, which is read here rather than by decoding the body again
+def result_response(result):
+    return mark_cacheable(jsonify(result), bool(result.get('success')))
+
+# Helper function for chart requests whose computation took longer than REQUEST_TIMEOUT
+def timeout_response():
+    response = jsonify({'success': False, 'error': 'Request timed out'})
+    response.status_code = 504
+    return response
+
+# Helper function to compute a chart response with the chart workers, adding the
+# time of its stages to the request's timings
+def compute_chart(build, filepath, data):
+    response, stages, rows = chart_workers.run(metrics.run_timed, build, filepath, data)
+    metrics.current_timer().merge(stages, rows)
+    return response
+
+# Helper function to identify the version of the upload a request reads, so cached
+# responses for an overwritten file are never served. None if there's no such file.
+def upload_version(data):
+    filename = data.get('filename')
+    if not isinstance(filename, str) or not filename:
+        return None
+    try:
+        stat = os.stat(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+    except OSError:
+        return None
+    return [filename, stat.st_mtime_ns, stat.st_size]
+
+# Serialized chart responses, revalidated by ETag
+response_cache = ResponseCache(app.config['RESPONSE_CACHE_MAX_BYTES'], upload_version)
+
+# Rendered chart images, kept apart so they don't evict chart responses
+image_cache = ResponseCache(app.config['IMAGE_CACHE_MAX_BYTES'], upload_version)
+
+# Compress JSON responses the client accepts gzip/brotli for (cached chart
+# responses are compressed once and arrive here already encoded)
+@app.after_request
+def compress_json(response):
+    if response.mimetype == 'application/json':
+        with metrics.stage('compress'):
+            return compress_response(response)
+    return response
+
+# Helper function to remove what is kept for a stored workbook besides the file:
+# its columnar sidecars and cached sheets
+def remove_upload_data(filepath):
+    columnar_store.remove_sidecars(filepath)
+    sheet_cache.invalidate(filepath)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+# Helper function to read a sheet, preferring the columnar copy written at upload
+def read_sheet(filepath, sheet_name):
+    df = columnar_store.read_sheet(filepath, sheet_name)
+    if df is None:
+        df = excel_reader.read_excel(filepath, sheet_name=sheet_name)
+    return df
+
+# Helper function to read a sheet through the parsed-sheet cache.
+# With columns given, only those columns are read from the columnar copy (and cached
+# as their own entry). Sheets without a columnar copy, and requests naming a column
+# the sheet doesn't have, get the whole sheet so results and errors stay the same.
+# The returned DataFrame is shared between requests, so don't modify it in place.
+@metrics.timed_stage('parse')
+def load_sheet(filepath, sheet_name, columns=None):
+    if columns is not None and all(isinstance(col, (str, int, float)) for col in columns):
+        df = sheet_cache.get(filepath, (sheet_name, tuple(columns)), lambda: columnar_store.read_sheet(filepath, sheet_name, columns))
+        if df is not None and df.shape[1] == len(columns):
+            return df
+    return sheet_cache.get(filepath, sheet_name, lambda: read_sheet(filepath, sheet_name))
+
+# Helper function to read a sheet's column indexes (built when it was stored) through
+# the parsed-sheet cache. None for sheets without a columnar copy.
+@metrics.timed_stage('parse')
+def load_sheet_index(filepath, sheet_name):
+    return sheet_cache.get(filepath, (sheet_name, '#index'), lambda: columnar_store.read_sheet_index(filepath, sheet_name))
+
+# Helper function to load a stored sheet's rollup grouped by keys through the
+# parsed-sheet cache, building and saving it the first time. None for sheets
+# without a columnar copy.
+@metrics.timed_stage('parse')
+def load_rollup(filepath, sheet_name, keys):
+    def loader():
+        stored = columnar_store.stored_sheet(filepath, sheet_name)
+        if stored is None or stored[1] is None:
+            return None
+        sheet_path, column_types = stored
+        numeric = [col for col in rollup_cube.numeric_columns(column_types) if col not in keys]
+        return rollup_cube.load_or_build(sheet_path, keys, lambda: load_sheet(filepath, sheet_name, keys + numeric), numeric)
+    
+    return sheet_cache.get(filepath, (sheet_name, '#rollup') + tuple(keys), loader)
+
+# Helper function to answer a chart from a rollup instead of the raw rows. That works
+# for aggregated chart types over the whole sheet with at most one equality filter
+# and numeric y-axes. Returns (chart_data, row_count), or None when the raw rows are
+# needed.
+@metrics.timed_stage('aggregate')
+def chart_from_rollup(filepath, sheet_name, df, window, filters, x_axis, y_axes, chart_type, max_points=None):
+    if not app.config['ROLLUP_CUBE'] or chart_type in ['scatter', 'bubble'] or len(filters) > 1:
+        return None
+    if len(df.iloc[window]) != len(df):
+        return None
+    
+    keys = [x_axis] if not filters or filters[0][0] == x_axis else [filters[0][0], x_axis]
+    if not all(isinstance(key, (str, int, float)) for key in keys):
+        return None
+    
+    rollup = load_rollup(filepath, sheet_name, keys)
+    if rollup is None or not rollup.available:
+        return None
+    if not all(y_axis_info.get('column') in rollup.sums.columns for y_axis_info in y_axes):
+        return None
+    
+    selected = rollup.select(*[value for _, value in filters])
+    if selected is None:
+        return None
+    
+    rolled_up, row_count = selected
+    metrics.add_rows(len(rolled_up))
+    return process_chart_data(rolled_up, x_axis, y_axes, chart_type, max_points), row_count
+
+# Helper function returning the index of a column, or None if it isn't indexed
+def find_column_index(sheet_index, column):
+    if sheet_index and isinstance(column, (str, int, float)):
+        return sheet_index.get(column)
+    return None
+
+# Helper function listing the columns a chart request reads: the axes, plus the
+# filter columns when they are applied. Row ranges are applied afterwards with
+# iloc, which on memory-mapped columns only touches the rows in the window.
+def chart_columns(x_axis, y_axes, filter_column=None, filter_value=None, chart_filter_column=None):
+    columns = [x_axis] + [y_axis_info.get('column') for y_axis_info in y_axes]
+    if filter_column and filter_value:
+        columns.append(filter_column)
+    if chart_filter_column:
+        columns.append(chart_filter_column)
+    return [col for col in dict.fromkeys(columns) if col is not None]
+
+# Helper function turning a request's startRow/endRow (Excel row numbers, with the
+# header in row 1) into the slice of sheet rows to use
+def row_window(start_row, end_row):
+    if start_row > 0:
+        start_row = max(start_row - 2, 0)
+    if end_row:
+        return slice(start_row, end_row - 1)
+    return slice(start_row, None)
+
+# Helper function to apply a row window and equality filters ((column, value) pairs,
+# applied in order). Filters on indexed columns take the matching rows from the
+# index instead of comparing every row. Returns the selected rows and where they
+# are in the sheet (a slice, or an array of positions once a filter applied).
+@metrics.timed_stage('filter')
+def select_rows(df, sheet_index, window, filters):
+    windowed = df.iloc[window]
+    rows = range(len(df))[window]
+    if not filters:
+        metrics.add_rows(len(windowed))
+        return windowed, slice(rows.start, rows.stop)
+    
+    positions = None
+    for column, value in filters:
+        column_index = find_column_index(sheet_index, column)
+        if column_index is not None:
+            matches = column_index.rows_equal_to(value)
+            if positions is None:
+                positions = matches[(matches >= rows.start) & (matches < rows.stop)]
+            else:
+                positions = np.intersect1d(positions, matches, assume_unique=True)
+        else:
+            if positions is None:
+                positions = np.arange(rows.start, rows.stop)
+            positions = positions[(df[column].take(positions) == value).to_numpy()]
+    
+    metrics.add_rows(len(positions))
+    return df.take(positions), positions
+
+# Helper function listing a column's distinct non-empty values in order of first
+# appearance, from the column index when there is one (rows as given by select_rows)
+@metrics.timed_stage('aggregate')
+def distinct_values(df, column, sheet_index=None, rows=None):
+    column_index = find_column_index(sheet_index, column)
+    if column_index is not None:
+        return column_index.distinct_values(rows)
+    return df[column].dropna().unique().tolist()
+
+# Helper function for data requests on a sheet that isn't ingested yet.
+# The client polls /ingest_status/<jobId> (or subscribes to /ingest_events/<jobId>)
+# and retries once the sheet is ready.
+def pending_response(job_id):
+    return jsonify({
+        'success': False,
+        'status': 'pending',
+        'jobId': job_id,
+        'error': 'Sheet is still being processed'
+    })
+
+# Helper function listing the columns filter_data reports unique values for.
+# Responses used to be cleaned with df.replace({np.nan: None}), which on a freshly
+# parsed workbook (one block per dtype) turned every column of a dtype containing
+# a single NaN into objects. The JSON provider now writes NaN as null without that
+# copy, so apply the same rule explicitly to keep responses unchanged. Text columns
+# stored as categoricals (see compact_dtypes) count as the object columns they were.
+def unique_value_columns(df):
+    text = [dtype == object or isinstance(dtype, pd.CategoricalDtype) for dtype in df.dtypes]
+    na_dtypes = {dtype for dtype, has_na, is_text in zip(df.dtypes, df.isna().any(), text) if has_na and not is_text}
+    return [col for col, dtype, is_text in zip(df.columns, df.dtypes, text) if is_text or dtype in na_dtypes]
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -31,56 +334,222 @@ def upload_file():
         return jsonify({'success': False, 'error': 'No file selected'})
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        extension = file.filename.rsplit('.', 1)[1].lower()
         
+        filename = None
         try:
-            # Get all sheet names
-            xls = pd.ExcelFile(filepath)
-            sheet_names = xls.sheet_names
+            # Stream the file to disk under the hash of its contents, so identical
+            # uploads share one stored copy
+            filename, filepath, is_new = upload_store.save_upload(file.stream, app.config['UPLOAD_FOLDER'], extension)
+            
+            # An identical workbook that was already converted is served as is
+            manifest = None if is_new else columnar_store.load_manifest(filepath)
+            original_filename = secure_filename(file.filename)
+            job_id = None
+            if manifest is not None and manifest.get('complete', True):
+                sheet_names = manifest['sheet_names']
+            else:
+                sheet_names = upload_store.read_sheet_names(filepath)
+                
+                # A workbook uploaded under the same name before is treated as a new
+                # version of it: sheets that only gained rows at the bottom are built
+                # from the stored earlier version plus their new rows
+                previous_filepath = upload_store.previous_upload(app.config['UPLOAD_FOLDER'], original_filename) if original_filename else None
+                if previous_filepath == filepath:
+                    previous_filepath = None
+                
+                # Convert every sheet to the columnar format once, so later requests
+                # don't have to parse the workbook again. This runs in the background
+                # and the client follows it through the returned job id.
+                if app.config['INGEST_WORKERS'] > 0:
+                    job_id = ingest_jobs.submit(filepath, filename, sheet_names, previous_filepath)
+                else:
+                    columnar_store.convert_workbook(filepath, previous_filepath)
             
-            return jsonify({
+            if original_filename:
+                upload_store.record_upload(app.config['UPLOAD_FOLDER'], original_filename, filename)
+            
+            response = {
                 'success': True, 
                 'filename': filename,
+                'originalFilename': original_filename,
                 'sheets': sheet_names
-            })
+            }
+            if job_id:
+                response['jobId'] = job_id
+            
+            return jsonify(response)
         except Exception as e:
+            # The client never learns the stored name, so drop this upload's
+            # reference to it here (and the workbook, if nothing else uses it)
+            if filename:
+                upload_store.release_upload(app.config['UPLOAD_FOLDER'], filename, remove_upload_data)
             return jsonify({'success': False, 'error': str(e)})
     
     return jsonify({'success': False, 'error': 'Invalid file type'})
 
+@app.route('/ingest_status/<job_id>', methods=['GET'])
+def ingest_status(job_id):
+    status = ingest_jobs.status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Unknown job'})
+    
+    return jsonify({'success': True, **status})
+
+@app.route('/ingest_events/<job_id>', methods=['GET'])
+def ingest_events(job_id):
+    if ingest_jobs.status(job_id) is None:
+        return jsonify({'success': False, 'error': 'Unknown job'})
+    
+    # Server-sent events: one message whenever the job's progress changes, until it is done
+    def events():
+        last = None
+        while True:
+            status = ingest_jobs.status(job_id)
+            if status is None:
+                return
+            status.pop('elapsed')
+            message = dumps(status, sort_keys=True)
+            if message != last:
+                yield f'data: {message}\n\n'
+                last = message
+            if status['status'] == 'done':
+                return
+            time.sleep(0.25)
+    
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/delete_file', methods=['POST'])
+def delete_file():
+    data = request.json
+    filename = data.get('filename')
+    
+    if not filename:
+        return jsonify({'success': False, 'error': 'Missing filename'})
+    
+    filename = secure_filename(filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(filepath):
+        return jsonify({'success': False, 'error': 'File not found'})
+    
+    try:
+        # Identical uploads share one stored copy, so only the last delete removes
+        # it; the columnar sidecars, cached sheets and version entries go with it
+        upload_store.release_upload(app.config['UPLOAD_FOLDER'], filename, remove_upload_data)
+        
+        return jsonify({'success': True})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/get_sheet_data', methods=['POST'])
 def get_sheet_data():
     data = request.json
     filename = data.get('filename')
     sheet_name = data.get('sheet')
+    offset = data.get('offset', 0)
+    limit = data.get('limit')
+    selected_columns = data.get('columns')
     
     if not filename or not sheet_name:
         return jsonify({'success': False, 'error': 'Missing filename or sheet name'})
     
+    # The window of rows must be whole numbers: a negative offset would count
+    # from the end of the sheet
+    try:
+        offset = int(offset) if offset is not None else 0
+        limit = int(limit) if limit is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'offset and limit must be whole numbers'})
+    if offset < 0 or (limit is not None and limit <= 0):
+        return jsonify({'success': False, 'error': 'offset must be 0 or more and limit more than 0'})
+    
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     if not os.path.exists(filepath):
         return jsonify({'success': False, 'error': 'File not found'})
     
+    # Don't block on a sheet that is still being ingested
+    job_id = ingest_jobs.pending_job(filepath, sheet_name)
+    if job_id:
+        return pending_response(job_id)
+    
     try:
-        # Read the sheet data with pandas
-        df = pd.read_excel(filepath, sheet_name=sheet_name)
-        
-        # Clean the data for JSON serialization
-        df = df.replace({np.nan: None})
+        # Read the sheet data (parsed once, then served from the cache)
+        df = load_sheet(filepath, sheet_name)
         
         # Get column names
         columns = df.columns.tolist()
+        total_rows = len(df)
+        offset = min(offset, total_rows)
+        
+        # Only serialize the requested window of rows (and columns, if given)
+        if limit is not None:
+            df = df.iloc[offset:offset + limit]
+        else:
+            df = df.iloc[offset:]
+        
+        if selected_columns:
+            df = df[selected_columns]
+        
+        # Stream column-oriented arrays to clients that opted in
+        if wants_columnar(request, data):
+            return columnar_response(
+                df,
+                success=True,
+                columns=columns,
+                offset=offset,
+                rowCount=len(df),
+                totalRows=total_rows
+            )
         
         # Convert data to a list of dictionaries for easier processing in JavaScript
-        data = df.to_dict('records')
+        # (NaN cells are written as null by the JSON provider)
+        with metrics.stage('serialize'):
+            data = df.to_dict('records')
+        metrics.add_rows(len(data))
         
         return jsonify({
             'success': True,
             'columns': columns,
             'data': data,
-            'rowCount': len(data)
+            'offset': offset,
+            'rowCount': len(data),
+            'totalRows': total_rows
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/column_values', methods=['POST'])
+def column_values():
+    data = request.json
+    filename = data.get('filename')
+    sheet_name = data.get('sheet')
+    column = data.get('column')
+    
+    if not filename or not sheet_name or not column:
+        return jsonify({'success': False, 'error': 'Missing required parameters'})
+    
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(filepath):
+        return jsonify({'success': False, 'error': 'File not found'})
+    
+    # Don't block on a sheet that is still being ingested
+    job_id = ingest_jobs.pending_job(filepath, sheet_name)
+    if job_id:
+        return pending_response(job_id)
+    
+    try:
+        # Distinct non-empty values in order of first appearance, straight from the
+        # column index if there is one, otherwise from just this column
+        column_index = find_column_index(load_sheet_index(filepath, sheet_name), column)
+        if column_index is not None:
+            values = column_index.distinct_values()
+        else:
+            df = load_sheet(filepath, sheet_name, [column])
+            values = df[column].dropna().unique().tolist()
+        
+        return jsonify({
+            'success': True,
+            'values': values
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -102,37 +571,32 @@ def filter_data():
     if not os.path.exists(filepath):
         return jsonify({'success': False, 'error': 'File not found'})
     
+    # Don't block on a sheet that is still being ingested
+    job_id = ingest_jobs.pending_job(filepath, sheet_name)
+    if job_id:
+        return pending_response(job_id)
+    
     try:
-        # Read the sheet data with pandas
-        df = pd.read_excel(filepath, sheet_name=sheet_name)
+        # Read the sheet data (parsed once, then served from the cache)
+        df = load_sheet(filepath, sheet_name)
+        sheet_index = load_sheet_index(filepath, sheet_name)
         
-        # Apply row range filter
-        if start_row > 0:
-            start_row = start_row - 2  # Adjust for Excel row numbering
-            if start_row < 0:
-                start_row = 0
+        # Apply row range and column filter (indexed columns are looked up, not scanned)
+        filters = [(filter_column, filter_value)] if filter_column and filter_value else []
+        df, rows = select_rows(df, sheet_index, row_window(start_row, end_row), filters)
         
-        if end_row:
-            end_row = end_row - 1  # Adjust for Excel row numbering
-            df = df.iloc[start_row:end_row]
-        else:
-            df = df.iloc[start_row:]
-        
-        # Apply column filter if specified
-        if filter_column and filter_value:
-            df = df[df[filter_column] == filter_value]
-        
-        # Clean data for JSON serialization
-        df = df.replace({np.nan: None})
-        
-        # Get unique values for chart filter
+        # Get unique values for chart filter (only for columns sent as strings/objects)
         unique_values = {}
-        for col in df.columns:
-            if df[col].dtype == object:  # Only get unique values for string columns
-                unique_values[col] = df[col].dropna().unique().tolist()
+        for col in unique_value_columns(df):
+            unique_values[col] = distinct_values(df, col, sheet_index, rows)
+        
+        # Stream column-oriented arrays to clients that opted in
+        if wants_columnar(request, data):
+            return columnar_response(df, success=True, uniqueValues=unique_values)
         
-        # Convert data to a list of dictionaries
-        data = df.to_dict('records')
+        # Convert data to a list of dictionaries (NaN cells are written as null)
+        with metrics.stage('serialize'):
+            data = df.to_dict('records')
         
         return jsonify({
             'success': True,
@@ -143,10 +607,37 @@ def filter_data():
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/generate_chart', methods=['POST'])
+@response_cache.cached
 def generate_chart():
     data = request.json
     filename = data.get('filename')
     sheet_name = data.get('sheet')
+    
+    if not filename or not sheet_name or not data.get('xAxis') or not data.get('yAxes') or not data.get('chartType'):
+        return jsonify({
+            'success': False, 
+            'error': 'Missing required parameters'
+        })
+    
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(filepath):
+        return jsonify({'success': False, 'error': 'File not found'})
+    
+    # Don't block on a sheet that is still being ingested
+    job_id = ingest_jobs.pending_job(filepath, sheet_name)
+    if job_id:
+        return pending_response(job_id)
+    
+    try:
+        return result_response(compute_chart(build_chart, filepath, data))
+    except ChartTimeout:
+        return timeout_response()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+# Helper function computing the /generate_chart response (run by the chart workers)
+def build_chart(filepath, data):
+    sheet_name = data.get('sheet')
     x_axis = data.get('xAxis')
     y_axes = data.get('yAxes', [])
     chart_type = data.get('chartType')
@@ -155,53 +646,131 @@ def generate_chart():
     chart_filter_column = data.get('chartFilterColumn')
     start_row = data.get('startRow', 0)
     end_row = data.get('endRow')
+    max_points = data.get('maxPoints')
+    
+    # Read only the columns the chart uses (parsed once, then served from the cache)
+    columns = chart_columns(x_axis, y_axes, filter_column, filter_value, chart_filter_column)
+    df = load_sheet(filepath, sheet_name, columns)
+    sheet_index = load_sheet_index(filepath, sheet_name)
+    
+    # Apply row range and column filter (indexed columns are looked up, not scanned)
+    filters = [(filter_column, filter_value)] if filter_column and filter_value else []
+    window = row_window(start_row, end_row)
+    rolled_up = chart_from_rollup(filepath, sheet_name, df, window, filters, x_axis, y_axes, chart_type, max_points)
+    df, rows = select_rows(df, sheet_index, window, filters)
+    
+    # Process data for chart (from the sheet's rollup when it covers the request)
+    chart_data = rolled_up[0] if rolled_up else process_chart_data(df, x_axis, y_axes, chart_type, max_points)
+    downsampling = chart_data.pop('downsampling', None) if chart_data else None
+    
+    # Prepare chart filter values if specified
+    chart_filter_values = []
+    if chart_filter_column:
+        chart_filter_values = distinct_values(df, chart_filter_column, sheet_index, rows)
+    
+    response = {
+        'success': True,
+        'chartData': chart_data,
+        'chartType': chart_type,
+        'chartFilterValues': chart_filter_values
+    }
+    
+    # Let the UI tell the user the chart shows a reduced set of points
+    if downsampling:
+        response['downsampling'] = downsampling
+    
+    return response
+
+@app.route('/render_chart', methods=['POST'])
+@image_cache.cached
+def render_chart():
+    data = request.json
+    filename = data.get('filename')
+    sheet_name = data.get('sheet')
+    image_format = data.get('format', 'svg')
     
-    if not filename or not sheet_name or not x_axis or not y_axes or not chart_type:
+    if not filename or not sheet_name or not data.get('xAxis') or not data.get('yAxes') or not data.get('chartType'):
         return jsonify({
             'success': False, 
             'error': 'Missing required parameters'
         })
     
+    if image_format not in chart_image.available_formats():
+        return jsonify({
+            'success': False,
+            'error': f"Unsupported image format '{image_format}' (available: {', '.join(chart_image.available_formats())})"
+        })
+    
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     if not os.path.exists(filepath):
         return jsonify({'success': False, 'error': 'File not found'})
     
+    # Don't block on a sheet that is still being ingested
+    job_id = ingest_jobs.pending_job(filepath, sheet_name)
+    if job_id:
+        return pending_response(job_id)
+    
     try:
-        # Read the sheet data with pandas
-        df = pd.read_excel(filepath, sheet_name=sheet_name)
-        
-        # Apply row range filter
-        if start_row > 0:
-            start_row = start_row - 2  # Adjust for Excel row numbering
-            if start_row < 0:
-                start_row = 0
-        
-        if end_row:
-            end_row = end_row - 1  # Adjust for Excel row numbering
-            df = df.iloc[start_row:end_row]
-        else:
-            df = df.iloc[start_row:]
-        
-        # Apply column filter if specified
-        if filter_column and filter_value:
-            df = df[df[filter_column] == filter_value]
-        
-        # Process data for chart
-        chart_data = process_chart_data(df, x_axis, y_axes, chart_type)
-        
-        # Prepare chart filter values if specified
-        chart_filter_values = []
-        if chart_filter_column:
-            chart_filter_values = df[chart_filter_column].dropna().unique().tolist()
-        
-        return jsonify({
-            'success': True,
-            'chartData': chart_data,
-            'chartType': chart_type,
-            'chartFilterValues': chart_filter_values
-        })
+        image = compute_chart(build_chart_image, filepath, data)
+    except ChartTimeout:
+        return timeout_response()
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
+    
+    return Response(image, mimetype=chart_image.MIMETYPES[image_format])
+
+# Helper function rendering the /render_chart image (run by the chart workers). The
+# chart is built as /generate_chart builds it, or as /apply_chart_filter does when
+# a chartFilterValue is given.
+def build_chart_image(filepath, data):
+    return render_chart_image(chart_builder(data)(filepath, data)['chartData'], data)
+
+# Helper function picking how a chart spec is built: as /apply_chart_filter builds
+# it when it has a chartFilterValue, as /generate_chart does otherwise
+def chart_builder(data):
+    return build_filtered_chart if data.get('chartFilterValue') else build_chart
+
+# Helper function drawing chart data as the image a /render_chart request asks for
+def render_chart_image(chart_data, data):
+    chart_type = data.get('chartType')
+    chart_data = palette_chart_data(chart_data, chart_type, data.get('yAxes', []))
+    
+    width = min(max(int(data.get('width', 800)), 100), 4000)
+    height = min(max(int(data.get('height', 500)), 100), 4000)
+    scale = min(max(float(data.get('scale', 1)), 0.5), 4)
+    with metrics.stage('render'):
+        return chart_image.render(chart_data, chart_type, data.get('format', 'svg'), width, height, data.get('title'), scale)
+
+# Helper function giving each series of a chart image its color from the
+# generate_colors palette (series whose y-axis picks a color keep it; slices
+# already have palette colors). Returns a copy; chart_data is left as it is.
+def palette_chart_data(chart_data, chart_type, y_axes):
+    if not chart_data or chart_type in ['pie', 'doughnut', 'polarArea']:
+        return chart_data
+    
+    datasets = [dict(dataset) for dataset in chart_data.get('datasets', [])]
+    chart_data = {**chart_data, 'datasets': datasets}
+    for i, (dataset, color) in enumerate(zip(datasets, generate_colors(len(datasets)))):
+        if i < len(y_axes) and isinstance(y_axes[i], dict) and y_axes[i].get('color'):
+            continue
+        dataset['borderColor'] = color
+        dataset['backgroundColor'] = chart_image.with_alpha(color, 0.2) if chart_type == 'radar' else color
+    return chart_data
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    caches = {'sheet': sheet_cache.stats(), 'response': response_cache.stats(), 'image': image_cache.stats()}
+    return Response(request_metrics.render(caches, request_limiter.stats()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'success': True,
+        'sheetCache': sheet_cache.stats(),
+        'responseCache': response_cache.stats(),
+        'imageCache': image_cache.stats(),
+        'requests': request_limiter.stats()
+    })
 
 # Helper function to generate colors for pie/doughnut charts
 def generate_colors(count):
@@ -218,51 +787,77 @@ def generate_colors(count):
 
 # Helper function to calculate percentage data for stacked bar charts
 def calculate_percentage_data(datasets, labels, visible_indices=None):
-    # For each label/category, calculate the sum of all dataset values
-    totals = [0] * len(labels)
+    label_count = len(labels)
     
     # If visible_indices is not provided, use all datasets
     if visible_indices is None:
         visible_indices = list(range(len(datasets)))
     
-    # Sum only the visible datasets
-    for idx in visible_indices:
-        if idx < len(datasets):
-            dataset = datasets[idx]
-            for i, value in enumerate(dataset['data']):
-                if i < len(totals):  # Ensure we don't go out of bounds
-                    totals[i] += abs(float(value)) if value is not None else 0
+    # Stack the absolute dataset values into a (datasets x labels) matrix, counting None as 0
+    magnitudes = np.zeros((len(datasets), label_count))
+    for idx, dataset in enumerate(datasets):
+        values = np.array(dataset['data'][:label_count], dtype=object)
+        values[np.equal(values, None)] = 0
+        magnitudes[idx, :len(values)] = np.abs(values.astype(float))
     
-    # Convert each dataset value to a percentage of the total
+    # Sum only the visible datasets for each label/category
+    visible_rows = [idx for idx in visible_indices if idx < len(datasets)]
+    totals = magnitudes[visible_rows].sum(axis=0) if visible_rows else np.zeros(label_count)
+    
+    # Convert every value to a percentage of its label's total in one operation
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentages = (magnitudes / totals * 100).astype(object)
+    percentages[:, ~(totals > 0)] = 0
+    
+    visible = set(visible_indices)
     percentage_datasets = []
     for idx, dataset in enumerate(datasets):
-        percentage_data = []
+        percentage_dataset = dataset.copy()
+        data_length = len(dataset['data'])
         
-        # Only process visible datasets for the result
-        if idx in visible_indices:
-            for i, value in enumerate(dataset['data']):
-                if i < len(totals) and totals[i] > 0:
-                    val = abs(float(value)) if value is not None else 0
-                    percentage_data.append((val / totals[i]) * 100)
-                else:
-                    percentage_data.append(0)
-            
-            percentage_dataset = dataset.copy()
-            percentage_dataset['data'] = percentage_data
-            percentage_datasets.append(percentage_dataset)
+        if idx in visible:
+            # Values past the last label have no total and stay at zero
+            percentage_dataset['data'] = percentages[idx, :data_length].tolist() + [0] * (data_length - label_count)
         else:
             # For hidden datasets, include them with zeros
-            percentage_dataset = dataset.copy()
-            percentage_dataset['data'] = [0] * len(dataset['data'])
-            percentage_datasets.append(percentage_dataset)
+            percentage_dataset['data'] = [0] * data_length
+        
+        percentage_datasets.append(percentage_dataset)
     
     return percentage_datasets
 
 @app.route('/apply_chart_filter', methods=['POST'])
+@response_cache.cached
 def apply_chart_filter():
     data = request.json
     filename = data.get('filename')
     sheet_name = data.get('sheet')
+    
+    if not filename or not sheet_name:
+        return jsonify({
+            'success': False, 
+            'error': 'Missing required parameters'
+        })
+    
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.exists(filepath):
+        return jsonify({'success': False, 'error': 'File not found'})
+    
+    # Don't block on a sheet that is still being ingested
+    job_id = ingest_jobs.pending_job(filepath, sheet_name)
+    if job_id:
+        return pending_response(job_id)
+    
+    try:
+        return result_response(compute_chart(build_filtered_chart, filepath, data))
+    except ChartTimeout:
+        return timeout_response()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+# Helper function computing the /apply_chart_filter response (run by the chart workers)
+def build_filtered_chart(filepath, data):
+    sheet_name = data.get('sheet')
     x_axis = data.get('xAxis')
     y_axes = data.get('yAxes', [])
     chart_type = data.get('chartType')
@@ -272,8 +867,52 @@ def apply_chart_filter():
     chart_filter_value = data.get('chartFilterValue')
     start_row = data.get('startRow', 0)
     end_row = data.get('endRow')
+    max_points = data.get('maxPoints')
     
-    if not filename or not sheet_name:
+    # Read only the columns the chart uses (parsed once, then served from the cache)
+    columns = chart_columns(x_axis, y_axes, filter_column, filter_value, chart_filter_column)
+    df = load_sheet(filepath, sheet_name, columns)
+    
+    # Apply row range, main filter and chart filter (indexed columns are looked up, not scanned)
+    filters = []
+    if filter_column and filter_value:
+        filters.append((filter_column, filter_value))
+    if chart_filter_column and chart_filter_value:
+        filters.append((chart_filter_column, chart_filter_value))
+    window = row_window(start_row, end_row)
+    
+    # Process data for chart, from the sheet's rollup when it covers the request
+    rolled_up = chart_from_rollup(filepath, sheet_name, df, window, filters, x_axis, y_axes, chart_type, max_points)
+    if rolled_up:
+        chart_data, row_count = rolled_up
+    else:
+        df, rows = select_rows(df, load_sheet_index(filepath, sheet_name), window, filters)
+        chart_data = process_chart_data(df, x_axis, y_axes, chart_type, max_points)
+        row_count = len(df)
+    downsampling = chart_data.pop('downsampling', None) if chart_data else None
+    
+    # For percentage stacked bar, ensure we always show 100% of the visible datasets
+    apply_visible_percentages(chart_data, chart_type, data.get('visibleDatasets'))
+    
+    response = {
+        'success': True,
+        'chartData': chart_data,
+        'filteredRowCount': row_count
+    }
+    
+    # Let the UI tell the user the chart shows a reduced set of points
+    if downsampling:
+        response['downsampling'] = downsampling
+    
+    return response
+
+@app.route('/apply_chart_filter_batch', methods=['POST'])
+def apply_chart_filter_batch():
+    data = request.json
+    filename = data.get('filename')
+    sheet_name = data.get('sheet')
+    
+    if not filename or not sheet_name or not data.get('chartFilterColumn'):
         return jsonify({
             'success': False, 
             'error': 'Missing required parameters'
@@ -283,63 +922,155 @@ def apply_chart_filter():
     if not os.path.exists(filepath):
         return jsonify({'success': False, 'error': 'File not found'})
     
+    # Don't block on a sheet that is still being ingested
+    job_id = ingest_jobs.pending_job(filepath, sheet_name)
+    if job_id:
+        return pending_response(job_id)
+    
     try:
-        # Read the sheet data with pandas
-        df = pd.read_excel(filepath, sheet_name=sheet_name)
-        
-        # Apply row range filter
-        if start_row > 0:
-            start_row = start_row - 2
-            if start_row < 0:
-                start_row = 0
-        
-        if end_row:
-            end_row = end_row - 1
-            df = df.iloc[start_row:end_row]
-        else:
-            df = df.iloc[start_row:]
-        
-        # Apply main filter if specified
-        if filter_column and filter_value:
-            df = df[df[filter_column] == filter_value]
-            
-        # Apply chart filter if specified
-        if chart_filter_column and chart_filter_value:
-            df = df[df[chart_filter_column] == chart_filter_value]
-        
-        # Process data for chart
-        chart_data = process_chart_data(df, x_axis, y_axes, chart_type)
-        
-        # Add information about visible datasets
-        visible_indices = data.get('visibleDatasets')
-        
-        # For percentage stacked bar, ensure we always show 100%
-        if chart_type == 'percentStackedBar' and chart_data and 'datasets' in chart_data:
-            # If we have information about which datasets are visible, use it
-            if visible_indices is not None:
-                chart_data['datasets'] = calculate_percentage_data(
-                    chart_data['datasets'], 
-                    chart_data['labels'],
-                    visible_indices
-                )
-            else:
-                # Otherwise recalculate with all datasets
-                chart_data['datasets'] = calculate_percentage_data(
-                    chart_data['datasets'], 
-                    chart_data['labels']
-                )
-        
-        return jsonify({
-            'success': True,
-            'chartData': chart_data,
-            'filteredRowCount': len(df)
-        })
-        
+        return jsonify(compute_chart(build_filtered_charts, filepath, data))
+    except ChartTimeout:
+        return timeout_response()
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+# Helper function computing the /apply_chart_filter_batch response (run by the chart workers)
+def build_filtered_charts(filepath, data):
+    sheet_name = data.get('sheet')
+    x_axis = data.get('xAxis')
+    y_axes = data.get('yAxes', [])
+    chart_type = data.get('chartType')
+    filter_column = data.get('filterColumn')
+    filter_value = data.get('filterValue')
+    chart_filter_column = data.get('chartFilterColumn')
+    start_row = data.get('startRow', 0)
+    end_row = data.get('endRow')
+    max_points = data.get('maxPoints')
+    
+    # Read only the columns the chart uses (parsed once, then served from the cache)
+    columns = chart_columns(x_axis, y_axes, filter_column, filter_value, chart_filter_column)
+    df = load_sheet(filepath, sheet_name, columns)
+    
+    # Apply row range and main filter (indexed columns are looked up, not scanned)
+    filters = [(filter_column, filter_value)] if filter_column and filter_value else []
+    df, rows = select_rows(df, load_sheet_index(filepath, sheet_name), row_window(start_row, end_row), filters)
+    
+    # Chart data for every chart filter value, computed in one pass
+    results = []
+    with metrics.stage('aggregate'):
+        for value, chart_data, row_count in process_chart_data_by_filter(df, x_axis, y_axes, chart_type, chart_filter_column, max_points):
+            downsampling = chart_data.pop('downsampling', None) if chart_data else None
+            apply_visible_percentages(chart_data, chart_type, data.get('visibleDatasets'))
+            result = {
+                'value': value,
+                'chartData': chart_data,
+                'filteredRowCount': row_count
+            }
+            if downsampling:
+                result['downsampling'] = downsampling
+            results.append(result)
+    
+    return {
+        'success': True,
+        'chartFilterColumn': chart_filter_column,
+        'results': results
+    }
+
+# Helper function to keep percentage stacked bars at 100% of the visible datasets
+@metrics.timed_stage('aggregate')
+def apply_visible_percentages(chart_data, chart_type, visible_indices=None):
+    if chart_type == 'percentStackedBar' and chart_data and 'datasets' in chart_data:
+        chart_data['datasets'] = calculate_percentage_data(
+            chart_data['datasets'], 
+            chart_data['labels'],
+            visible_indices
+        )
+
+# Helper function to process chart data for every value of the chart filter column.
+# Aggregated charts are summed once over (chart filter column, x-axis); each slice of
+# that result has one row per label, so process_chart_data turns it into exactly the
+# same chart as it would from the filtered raw rows. Yields (value, chart_data, row_count)
+# in order of first appearance, skipping empty values like the chart filter dropdown does.
+def process_chart_data_by_filter(df, x_axis, y_axes, chart_type, chart_filter_column, max_points=None):
+    if chart_type in ['scatter', 'bubble']:
+        # Coordinate-based charts plot raw rows, so just split the rows once
+        for value, group in df.groupby(chart_filter_column, sort=False, observed=True):
+            yield to_python_scalar(value), process_chart_data(group, x_axis, y_axes, chart_type, max_points), len(group)
+        return
+    
+    y_columns = list(dict.fromkeys(y_axis_info.get('column') for y_axis_info in y_axes))
+    
+    # Keep empty x-axis labels so charts that list them still do
+    keys = [chart_filter_column] if chart_filter_column == x_axis else [chart_filter_column, x_axis]
+    sums, sizes = rollup_cube.group_sums(df[df[chart_filter_column].notna()], keys, y_columns)
+    
+    # Split by chart filter value through its codes, which keep the values as they are
+    value_codes, values = pd.factorize(sums.index.get_level_values(0))
+    row_counts = sizes.groupby(value_codes, sort=False).sum()
+    
+    for code, group in sums.groupby(value_codes, sort=False):
+        if len(keys) > 1:
+            group = group.droplevel(0)
+        rollup = rollup_cube.keys_to_columns(group)
+        yield to_python_scalar(values[code]), process_chart_data(rollup, x_axis, y_axes, chart_type, max_points), int(row_counts[code])
+
+# Helper function to turn NumPy scalars (e.g. group keys) into JSON-friendly values
+def to_python_scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+# Helper function to convert the masked cells of a column to floats in one go.
+# Non-numeric columns go through float() per value (via NumPy), so text cells
+# raise the same "could not convert string to float" error as before.
+def column_as_float(series, mask):
+    values = series.to_numpy()
+    if values.dtype.kind not in 'biuf':
+        values = series.to_numpy(dtype=object)
+    return np.asarray(values[mask], dtype=float)
+
+# Helper function to choose which labels of a line chart to keep when downsampling.
+# series_values is a (series x labels) float matrix. Labels are split into equal buckets
+# and every series keeps its minimum and maximum in each bucket, so peaks and dips survive
+# for all series; the first and last labels are always kept. Returns sorted positions.
+def min_max_bucket_indices(series_values, max_points):
+    label_count = series_values.shape[1]
+    series_count = max(1, series_values.shape[0])
+    bucket_count = max(1, (max_points - 2) // (2 * series_count))
+    
+    missing = np.isnan(series_values)
+    low_values = np.where(missing, np.inf, series_values)
+    high_values = np.where(missing, -np.inf, series_values)
+    
+    keep = [0, label_count - 1]
+    edges = np.linspace(1, label_count - 1, bucket_count + 1).astype(int)
+    for start, end in zip(edges[:-1], edges[1:]):
+        if start < end:
+            keep.extend(start + np.argmin(low_values[:, start:end], axis=1))
+            keep.extend(start + np.argmax(high_values[:, start:end], axis=1))
+    
+    return np.unique(keep)
+
+# Helper function to thin out scatter/bubble points when downsampling. Points are binned
+# on a grid over their x/y range and the first point in each occupied cell is kept, so
+# the overall shape and outliers remain. Returns positions in original order.
+def grid_decimate_indices(x_values, y_values, max_points):
+    grid_size = max(1, int(np.sqrt(max_points)))
+    
+    def to_bins(values):
+        low, high = values.min(), values.max()
+        if high == low:
+            return np.zeros(len(values), dtype=np.int64)
+        return np.minimum(((values - low) / (high - low) * grid_size).astype(np.int64), grid_size - 1)
+    
+    cells = to_bins(x_values) * grid_size + to_bins(y_values)
+    _, first_in_cell = np.unique(cells, return_index=True)
+    return np.sort(first_in_cell)
+
 # Helper function to process chart data
-def process_chart_data(df, x_axis, y_axes, chart_type):
+# When max_points is given, line charts keep at most about that many labels and
+# scatter/bubble charts at most that many points per dataset; the counts before and
+# after are reported under chart_data['downsampling'].
+@metrics.timed_stage('aggregate')
+def process_chart_data(df, x_axis, y_axes, chart_type, max_points=None):
     # Common chart processing logic extracted from generate_chart
     if chart_type in ['pie', 'doughnut', 'polarArea']:
         # For single-series charts, only use the first y-axis
@@ -347,13 +1078,13 @@ def process_chart_data(df, x_axis, y_axes, chart_type):
             y_axis = y_axes[0]['column']
             
             # Group by x-axis and sum y-values
-            pie_data = df.groupby(x_axis)[y_axis].sum().reset_index()
+            pie_data = compact_dtypes.as_object(df, [y_axis]).groupby(x_axis, observed=True)[y_axis].sum().reset_index()
             
             chart_data = {
                 'labels': pie_data[x_axis].tolist(),
                 'datasets': [{
                     'label': y_axis,
-                    'data': pie_data[y_axis].tolist(),
+                    'data': pie_data[y_axis].to_numpy(),
                     'backgroundColor': generate_colors(len(pie_data)),
                     'borderColor': 'white',
                     'borderWidth': 1
@@ -367,6 +1098,8 @@ def process_chart_data(df, x_axis, y_axes, chart_type):
         chart_data = {
             'datasets': []
         }
+        original_points = 0
+        returned_points = 0
         
         for i, y_axis_info in enumerate(y_axes):
             y_axis = y_axis_info.get('column')
@@ -380,25 +1113,42 @@ def process_chart_data(df, x_axis, y_axes, chart_type):
                 'data': []
             }
             
-            # Create data points with x,y coordinates
-            for _, row in df.iterrows():
-                x_val = row[x_axis]
-                y_val = row[y_axis]
-                
-                if pd.notna(x_val) and pd.notna(y_val):
-                    if chart_type == 'bubble':
-                        # Use a third column for bubble size if available
-                        size = 10  # Default size
-                        if i + 1 < len(y_axes):
-                            size_col = y_axes[i+1].get('column')
-                            if size_col in row and pd.notna(row[size_col]):
-                                size = float(row[size_col])
-                        point = {'x': float(x_val), 'y': float(y_val), 'r': size}
-                    else:
-                        point = {'x': float(x_val), 'y': float(y_val)}
-                    dataset['data'].append(point)
+            # Create data points with x,y coordinates from the rows where both are present
+            mask = (df[x_axis].notna() & df[y_axis].notna()).to_numpy()
+            x_values = column_as_float(df[x_axis], mask)
+            y_values = column_as_float(df[y_axis], mask)
+            
+            if chart_type == 'bubble':
+                # Use the next y-axis column for bubble size if available, 10 otherwise
+                sizes = np.full(len(x_values), 10, dtype=object)
+                if i + 1 < len(y_axes):
+                    size_col = y_axes[i+1].get('column')
+                    if size_col in df.columns:
+                        size_present = df[size_col].notna().to_numpy()
+                        sizes[size_present[mask]] = column_as_float(df[size_col], mask & size_present).tolist()
+            
+            # Thin out large point clouds before building the point objects
+            original_points += len(x_values)
+            if max_points and len(x_values) > max_points:
+                keep = grid_decimate_indices(x_values, y_values, max_points)
+                x_values = x_values[keep]
+                y_values = y_values[keep]
+                if chart_type == 'bubble':
+                    sizes = sizes[keep]
+            returned_points += len(x_values)
+            
+            if chart_type == 'bubble':
+                dataset['data'] = [{'x': x, 'y': y, 'r': r} for x, y, r in zip(x_values.tolist(), y_values.tolist(), sizes.tolist())]
+            else:
+                dataset['data'] = [{'x': x, 'y': y} for x, y in zip(x_values.tolist(), y_values.tolist())]
             
             chart_data['datasets'].append(dataset)
+        
+        if returned_points < original_points:
+            chart_data['downsampling'] = {
+                'originalPoints': original_points,
+                'returnedPoints': returned_points
+            }
             
         return chart_data
     
@@ -408,47 +1158,39 @@ def process_chart_data(df, x_axis, y_axes, chart_type):
         if not y_axes:
             return {'labels': [], 'datasets': []}
             
-        pivoted_data = pd.pivot_table(df, values=y_axes[0]['column'], index=x_axis, aggfunc='sum')
-        
-        for i in range(1, len(y_axes)):
-            y_axis = y_axes[i]['column']
-            temp_pivot = pd.pivot_table(df, values=y_axis, index=x_axis, aggfunc='sum')
-            pivoted_data = pd.merge(pivoted_data, temp_pivot, left_index=True, right_index=True)
-        
-        pivoted_data = pivoted_data.reset_index()
+        # Sum every y-axis column per label in a single grouped aggregation
+        y_columns = list(dict.fromkeys(y_axis_info.get('column') for y_axis_info in y_axes))
+        pivoted_data = compact_dtypes.as_object(df, y_columns).groupby(x_axis, observed=True)[y_columns].sum()
         
         # Create chart data structure
         chart_data = {
-            'labels': pivoted_data[x_axis].tolist(),
+            'labels': pivoted_data.index.tolist(),
             'datasets': []
         }
         
+        # For percentage stacked bars, normalize each label's values to its total
+        if chart_type == 'percentStackedBar':
+            series_columns = [y_axis_info.get('column') for y_axis_info in y_axes]
+            magnitudes = np.abs(pivoted_data[series_columns].to_numpy(dtype=float))
+            
+            # Accumulate series by series so totals add up in the same order as before
+            totals = np.zeros(len(pivoted_data))
+            for column in magnitudes.T:
+                totals += np.nan_to_num(column)
+            
+            with np.errstate(divide='ignore', invalid='ignore'):
+                percentages = (magnitudes / totals[:, np.newaxis] * 100).astype(object)
+            percentages[totals <= 0] = 0
+        
         # For each y-axis, create a dataset
         for i, y_axis_info in enumerate(y_axes):
             y_axis = y_axis_info.get('column')
             color = y_axis_info.get('color', f'rgba(26, 69, 112, {0.8 if i == 0 else 0.6})')
             
-            values = pivoted_data[y_axis].tolist()
-            
-            # For percentage stacked bars, convert to percentages
             if chart_type == 'percentStackedBar':
-                # Calculate totals for each x-axis label
-                totals = [0] * len(pivoted_data)
-                for j, y_info in enumerate(y_axes):
-                    y_col = y_info.get('column')
-                    for k, val in enumerate(pivoted_data[y_col].tolist()):
-                        if not pd.isna(val):
-                            totals[k] += abs(val)
-                
-                # Convert to percentages
-                percent_values = []
-                for j, val in enumerate(values):
-                    if totals[j] > 0:
-                        percent_values.append((abs(val) / totals[j]) * 100)
-                    else:
-                        percent_values.append(0)
-                
-                values = percent_values
+                values = percentages[:, i].tolist()
+            else:
+                values = pivoted_data[y_axis].to_numpy()
             
             dataset = {
                 'label': y_axis,
@@ -473,24 +1215,32 @@ def process_chart_data(df, x_axis, y_axes, chart_type):
             'datasets': []
         }
         
+        # Sum every y-axis column per label in a single grouped aggregation, in label order.
+        # Labels with no group (e.g. empty x values) come back as NaN and are sent as None.
+        y_columns = list(dict.fromkeys(y_axis_info.get('column') for y_axis_info in y_axes))
+        grouped_data = compact_dtypes.as_object(df, y_columns).groupby(x_axis, observed=True)[y_columns].sum().reindex(chart_data['labels'])
+        
+        # Keep the labels holding each series' extremes when a line chart has too many
+        label_count = len(chart_data['labels'])
+        if chart_type == 'line' and max_points and label_count > max_points:
+            series_values = grouped_data[y_columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float).T
+            keep = min_max_bucket_indices(series_values, max_points)
+            grouped_data = grouped_data.iloc[keep]
+            chart_data['labels'] = [chart_data['labels'][k] for k in keep]
+            chart_data['downsampling'] = {
+                'originalPoints': label_count,
+                'returnedPoints': len(keep)
+            }
+        
         # Add datasets based on y-axes
         for i, y_axis_info in enumerate(y_axes):
             y_axis = y_axis_info.get('column')
             color = y_axis_info.get('color', f'rgba(26, 69, 112, {0.8 if i == 0 else 0.6})')
             
-            # Group by x-axis and sum y-values
-            grouped_data = df.groupby(x_axis)[y_axis].sum().reset_index()
-            
-            # Create a dataframe with all possible x-axis values to handle missing values
-            all_x = pd.DataFrame({x_axis: chart_data['labels']})
-            
-            # Don't fill NaN with 0, instead keep them as None for JSON
-            merged_data = pd.merge(all_x, grouped_data, on=x_axis, how='left')
-            
-            # Convert NaN to None for proper JSON serialization
+            # The array is serialized as is, with NaN sent as null
             dataset = {
                 'label': y_axis,
-                'data': [None if pd.isna(val) else val for val in merged_data[y_axis].tolist()],
+                'data': grouped_data[y_axis].to_numpy(),
                 'backgroundColor': color,
                 'borderColor': color,
                 'borderWidth': 1
@@ -528,443 +1278,30 @@ def download_chart_code():
     selected_filter = data.get('chartFilterValue', '')
     
     # Get original data for filtering
-    original_data = data.get('originalData', chart_data)
+    original_data = data.get('originalData')
     visible_datasets = data.get('visibleDatasets', [])
     
     if not chart_type or not chart_data:
         return jsonify({'success': False, 'error': 'Missing chart data'})
     
     try:
-        # Get current date
-        from datetime import datetime
-        current_date = datetime.now().strftime("%-m/%-d/%Y")
-        
-        # Format function needed for all charts
-        format_function = """
-        // Format number in Indian format (e.g., 1,00,000)
-        function formatIndianNumber(num) {
-            if (num === null || num === undefined || isNaN(num)) return '0';
-            
-            // Handle negative numbers
-            let isNegative = false;
-            if (num < 0) {
-                isNegative = true;
-                num = Math.abs(num);
-            }
-            
-            // Format number to handle different magnitudes properly
-            let formattedNumber;
-            
-            // For numbers less than 1,000, no special formatting needed
-            if (num < 1000) {
-                formattedNumber = num.toString();
-            } else {
-                // Convert to string and split at decimal point
-                const parts = num.toString().split('.');
-                let integerPart = parts[0];
-                
-                // First we get the last 3 digits
-                const lastThree = integerPart.substring(integerPart.length - 3);
-                // Then we get the remaining digits
-                const remaining = integerPart.substring(0, integerPart.length - 3);
-                
-                // Now we format the remaining digits with commas after every 2 digits
-                let formattedRemaining = '';
-                if (remaining) {
-                    formattedRemaining = remaining.replace(/\\B(?=(\\d{2})+(?!\\d))/g, ',');
-                }
-                
-                // Combine the parts
-                formattedNumber = formattedRemaining ? formattedRemaining + ',' + lastThree : lastThree;
-                
-                // Add decimal part if exists
-                if (parts.length > 1) {
-                    formattedNumber += '.' + parts[1];
-                }
-            }
-            
-            // Add negative sign if needed
-            if (isNegative) {
-                formattedNumber = '-' + formattedNumber;
-            }
-            
-            return formattedNumber;
-        }
-        """
-        
-        # Create extra_js with necessary functions
-        extra_js = format_function
-        
-        # Add percentage stacked bar chart specific functions
-        if chart_type == 'percentStackedBar':
-            percentage_code = """
-            // Store original data for percentage calculations
-            const originalData = JSON.parse(JSON.stringify(chartData));
-            
-            // Function to recalculate percentages when toggling legend items
-            function recalculatePercentages(chart) {
-                // Get indices of visible datasets
-                const visibleDatasets = [];
-                chart.data.datasets.forEach((dataset, index) => {
-                    if (!chart.getDatasetMeta(index).hidden) {
-                        visibleDatasets.push(index);
-                    }
-                });
-                
-                // Calculate totals for each data point using only visible datasets
-                const totals = Array(chart.data.labels.length).fill(0);
-                visibleDatasets.forEach(datasetIndex => {
-                    originalData.datasets[datasetIndex].data.forEach((value, index) => {
-                        totals[index] += Math.abs(parseFloat(value) || 0);
-                    });
-                });
-                
-                // Update percentages for visible datasets
-                chart.data.datasets.forEach((dataset, datasetIndex) => {
-                    if (!chart.getDatasetMeta(datasetIndex).hidden) {
-                        dataset.data = originalData.datasets[datasetIndex].data.map((value, index) => {
-                            return totals[index] ? (Math.abs(parseFloat(value) || 0) / totals[index]) * 100 : 0;
-                        });
-                    }
-                });
-                
-                chart.update();
-            }
-            """
-            extra_js += "\n" + percentage_code
-        
-        # Add filter functionality if filter column is provided
-        if filter_column and filter_values:
-            filter_js = """
-            // Function to filter chart data based on selected value
-            function filterChartData() {
-                const filterValue = document.getElementById('chartFilter').value;
-                const chart = window.myChart;
-                
-                if (!chart || !chart.data) return;
-                
-                // Store current dataset visibility
-                const visibility = [];
-                chart.data.datasets.forEach((dataset, index) => {
-                    visibility.push(!chart.getDatasetMeta(index).hidden);
-                });
-                
-                // Reset to full data or filter based on selection
-                if (!filterValue) {
-                    // Use complete data
-                    chart.data.labels = fullChartData.labels;
-                    chart.data.datasets.forEach((dataset, i) => {
-                        dataset.data = fullChartData.datasets[i].data;
-                    });
-                } else {
-                    // Get the selected filter values
-                    let selectedIndex = -1;
-                    
-                    // Find the index of the selected filter value
-                    for (let i = 0; i < fullChartData.labels.length; i++) {
-                        if (fullChartData.labels[i] === filterValue) {
-                            selectedIndex = i;
-                            break;
-                        }
-                    }
-                    
-                    if (selectedIndex !== -1) {
-                        // Filter to show only the selected value
-                        chart.data.labels = [fullChartData.labels[selectedIndex]];
-                        
-                        // Update each dataset
-                        chart.data.datasets.forEach((dataset, i) => {
-                            dataset.data = [fullChartData.datasets[i].data[selectedIndex]];
-                        });
-                    }
-                }
-                
-                // Restore dataset visibility
-                chart.data.datasets.forEach((dataset, index) => {
-                    chart.getDatasetMeta(index).hidden = !visibility[index];
-                });
-                
-                // For percentage stacked bar charts, recalculate percentages
-                if (chart.config.type === 'bar' && 
-                    chart.options.scales && 
-                    chart.options.scales.y && 
-                    chart.options.scales.y.stacked) {
-                    if (typeof recalculatePercentages === 'function') {
-                        recalculatePercentages(chart);
-                    }
-                } else {
-                    chart.update();
-                }
-            }
-            """
-            extra_js += "\n" + filter_js
-        
-        # Prepare HTML template
-        html_template = f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>{chart_title}</title>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <link href="https://fonts.googleapis.com/css?family=Lato" rel="stylesheet">
-    <style>
-        body {{ 
-            font-family: Lato, Arial, sans-serif; 
-            margin: 20px; 
-            background-color: #f5f5f5;
-        }}
-        .chart-container {{ 
-            max-width: 1000px; 
-            margin: 0 auto 20px auto; 
-            background-color: white;
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-            border-radius: 8px;
-            padding: 20px;
-        }}
-        .chart-title {{
-            text-align: center;
-            font-size: 20px;
-            font-weight: bold;
-            margin-bottom: 20px;
-            color: #2c3e50;
-        }}
-        .chart-filter-controls {{
-            display: flex;
-            align-items: center;
-            margin-bottom: 15px;
-            background-color: #f8f9fa;
-            padding: 8px;
-            border-radius: 4px;
-        }}
-        .chart-filter-group {{
-            display: flex;
-            align-items: center;
-        }}
-        .chart-filter-group label {{
-            margin-right: 10px;
-            font-size: 14px;
-            color: #444;
-        }}
-        .chart-filter-group select {{
-            padding: 6px 10px;
-            border: 1px solid #ddd;
-            border-radius: 4px;
-            font-size: 14px;
-            min-width: 200px;
-        }}
-        .chart-canvas-container {{
-            height: 500px;
-            width: 100%;
-        }}
-        .chart-footer {{
-            display: flex;
-            justify-content: space-between;
-            margin-top: 10px;
-            padding-top: 5px;
-            border-top: 1px solid #e9ecef;
-        }}
-        .chart-info {{
-            flex: 1;
-        }}
-        .chart-description {{
-            margin-top: 0;
-            padding: 2px;
-            font-size: 10px;
-        }}
-        .chart-additional-info {{
-            margin-top: 2px;
-            padding: 2px;
-            font-size: 10px;
-            color: #6c757d;
-        }}
-        .chart-date {{
-            font-size: 12px;
-            color: #6c757d;
-            margin-left: 15px;
-        }}
-        .custom-legend {{
-            display: flex;
-            flex-wrap: wrap;
-            gap: 8px;
-            padding: 10px;
-            margin-bottom: 10px;
-        }}
-        .legend-item {{
-            display: flex;
-            align-items: center;
-            gap: 4px;
-            padding: 4px 8px;
-            border-radius: 4px;
-            cursor: pointer;
-        }}
-        .hidden {{
-            display: none;
-        }}
-    </style>
-</head>
-<body>
-    <div class="chart-container">
-        <div class="chart-title">{chart_title}</div>
-        
-        {f'''
-        <div class="chart-filter-controls">
-            <div class="chart-filter-group">
-                <label for="chartFilter">Filter by {filter_column}:</label>
-                <select id="chartFilter" onchange="filterChartData()">
-                    <option value="">All Values</option>
-                    {' '.join([f'<option value="{val}"{" selected" if val == selected_filter else ""}>{val}</option>' for val in filter_values])}
-                </select>
-            </div>
-        </div>
-        ''' if filter_column and filter_values else ''}
-        
-        <div class="chart-canvas-container">
-            <canvas id="myChart"></canvas>
-        </div>
-        
-        <div class="chart-footer">
-            <div class="chart-info">
-                <div class="chart-description">{chart_description}</div>
-                <div class="chart-additional-info">{chart_additional_info}</div>
-            </div>
-            <div class="chart-date">{current_date}</div>
-        </div>
-    </div>
-    
-    <script>
-        // Initialize chart when the page loads
-        document.addEventListener('DOMContentLoaded', function() {{
-            const ctx = document.getElementById('myChart').getContext('2d');
-            
-            {extra_js}
-            
-            // Chart data (current filtered view)
-            const chartData = {json.dumps(chart_data, indent=2)};
-            
-            // Full chart data for filtering
-            const fullChartData = {json.dumps(original_data, indent=2)};
-            
-            // Chart options
-            const options = {json.dumps(chart_options, indent=2)};
-            
-            // Ensure tooltip callbacks are properly configured
-            if (!options.plugins) options.plugins = {{}};
-            if (!options.plugins.tooltip) options.plugins.tooltip = {{}};
-            if (!options.plugins.tooltip.callbacks) options.plugins.tooltip.callbacks = {{}};
-            
-            // Configure tooltips based on chart type
-            if ('{chart_type}' === 'percentStackedBar') {{
-                options.plugins.tooltip.callbacks.label = function(context) {{
-                    let label = context.dataset.label || '';
-                    if (label) {{
-                        label += ': ';
-                    }}
-                    if (context.parsed.y !== null) {{
-                        label += context.parsed.y.toFixed(1) + '%';
-                    }}
-                    return label;
-                }};
-            }} else if ('{chart_type}' === 'pie' || '{chart_type}' === 'doughnut' || '{chart_type}' === 'polarArea') {{
-                options.plugins.tooltip.callbacks.label = function(context) {{
-                    let label = context.label || '';
-                    let value = context.raw;
-                    if (label) {{
-                        label += ': ';
-                    }}
-                    label += formatIndianNumber(value);
-                    return label;
-                }};
-            }} else {{
-                options.plugins.tooltip.callbacks.label = function(context) {{
-                    let label = context.dataset.label || '';
-                    if (label) {{
-                        label += ': ';
-                    }}
-                    if (context.parsed.y !== null) {{
-                        label += formatIndianNumber(context.parsed.y);
-                    }}
-                    return label;
-                }};
-            }}
-            
-            // Remove vertical grid lines
-            if (!options.scales) options.scales = {{}};
-            if (!options.scales.x) options.scales.x = {{}};
-            if (!options.scales.x.grid) options.scales.x.grid = {{}};
-            options.scales.x.grid.display = false;
-            
-            // Create chart
-            window.myChart = new Chart(ctx, {{
-                type: '{chart_type if chart_type not in ["stackedBar", "percentStackedBar", "horizontalBar"] else "bar"}',
-                data: chartData,
-                options: options
-            }});
-            
-            // Create custom legend
-            const legendContainer = document.createElement('div');
-            legendContainer.className = 'custom-legend';
-            document.querySelector('.chart-canvas-container').insertBefore(legendContainer, myChart);
-            
-            // Create legend items with checkboxes
-            chartData.datasets.forEach((dataset, index) => {{
-                const legendItem = document.createElement('div');
-                legendItem.className = 'legend-item';
-                legendItem.style.backgroundColor = dataset.backgroundColor + '15';
-                legendItem.style.border = '1px solid ' + dataset.backgroundColor + '40';
-                
-                const checkbox = document.createElement('input');
-                checkbox.type = 'checkbox';
-                checkbox.checked = {str(visible_datasets).lower() == '[]' or f"index in {str(visible_datasets)}" if chart_type == 'percentStackedBar' else 'true'};
-                checkbox.style.cursor = 'pointer';
-                checkbox.style.marginRight = '6px';
-                
-                const label = document.createElement('span');
-                label.textContent = dataset.label || `Dataset ${{index + 1}}`;
-                label.style.color = dataset.backgroundColor;
-                label.style.cursor = 'pointer';
-                
-                legendItem.appendChild(checkbox);
-                legendItem.appendChild(label);
-                
-                // Add click handlers
-                [checkbox, label, legendItem].forEach(element => {{
-                    element.addEventListener('click', (e) => {{
-                        if (e.target !== checkbox) {{
-                            checkbox.checked = !checkbox.checked;
-                        }}
-                        
-                        const meta = window.myChart.getDatasetMeta(index);
-                        meta.hidden = !checkbox.checked;
-                        
-                        // Update legend item appearance
-                        legendItem.style.backgroundColor = checkbox.checked ? 
-                            dataset.backgroundColor + '15' : 
-                            '#f5f5f5';
-                        label.style.color = checkbox.checked ? 
-                            dataset.backgroundColor : 
-                            '#999';
-                        
-                        // If it's a percentage stacked bar chart, recalculate percentages
-                        if ('{chart_type}' === 'percentStackedBar') {{
-                            recalculatePercentages(window.myChart);
-                        }} else {{
-                            window.myChart.update();
-                        }}
-                    }});
-                }});
-                
-                legendContainer.appendChild(legendItem);
-            }});
-            
-            // Initialize percentage stacked bar chart if needed
-            {f"setTimeout(function() {{ recalculatePercentages(window.myChart); }}, 50);" if chart_type == 'percentStackedBar' else ""}
-        }});
-    </script>
-</body>
-</html>"""
+        html_page = render_chart_page(
+            chart_type, chart_data, chart_options,
+            full_data=original_data,
+            title=chart_title,
+            description=chart_description,
+            additional_info=chart_additional_info,
+            filter_column=filter_column,
+            filter_values=filter_values,
+            selected_filter=selected_filter,
+            visible_datasets=visible_datasets,
+            compress=data.get('compressData', 'auto'),
+            compress_min_bytes=app.config['EXPORT_COMPRESS_MIN_BYTES']
+        )
         
         # Create a BytesIO object
         html_bytes = io.BytesIO()
-        html_bytes.write(html_template.encode('utf-8'))
+        html_bytes.write(html_page.encode('utf-8'))
         html_bytes.seek(0)
         
         return send_file(
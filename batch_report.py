@@ -0,0 +1,270 @@
+# Batch chart reports over a directory of workbooks, without the web UI.
+#
+# Every workbook gets the charts of a spec, built by the same functions the
+# chart routes use (build_chart, or build_filtered_chart for specs with a
+# chartFilterValue), so each JSON output is byte for byte what /generate_chart
+# or /apply_chart_filter would return for that workbook. Workbooks are spread
+# over a pool of worker processes; all charts of one workbook run in the same
+# worker, so its sheet is parsed once.
+#
+# A spec is a JSON object with the fields /generate_chart accepts (sheet,
+# xAxis, yAxes, chartType, filterColumn/filterValue, chartFilterColumn/
+# chartFilterValue, startRow/endRow, maxPoints), plus an optional "name" and
+# "title", or a list of such objects for several charts per workbook. Without a
+# sheet, each workbook's first sheet is used. The same fields can be given as
+# options instead of a spec file.
+#
+# Outputs go to OUTPUT/<workbook>/<chart name>.<format> for each of --formats:
+#
+#   json   the route's response body
+#   html   the standalone page /download_chart_code exports
+#   svg    the image /render_chart returns (png too, with cairosvg installed)
+#
+# plus OUTPUT/summary.json with every chart's status, timings and files.
+# With --store, workbooks are converted to the columnar format next to them on
+# first use (as uploads are), which makes later runs over them much faster.
+#
+# Usage:
+#   python batch_report.py reports/2024 --spec spec.json --output out
+#   python batch_report.py reports/2024 --x-axis Region --y-axis Sales --chart-type bar --formats json,svg
+
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Charts are computed in this process (or its pool workers), never handed to
+# ingestion or chart worker pools of the app's own
+os.environ['INGEST_WORKERS'] = '0'
+os.environ['CHART_WORKERS'] = '0'
+
+FORMATS = ('json', 'html', 'svg', 'png')
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xls')
+
+
+def find_workbooks(directory, recursive=False):
+    pattern = os.path.join(directory, '**', '*') if recursive else os.path.join(directory, '*')
+    paths = []
+    for path in glob.glob(pattern, recursive=recursive):
+        name = os.path.basename(path)
+        # Skip Excel's lock files (~$Book.xlsx)
+        if name.lower().endswith(WORKBOOK_EXTENSIONS) and not name.startswith('~$') and os.path.isfile(path):
+            paths.append(os.path.abspath(path))
+    return sorted(paths)
+
+
+def load_specs(args):
+    if args.spec:
+        with open(args.spec) as f:
+            specs = json.load(f)
+        specs = specs if isinstance(specs, list) else [specs]
+    else:
+        spec = {
+            'sheet': args.sheet,
+            'xAxis': args.x_axis,
+            'yAxes': [{'column': column} for column in args.y_axis or []],
+            'chartType': args.chart_type,
+            'filterColumn': args.filter_column,
+            'filterValue': args.filter_value,
+            'chartFilterColumn': args.chart_filter_column,
+            'chartFilterValue': args.chart_filter_value,
+            'startRow': args.start_row,
+            'endRow': args.end_row,
+            'maxPoints': args.max_points
+        }
+        specs = [{key: value for key, value in spec.items() if value is not None}]
+
+    names = set()
+    for i, spec in enumerate(specs):
+        if not isinstance(spec, dict) or not spec.get('xAxis') or not spec.get('yAxes') or not spec.get('chartType'):
+            raise SystemExit(f'Chart spec {i + 1} needs xAxis, yAxes and chartType')
+        name = output_name(str(spec.get('name') or f"{spec['chartType']}-{i + 1}"))
+        if name in names:
+            raise SystemExit(f"Chart spec {i + 1}: the name '{name}' is used twice")
+        names.add(name)
+        spec['name'] = name
+    return specs
+
+
+def output_name(name):
+    from werkzeug.utils import secure_filename
+    return secure_filename(name) or 'chart'
+
+
+# Build every chart of a spec for one workbook and write its outputs. Runs in a
+# pool worker; returns the workbook's summary entry.
+def report_workbook(filepath, specs, output_dir, formats, store):
+    import app as charts
+    import metrics
+    import columnar_store
+    import upload_store
+
+    started = time.perf_counter()
+    entry = {'workbook': filepath, 'charts': [], 'bytes': os.path.getsize(filepath)}
+    target = os.path.join(output_dir, output_name(os.path.basename(filepath)))
+    os.makedirs(target, exist_ok=True)
+
+    try:
+        if store and columnar_store.load_manifest(filepath) is None:
+            columnar_store.convert_workbook(filepath)
+        first_sheet = None
+
+        for spec in specs:
+            data = {key: value for key, value in spec.items() if key not in ('name', 'title')}
+            if not data.get('sheet'):
+                if first_sheet is None:
+                    first_sheet = upload_store.read_sheet_names(filepath)[0]
+                data['sheet'] = first_sheet
+
+            chart = {'name': spec['name'], 'sheet': data['sheet'], 'files': []}
+            chart_started = time.perf_counter()
+            try:
+                result, stages, rows = metrics.run_timed(charts.chart_builder(data), filepath, data)
+            except Exception as e:
+                result, stages, rows = {'success': False, 'error': str(e)}, {}, 0
+            chart.update(success=result['success'], rows=rows, stages=stages)
+            if not result['success']:
+                chart['error'] = result['error']
+
+            for image_format in formats:
+                path = os.path.join(target, f"{spec['name']}.{image_format}")
+                if image_format == 'json':
+                    body = charts.app.json.dumps(result).encode('utf-8') + b'\n'
+                elif not result['success']:
+                    continue
+                elif image_format == 'html':
+                    body = chart_page(charts, spec, data, result).encode('utf-8')
+                else:
+                    image_spec = {**data, 'format': image_format, 'title': spec.get('title')}
+                    body = charts.render_chart_image(result['chartData'], image_spec)
+                with open(path, 'wb') as f:
+                    f.write(body)
+                chart['files'].append(path)
+
+            chart['seconds'] = round(time.perf_counter() - chart_started, 4)
+            entry['charts'].append(chart)
+    except Exception as e:
+        entry['error'] = str(e)
+    finally:
+        # Keep each worker's memory to the workbook it is on
+        charts.sheet_cache.invalidate(filepath)
+
+    entry['seconds'] = round(time.perf_counter() - started, 4)
+    return entry
+
+
+def chart_page(charts, spec, data, result):
+    return charts.render_chart_page(
+        data['chartType'], result['chartData'], {},
+        title=spec.get('title') or spec['name'],
+        filter_column=data.get('chartFilterColumn', ''),
+        filter_values=result.get('chartFilterValues', []),
+        selected_filter=data.get('chartFilterValue', ''),
+        compress_min_bytes=charts.app.config['EXPORT_COMPRESS_MIN_BYTES']
+    )
+
+
+def print_progress(done, total, entry):
+    charts = entry['charts']
+    failed = sum(not chart['success'] for chart in charts)
+    status = f"error: {entry['error']}" if entry.get('error') else f'{len(charts) - failed} ok' + (f', {failed} failed' if failed else '')
+    print(f"[{done}/{total}] {os.path.basename(entry['workbook'])}: {status} ({entry['seconds']:.2f}s)", file=sys.stderr)
+
+
+def summarize(entries, elapsed):
+    charts = [chart for entry in entries for chart in entry['charts']]
+    stages = {}
+    for chart in charts:
+        for name, seconds in chart['stages'].items():
+            stages[name] = stages.get(name, 0.0) + seconds
+    megabytes = sum(entry['bytes'] for entry in entries) / (1024 * 1024)
+    return {
+        'workbooks': len(entries),
+        'workbookErrors': sum(1 for entry in entries if entry.get('error')),
+        'charts': len(charts),
+        'chartsFailed': sum(1 for chart in charts if not chart['success']),
+        'rows': sum(chart['rows'] for chart in charts),
+        'seconds': round(elapsed, 3),
+        'workbooksPerSecond': round(len(entries) / elapsed, 3) if elapsed else None,
+        'chartsPerSecond': round(len(charts) / elapsed, 3) if elapsed else None,
+        'megabytesPerSecond': round(megabytes / elapsed, 3) if elapsed else None,
+        'stageSeconds': {name: round(seconds, 3) for name, seconds in stages.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build chart reports for every workbook in a directory')
+    parser.add_argument('directory', help='Directory of .xlsx/.xls workbooks')
+    parser.add_argument('--output', default='reports', help='Where the outputs go (default: reports)')
+    parser.add_argument('--spec', help='JSON file with the chart spec (or a list of them)')
+    parser.add_argument('--sheet')
+    parser.add_argument('--x-axis')
+    parser.add_argument('--y-axis', action='append', help='A y-axis column (repeat for several)')
+    parser.add_argument('--chart-type')
+    parser.add_argument('--filter-column')
+    parser.add_argument('--filter-value')
+    parser.add_argument('--chart-filter-column')
+    parser.add_argument('--chart-filter-value')
+    parser.add_argument('--start-row', type=int)
+    parser.add_argument('--end-row', type=int)
+    parser.add_argument('--max-points', type=int)
+    parser.add_argument('--formats', default='json', help=f"Comma-separated outputs: {', '.join(FORMATS)} (default: json)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes (0 runs in this process)')
+    parser.add_argument('--recursive', action='store_true', help='Include workbooks in subdirectories')
+    parser.add_argument('--store', action='store_true',
+                        help='Convert workbooks to the columnar format next to them for faster later runs')
+    args = parser.parse_args()
+
+    formats = [name.strip() for name in args.formats.split(',') if name.strip()]
+    unknown = [name for name in formats if name not in FORMATS]
+    if unknown:
+        raise SystemExit(f"Unknown output format(s): {', '.join(unknown)}")
+    specs = load_specs(args)
+    workbooks = find_workbooks(args.directory, args.recursive)
+    if not workbooks:
+        raise SystemExit(f'No workbooks found in {args.directory}')
+    output_dir = os.path.abspath(args.output)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # The app creates its upload folder relative to the working directory, so
+    # run from the repository (every path above is absolute by now)
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    if 'png' in formats:
+        import chart_image
+        if 'png' not in chart_image.available_formats():
+            raise SystemExit('PNG output needs cairosvg installed')
+
+    print(f'{len(workbooks)} workbook(s), {len(specs)} chart(s) each, {max(args.workers, 1)} worker(s)', file=sys.stderr)
+    started = time.perf_counter()
+    entries = []
+    if args.workers <= 0:
+        for filepath in workbooks:
+            entries.append(report_workbook(filepath, specs, output_dir, formats, args.store))
+            print_progress(len(entries), len(workbooks), entries[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(report_workbook, filepath, specs, output_dir, formats, args.store) for filepath in workbooks]
+            for future in as_completed(futures):
+                entries.append(future.result())
+                print_progress(len(entries), len(workbooks), entries[-1])
+    elapsed = time.perf_counter() - started
+
+    entries.sort(key=lambda entry: entry['workbook'])
+    summary = summarize(entries, elapsed)
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump({'summary': summary, 'specs': specs, 'workbooks': entries}, f, indent=2, default=str)
+
+    print(f"{summary['workbooks']} workbooks, {summary['charts']} charts ({summary['chartsFailed']} failed) in "
+          f"{summary['seconds']:.2f}s: {summary['workbooksPerSecond']} workbooks/s, {summary['chartsPerSecond']} charts/s, "
+          f"{summary['megabytesPerSecond']} MB/s, {summary['rows']} rows", file=sys.stderr)
+    sys.exit(1 if summary['chartsFailed'] or summary['workbookErrors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# Benchmark of the compact column types of stored sheets (see compact_dtypes).
+#
+# Converts a workbook (a synthetic one unless --workbook is given) and reports
+# for every sheet the bytes its columns hold as parsed and as stored, the memory
+# a process holds once it has loaded the sheet (memory-mapped columns left out,
+# since the page cache shares them) with the earlier layout (an object array per
+# text column, int64 integers) and with compact types, and how long each takes
+# to load. Every chart type over every text and integer x-axis must come out the
+# same from both.
+#
+# Usage:
+#   python benchmarks/bench_compact_dtypes.py
+#   python benchmarks/bench_compact_dtypes.py --rows 200000 --cardinality 50
+#   python benchmarks/bench_compact_dtypes.py --workbook uploads/report.xlsx
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import columnar_store
+import compact_dtypes
+from app import app, process_chart_data
+from workbooks import make_workbook
+
+CHART_TYPES = ['bar', 'line', 'pie', 'radar', 'stackedBar', 'percentStackedBar', 'scatter']
+
+
+# The sheet's columns saved the way they were before compacting
+def write_plain(df, directory):
+    paths = []
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i].to_numpy()
+        path = os.path.join(directory, f'col_{i}.npy')
+        np.save(path, values, allow_pickle=values.dtype == object)
+        paths.append(path)
+    return paths
+
+
+def read_plain(paths, columns):
+    arrays = {}
+    for i, path in enumerate(paths):
+        try:
+            arrays[i] = np.load(path, mmap_mode='r')
+        except ValueError:
+            arrays[i] = np.load(path, allow_pickle=True)
+    df = pd.DataFrame(arrays, copy=False)
+    df.columns = columns
+    return df
+
+
+# Seconds to load the sheet and the bytes it keeps allocated in this process
+def measure_load(load, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        df = load()
+        held = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del df
+    return best, held
+
+
+def chart_json(df, x_axis, y_columns, chart_type):
+    try:
+        chart_data = process_chart_data(df, x_axis, [{'column': col} for col in y_columns], chart_type)
+    except Exception as e:
+        chart_data = {'error': str(e)}
+    return app.json.dumps(chart_data)
+
+
+def same_charts(compacted, restored):
+    x_axes = [col for col, dtype in compacted.dtypes.items() if isinstance(dtype, pd.CategoricalDtype) or dtype.kind == 'i']
+    y_columns = [col for col, dtype in restored.dtypes.items() if dtype.kind in 'if'][:3]
+    if not y_columns:
+        return True
+    for x_axis in x_axes:
+        for chart_type in CHART_TYPES:
+            if chart_json(compacted, x_axis, y_columns, chart_type) != chart_json(restored, x_axis, y_columns, chart_type):
+                return False
+    return True
+
+
+def megabytes(nbytes):
+    return nbytes / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory of stored sheets before and after compacting their column types')
+    parser.add_argument('--workbook', help='Workbook to convert (default: a synthetic one)')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--value-columns', type=int, default=4)
+    parser.add_argument('--cardinality', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-compact-')
+    try:
+        filepath = os.path.join(directory, 'workbook.xlsx')
+        if args.workbook:
+            shutil.copyfile(args.workbook, filepath)
+        else:
+            print(f'Writing workbook ({args.rows} rows) ...')
+            make_workbook(filepath, args.rows, args.value_columns, args.cardinality)
+        columnar_store.convert_workbook(filepath)
+        manifest = columnar_store.load_manifest(filepath)
+
+        print(f"{'sheet':<24} {'rows':>8} {'parsed MB':>10} {'stored MB':>10} {'held MB':>15} {'load ms':>15} {'same':>5}")
+        for sheet_name in manifest['sheets']:
+            sheet_path, types = columnar_store.stored_sheet(filepath, sheet_name)
+            compacted = columnar_store.read_sheet_dir(sheet_path)
+            restored = compact_dtypes.restore(compacted, types)
+            plain_dir = os.path.join(directory, f"plain-{manifest['sheets'][sheet_name]}")
+            os.makedirs(plain_dir)
+            paths = write_plain(restored, plain_dir)
+
+            plain_seconds, plain_held = measure_load(lambda: read_plain(paths, restored.columns), args.repeat)
+            compact_seconds, compact_held = measure_load(lambda: columnar_store.read_sheet_dir(sheet_path), args.repeat)
+            memory = manifest['memory'][sheet_name]
+            print(f"{str(sheet_name)[:24]:<24} {len(compacted):>8} {megabytes(memory['before']):>10.2f} "
+                  f"{megabytes(memory['after']):>10.2f} {megabytes(plain_held):>6.2f} -> {megabytes(compact_held):>5.2f} "
+                  f"{plain_seconds * 1000:>6.1f} -> {compact_seconds * 1000:>5.1f} {str(same_charts(compacted, restored)):>5}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Benchmark of the Excel reader engines (see excel_reader.py).
+#
+# Reads every sheet of each workbook with each available engine and reports the
+# best time of --repeat reads, the speedup over openpyxl (pd.read_excel's
+# default) and whether the frames match openpyxl's exactly: same columns,
+# dtypes, and the same type and value in every cell. By default the workbooks
+# in uploads/ are read; --rows adds a synthetic workbook (see workbooks.py).
+#
+# Usage:
+#   python benchmarks/bench_excel_readers.py
+#   python benchmarks/bench_excel_readers.py --rows 50000 --repeat 3
+#   python benchmarks/bench_excel_readers.py path/to/workbook.xlsx --engines stream openpyxl
+
+import os
+import sys
+import glob
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import excel_reader
+from workbooks import make_workbook, workbook_name
+
+
+def frame_signature(df):
+    return (
+        [repr(column) for column in df.columns],
+        [str(dtype) for dtype in df.dtypes],
+        [[(type(value).__name__, repr(value)) for value in df.iloc[:, i].tolist()] for i in range(df.shape[1])]
+    )
+
+
+def same_frames(expected, actual):
+    if list(expected) != list(actual):
+        return False
+    return all(frame_signature(expected[name]) == frame_signature(actual[name]) for name in expected)
+
+
+def time_engine(path, engine, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sheets = excel_reader.read_with_engine(path, None, engine)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, sheets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the Excel reader engines')
+    parser.add_argument('paths', nargs='*', help='Workbooks to read (default: uploads/*.xlsx)')
+    parser.add_argument('--engines', nargs='+', default=excel_reader.available_engines(),
+                        help=f"Engines to compare (available: {', '.join(excel_reader.available_engines())})")
+    parser.add_argument('--repeat', type=int, default=3, help='Reads per engine and workbook')
+    parser.add_argument('--rows', type=int, default=0, help='Also read a synthetic workbook with this many rows')
+    parser.add_argument('--value-columns', type=int, default=4)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'excel-charts-bench'),
+                        help='Where generated workbooks are kept between runs')
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(ROOT, 'uploads', '*.xlsx')))
+    if args.rows:
+        os.makedirs(args.data_dir, exist_ok=True)
+        workbook = os.path.join(args.data_dir, workbook_name(args.rows, args.value_columns, 20, 0.05, 0))
+        if not os.path.exists(workbook):
+            print(f'Writing {workbook} ...')
+        paths.append(make_workbook(workbook, args.rows, args.value_columns))
+    if not paths:
+        raise SystemExit('No workbooks to read')
+
+    unknown = [engine for engine in args.engines if engine not in excel_reader.available_engines()]
+    if unknown:
+        raise SystemExit(f"Not available here: {', '.join(unknown)}")
+
+    print(f"{'workbook':<48} {'engine':<10} {'best s':>8} {'speedup':>8} {'identical':>10}")
+    for path in paths:
+        baseline, expected = time_engine(path, 'openpyxl', args.repeat)
+        for engine in args.engines:
+            if engine == 'openpyxl':
+                elapsed, identical = baseline, True
+            else:
+                elapsed, sheets = time_engine(path, engine, args.repeat)
+                identical = same_frames(expected, sheets)
+            name = os.path.basename(path)
+            name = name if len(name) <= 48 else name[:45] + '...'
+            print(f'{name:<48} {engine:<10} {elapsed:>8.3f} {baseline / elapsed:>7.2f}x {str(identical):>10}')
+
+
+if __name__ == '__main__':
+    main()
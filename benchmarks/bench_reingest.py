@@ -0,0 +1,135 @@
+# Benchmark of incremental re-ingestion (see columnar_store.appended_sheet).
+#
+# Writes a synthetic workbook and a later version of it with --added rows
+# appended, converts the first, then converts the second both in full and as a
+# new version of the first. Reports both times and checks that the stored
+# sheets, column indexes and rollups come out the same either way.
+#
+# Usage:
+#   python benchmarks/bench_reingest.py
+#   python benchmarks/bench_reingest.py --rows 100000 --added 500 --repeat 3
+
+import os
+import sys
+import glob
+import time
+import shutil
+import pickle
+import argparse
+import tempfile
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import columnar_store
+import column_index
+import rollup_cube
+from workbooks import make_frame
+from bench_excel_readers import frame_signature
+
+
+def write_versions(directory, rows, added, value_columns):
+    df = make_frame(rows + added, value_columns)
+    # An integer column, so some rollups have sums that carry over
+    df['Units'] = np.random.default_rng(1).integers(0, 100, len(df))
+    paths = []
+    for name, count in (('v1.xlsx', rows), ('v2.xlsx', rows + added)):
+        path = os.path.join(directory, name)
+        df.iloc[:count].to_excel(path, sheet_name='Data', index=False)
+        paths.append(path)
+    return paths
+
+
+# Build rollups like the ones charts ask for: over every numeric column (float
+# sums, built again for a new version) and over Units alone (carried over)
+def build_rollups(filepath, sheet_name):
+    sheet_path, types = columnar_store.stored_sheet(filepath, sheet_name)
+    df = columnar_store.read_sheet_dir(sheet_path)
+    for keys in (['Region'], ['Category', 'Region']):
+        numeric = [col for col in rollup_cube.numeric_columns(types) if col not in keys]
+        rollup_cube.load_or_build(sheet_path, keys, lambda: df, numeric)
+    rollup_cube.load_or_build(sheet_path, ['Product'], lambda: df[['Product', 'Units']], ['Units'])
+
+
+def stored_state(filepath):
+    manifest = columnar_store.load_manifest(filepath)
+    state = {}
+    for sheet_name, sheet_dir in manifest['sheets'].items():
+        sheet_path = os.path.join(columnar_store.sidecar_dir(filepath), sheet_dir)
+        df = columnar_store.read_sheet_dir(sheet_path)
+        indexes = column_index.read_indexes(sheet_path, df.columns)
+        rollups = {}
+        for path in glob.glob(os.path.join(sheet_path, rollup_cube.ROLLUP_DIR, '*.pkl')):
+            with open(path, 'rb') as f:
+                rollups[os.path.basename(path)] = pickle.load(f)
+        state[sheet_name] = (df, indexes, rollups)
+    return state
+
+
+def same_rollups(expected, actual):
+    if not expected.available or not actual.available:
+        return expected.available == actual.available
+    return (expected.sums.equals(actual.sums) and expected.sums.index.equals(actual.sums.index) and
+            expected.sizes.equals(actual.sizes) and list(expected.sums.dtypes) == list(actual.sums.dtypes))
+
+
+def same_state(full, incremental):
+    for sheet_name, (df, indexes, rollups) in full.items():
+        inc_df, inc_indexes, inc_rollups = incremental[sheet_name]
+        if frame_signature(df) != frame_signature(inc_df) or set(indexes) != set(inc_indexes):
+            return False
+        for column, index in indexes.items():
+            other = inc_indexes[column]
+            if not (index.uniques.equals(other.uniques) and
+                    all(np.array_equal(getattr(index, part), getattr(other, part)) for part in ('codes', 'order', 'offsets'))):
+                return False
+        if any(not same_rollups(rollups[name], rollup) for name, rollup in inc_rollups.items()):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare full and incremental conversion of an appended-to workbook')
+    parser.add_argument('--rows', type=int, default=20000, help='Rows in the first version')
+    parser.add_argument('--added', type=int, default=1000, help='Rows the second version adds')
+    parser.add_argument('--value-columns', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench-reingest-')
+    try:
+        print(f'Writing workbooks ({args.rows} + {args.added} rows) ...')
+        first, second = write_versions(directory, args.rows, args.added, args.value_columns)
+        columnar_store.convert_workbook(first)
+        build_rollups(first, 'Data')
+
+        timings = {}
+        states = {}
+        for label, previous in (('full', None), ('incremental', first)):
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                columnar_store.convert_workbook(second, previous)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = best
+            if previous is None:
+                # The rollups a full conversion would build on first use, to
+                # compare the carried ones with
+                build_rollups(second, 'Data')
+            states[label] = stored_state(second)
+
+        print(f"{'conversion':<14} {'best s':>8} {'speedup':>8}")
+        for label, elapsed in timings.items():
+            print(f"{label:<14} {elapsed:>8.3f} {timings['full'] / elapsed:>7.2f}x")
+        carried = len(states['incremental']['Data'][2])
+        print(f"rollups carried over: {carried} of {len(states['full']['Data'][2])} (float sums are built again on first use)")
+        print(f"identical: {same_state(states['full'], states['incremental'])}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+# Benchmark of the HTTP routes on a synthetic workbook.
+#
+# Generates a workbook (see workbooks.py), then drives every route through the
+# Flask test client: /upload, /get_sheet_data, /column_values, /filter_data,
+# /generate_chart for every chart type, /apply_chart_filter,
+# /apply_chart_filter_batch, /render_chart and /download_chart_code. For each it records the
+# first (cold) call, latency percentiles over the warm calls after it, the
+# payload size (raw and gzipped), and the process's peak RSS so far.
+#
+# Uploads are ingested in the request (INGEST_WORKERS=0), charts are computed in
+# it (CHART_WORKERS=0) and the response caches are off unless --response-cache is
+# given, so repeated calls measure the work rather than the cache. Each upload
+# goes to a fresh folder so it is never deduplicated.
+#
+# Usage:
+#   python benchmarks/bench_routes.py --rows 50000 --output before.json
+#   python benchmarks/bench_routes.py --rows 50000 --output after.json
+#   python benchmarks/bench_routes.py --compare before.json after.json
+
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from workbooks import make_workbook, workbook_name, value_column_names
+
+CHART_TYPES = ['bar', 'line', 'pie', 'doughnut', 'polarArea', 'radar', 'stackedBar', 'percentStackedBar', 'scatter', 'bubble']
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(timings):
+    warm = timings[1:] or timings
+    ms = np.array(warm) * 1000
+    return {
+        'n': len(timings),
+        'firstMs': round(timings[0] * 1000, 3),
+        'p50Ms': round(float(np.percentile(ms, 50)), 3),
+        'p90Ms': round(float(np.percentile(ms, 90)), 3),
+        'p99Ms': round(float(np.percentile(ms, 99)), 3),
+        'meanMs': round(float(ms.mean()), 3),
+        'minMs': round(float(ms.min()), 3)
+    }
+
+
+class RouteBenchmark:
+    def __init__(self, client, repeat):
+        self.client = client
+        self.repeat = repeat
+        self.results = {}
+
+    # Time request(i) repeat times; every response must be a success
+    def measure(self, name, request, repeat=None):
+        timings = []
+        for i in range(repeat or self.repeat):
+            start = time.perf_counter()
+            response = request(i)
+            timings.append(time.perf_counter() - start)
+
+            if response.status_code != 200:
+                raise SystemExit(f'{name}: HTTP {response.status_code}')
+            if response.mimetype == 'application/json' and not response.get_json().get('success'):
+                raise SystemExit(f"{name}: {response.get_json().get('error')}")
+
+        body = response.get_data()
+        self.results[name] = {
+            **summarize(timings),
+            'bytes': len(body),
+            'gzipBytes': len(gzip.compress(body, compresslevel=6)),
+            'peakRssMb': peak_rss_mb()
+        }
+        print_row(name, self.results[name])
+        return response
+
+    def post(self, name, url, payload, repeat=None):
+        return self.measure(name, lambda i: self.client.post(url, json=payload), repeat)
+
+
+def print_header():
+    print(f"{'route':<38} {'n':>4} {'first ms':>10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'bytes':>10} {'gzip':>9} {'rss MB':>8}")
+
+
+def print_row(name, result):
+    print(f"{name:<38} {result['n']:>4} {result['firstMs']:>10.2f} {result['p50Ms']:>9.2f} {result['p90Ms']:>9.2f} "
+          f"{result['p99Ms']:>9.2f} {result['bytes']:>10} {result['gzipBytes']:>9} {result['peakRssMb']:>8.1f}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    os.makedirs(args.data_dir, exist_ok=True)
+    name = workbook_name(args.rows, args.value_columns, args.cardinality, args.null_density, args.seed)
+    workbook = os.path.join(args.data_dir, name)
+    if not os.path.exists(workbook):
+        print(f'Writing {workbook} ...')
+    make_workbook(workbook, args.rows, args.value_columns, args.cardinality, args.null_density, args.seed)
+    with open(workbook, 'rb') as f:
+        workbook_bytes = f.read()
+
+    os.environ['INGEST_WORKERS'] = '0'
+    os.environ['CHART_WORKERS'] = '0'
+    if not args.response_cache:
+        os.environ['RESPONSE_CACHE_MAX_BYTES'] = '0'
+        os.environ['IMAGE_CACHE_MAX_BYTES'] = '0'
+
+    workdir = tempfile.mkdtemp(prefix='bench-routes-')
+    os.chdir(workdir)
+    from app import app
+
+    client = app.test_client()
+    bench = RouteBenchmark(client, args.repeat)
+    values = value_column_names(args.value_columns)
+    print_header()
+
+    # Each upload goes to an empty folder, so it is stored and converted every time
+    def upload(i):
+        app.config['UPLOAD_FOLDER'] = os.path.join(workdir, f'uploads-{i}')
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        return client.post('/upload', data={'excelFile': (io.BytesIO(workbook_bytes), name)},
+                           content_type='multipart/form-data')
+
+    uploaded = bench.measure('upload', upload, args.upload_repeat).get_json()
+    sheet = {'filename': uploaded['filename'], 'sheet': uploaded['sheets'][0]}
+
+    bench.post('get_sheet_data (first 100 rows)', '/get_sheet_data', {**sheet, 'offset': 0, 'limit': 100})
+    bench.post('get_sheet_data (all rows)', '/get_sheet_data', sheet)
+    bench.post('column_values', '/column_values', {**sheet, 'column': 'Category'})
+    bench.post('filter_data', '/filter_data', {**sheet, 'filterColumn': 'Region', 'filterValue': 'Region 0001'})
+
+    chart = {
+        **sheet,
+        'xAxis': 'Category',
+        'yAxes': [{'column': column} for column in values[:2]],
+        'chartFilterColumn': 'Region',
+        'maxPoints': 2000
+    }
+    charts = {}
+    for chart_type in CHART_TYPES:
+        payload = {**chart, 'chartType': chart_type}
+        if chart_type in ['scatter', 'bubble']:
+            payload.update(xAxis=values[0], yAxes=[{'column': column} for column in values[1:3]])
+        charts[chart_type] = bench.post(f'generate_chart ({chart_type})', '/generate_chart', payload).get_json()
+
+    bench.post('generate_chart (bar, filtered)', '/generate_chart',
+               {**chart, 'chartType': 'bar', 'filterColumn': 'Year', 'filterValue': 2010})
+    bench.post('apply_chart_filter (bar)', '/apply_chart_filter',
+               {**chart, 'chartType': 'bar', 'chartFilterValue': 'Region 0001'})
+    bench.post('apply_chart_filter (percentStackedBar)', '/apply_chart_filter',
+               {**chart, 'chartType': 'percentStackedBar', 'chartFilterValue': 'Region 0001', 'visibleDatasets': [0]})
+    bench.post('apply_chart_filter_batch (bar)', '/apply_chart_filter_batch', {**chart, 'chartType': 'bar'})
+    bench.post('render_chart (bar, svg)', '/render_chart', {**chart, 'chartType': 'bar', 'format': 'svg'})
+
+    bar = charts['bar']
+    bench.post('download_chart_code (bar)', '/download_chart_code', {
+        'chartType': 'bar',
+        'chartData': bar['chartData'],
+        'chartOptions': {},
+        'chartTitle': 'Benchmark',
+        'chartFilterColumn': 'Region',
+        'chartFilterValues': bar['chartFilterValues']
+    })
+    first = {'labels': bar['chartData']['labels'][:1],
+             'datasets': [{**dataset, 'data': dataset['data'][:1]} for dataset in bar['chartData']['datasets']]}
+    bench.post('download_chart_code (filtered view)', '/download_chart_code', {
+        'chartType': 'bar',
+        'chartData': first,
+        'originalData': bar['chartData'],
+        'chartOptions': {},
+        'chartTitle': 'Benchmark',
+        'chartFilterColumn': 'Category',
+        'chartFilterValues': bar['chartData']['labels'],
+        'chartFilterValue': bar['chartData']['labels'][0]
+    })
+
+    report = {
+        'meta': {
+            'rows': args.rows,
+            'valueColumns': args.value_columns,
+            'cardinality': args.cardinality,
+            'nullDensity': args.null_density,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'responseCache': args.response_cache,
+            'workbookBytes': len(workbook_bytes),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': bench.results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.output}')
+
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Compare two result files by p50 latency and payload size. A route regressed if
+# it got slower by more than threshold (a fraction) and by at least min_delta_ms.
+def compare(base_path, new_path, threshold, min_delta_ms):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    params = ['rows', 'valueColumns', 'cardinality', 'nullDensity', 'seed', 'responseCache']
+    changed = [p for p in params if base['meta'].get(p) != new['meta'].get(p)]
+    if changed:
+        print(f"Warning: the runs used different parameters ({', '.join(changed)})")
+    print(f"base: {base['meta'].get('revision')} {base['meta']['time']}   new: {new['meta'].get('revision')} {new['meta']['time']}")
+
+    print(f"{'route':<38} {'base p50':>10} {'new p50':>10} {'change':>8} {'base p90':>10} {'new p90':>10} {'bytes':>14} {'rss MB':>14}")
+    regressions = []
+    for name, old in base['results'].items():
+        result = new['results'].get(name)
+        if result is None:
+            print(f'{name:<38} (missing from new run)')
+            continue
+
+        change = (result['p50Ms'] - old['p50Ms']) / old['p50Ms'] if old['p50Ms'] else 0.0
+        flag = ''
+        if change > threshold and result['p50Ms'] - old['p50Ms'] >= min_delta_ms:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold and old['p50Ms'] - result['p50Ms'] >= min_delta_ms:
+            flag = '  faster'
+        size = f"{old['bytes']}->{result['bytes']}" if old['bytes'] != result['bytes'] else str(result['bytes'])
+        rss = f"{old['peakRssMb']:.0f}->{result['peakRssMb']:.0f}"
+        print(f"{name:<38} {old['p50Ms']:>10.2f} {result['p50Ms']:>10.2f} {change:>+8.0%} "
+              f"{old['p90Ms']:>10.2f} {result['p90Ms']:>10.2f} {size:>14} {rss:>14}{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app routes on a synthetic workbook')
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--value-columns', type=int, default=4)
+    parser.add_argument('--cardinality', type=int, default=20)
+    parser.add_argument('--null-density', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=10, help='Calls per route')
+    parser.add_argument('--upload-repeat', type=int, default=3, help='Calls of /upload')
+    parser.add_argument('--response-cache', action='store_true', help='Leave the chart response and image caches on')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'excel-charts-bench'),
+                        help='Where generated workbooks are kept between runs')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help='Compare two result files instead of running')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Slowdown (fraction of the base p50) reported as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help='Ignore slowdowns smaller than this')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold, args.min_delta_ms))
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
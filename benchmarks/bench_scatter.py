@@ -0,0 +1,98 @@
+# Benchmark for the scatter/bubble branch of process_chart_data.
+#
+# Compares the current vectorized implementation against the previous
+# row-by-row (iterrows) version on synthetic data, and checks that both
+# produce the same points.
+#
+# Usage:
+#   python benchmarks/bench_scatter.py
+#   python benchmarks/bench_scatter.py --sizes 10000 100000 --skip-legacy-above 100000
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import process_chart_data
+
+
+# The scatter/bubble point construction as it was before vectorization
+def legacy_points(df, x_axis, y_axes, chart_type):
+    datasets = []
+    for i, y_axis_info in enumerate(y_axes):
+        y_axis = y_axis_info.get('column')
+        points = []
+        for _, row in df.iterrows():
+            x_val = row[x_axis]
+            y_val = row[y_axis]
+            if pd.notna(x_val) and pd.notna(y_val):
+                if chart_type == 'bubble':
+                    size = 10
+                    if i + 1 < len(y_axes):
+                        size_col = y_axes[i+1].get('column')
+                        if size_col in row and pd.notna(row[size_col]):
+                            size = float(row[size_col])
+                    points.append({'x': float(x_val), 'y': float(y_val), 'r': size})
+                else:
+                    points.append({'x': float(x_val), 'y': float(y_val)})
+        datasets.append(points)
+    return datasets
+
+
+def make_frame(rows, null_density=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'x': rng.normal(0, 100, rows),
+        'y1': rng.normal(50, 10, rows),
+        'y2': rng.integers(0, 1000, rows).astype(float),
+        'label': rng.choice(['a', 'b', 'c'], rows)
+    })
+    for col in ['x', 'y1', 'y2']:
+        df.loc[rng.random(rows) < null_density, col] = np.nan
+    return df
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scatter/bubble chart processing')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy-above', type=int, default=None,
+                        help='Only time the iterrows version up to this many rows')
+    args = parser.parse_args()
+
+    y_axes = [{'column': 'y1'}, {'column': 'y2'}]
+
+    print(f"{'chart':<8} {'rows':>10} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9}")
+    for rows in args.sizes:
+        df = make_frame(rows)
+        for chart_type in ['scatter', 'bubble']:
+            new_time, chart_data = best_of(lambda: process_chart_data(df, 'x', y_axes, chart_type), args.repeat)
+
+            if args.skip_legacy_above is not None and rows > args.skip_legacy_above:
+                print(f"{chart_type:<8} {rows:>10} {'-':>12} {new_time:>15.4f} {'-':>9}")
+                continue
+
+            # iterrows is slow enough that a single run is representative
+            old_time, legacy = best_of(lambda: legacy_points(df, 'x', y_axes, chart_type), 1)
+            if legacy != [dataset['data'] for dataset in chart_data['datasets']]:
+                raise SystemExit(f'Output mismatch for {chart_type} at {rows} rows')
+
+            print(f"{chart_type:<8} {rows:>10} {old_time:>12.4f} {new_time:>15.4f} {old_time / new_time:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
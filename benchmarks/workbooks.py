@@ -0,0 +1,74 @@
+# Synthetic workbooks for the benchmarks.
+#
+# A sheet has a few low-cardinality text columns (Region, Category, Product),
+# an integer Year, a date column and any number of float value columns, with a
+# share of empty cells in the text and value columns. The same parameters and
+# seed always give the same workbook.
+#
+# Usage:
+#   python benchmarks/workbooks.py out.xlsx --rows 100000 --value-columns 8 --cardinality 50
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+KEY_COLUMNS = ['Region', 'Category', 'Product']
+
+
+def make_frame(rows, value_columns=4, cardinality=20, null_density=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i, name in enumerate(KEY_COLUMNS):
+        # Product has more distinct values than the other keys
+        distinct = cardinality * (4 if i == len(KEY_COLUMNS) - 1 else 1)
+        labels = np.array([f'{name} {j:04d}' for j in range(distinct)], dtype=object)
+        data[name] = labels[rng.integers(0, distinct, rows)]
+    data['Year'] = rng.integers(2000, 2025, rows)
+    data['Date'] = pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 1500, rows), unit='D')
+    for i in range(value_columns):
+        data[f'Value {i + 1}'] = rng.normal(1000, 250, rows).round(2)
+
+    df = pd.DataFrame(data)
+    for name in KEY_COLUMNS + [f'Value {i + 1}' for i in range(value_columns)]:
+        df.loc[rng.random(rows) < null_density, name] = None
+    return df
+
+
+def value_column_names(value_columns):
+    return [f'Value {i + 1}' for i in range(value_columns)]
+
+
+# Write the workbook once and reuse it while its parameters don't change
+def make_workbook(path, rows, value_columns=4, cardinality=20, null_density=0.05, seed=0, sheet_name='Data'):
+    if os.path.exists(path):
+        return path
+    df = make_frame(rows, value_columns, cardinality, null_density, seed)
+    staging = f'{path}.tmp.xlsx'
+    df.to_excel(staging, sheet_name=sheet_name, index=False)
+    os.replace(staging, path)
+    return path
+
+
+def workbook_name(rows, value_columns, cardinality, null_density, seed):
+    return f'synthetic-{rows}r-{value_columns}v-{cardinality}c-{int(null_density * 100)}n-{seed}s.xlsx'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic workbook')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--value-columns', type=int, default=4)
+    parser.add_argument('--cardinality', type=int, default=20)
+    parser.add_argument('--null-density', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        os.remove(args.path)
+    make_workbook(args.path, args.rows, args.value_columns, args.cardinality, args.null_density, args.seed)
+    print(args.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,616 @@
+import re
+import gzip
+import html
+import base64
+from datetime import datetime
+from functools import lru_cache
+from serializers import dumps
+
+# Standalone HTML export of a chart (/download_chart_code).
+#
+# The page's CSS and scripts never change, so they are assembled once per chart
+# type (and filter on/off) into a CompiledTemplate: literal text split around a
+# few {{ name }} slots, rendered with a single join. Only the title, footer
+# and data are filled in per export.
+#
+# The data goes in once, compactly, as a payload the page derives both of its
+# views from:
+#
+#   {"data": <full chart data>}                        the view is the full data
+#   {"data": <full chart data>, "viewIndices": [5]}    the view is those labels
+#   {"data": <full chart data>, "view": <chart data>}  an unrelated view
+#
+# plus "filterValues" and "selectedFilter" (an index) when the page has a filter.
+#
+# Large payloads can be embedded as base64 of their gzip instead, which the page
+# unpacks with the browser's DecompressionStream.
+
+PLACEHOLDER = re.compile(r'\{\{ (\w+) \}\}')
+GZIP_LEVEL = 6
+
+
+class CompiledTemplate:
+    def __init__(self, text):
+        parts = PLACEHOLDER.split(text)
+        self.literals = parts[0::2]
+        self.names = parts[1::2]
+
+    def render(self, **values):
+        out = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            out.append(values[name])
+            out.append(literal)
+        return ''.join(out)
+
+
+STYLE = """
+        body {
+            font-family: Lato, Arial, sans-serif;
+            margin: 20px;
+            background-color: #f5f5f5;
+        }
+        .chart-container {
+            max-width: 1000px;
+            margin: 0 auto 20px auto;
+            background-color: white;
+            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
+            border-radius: 8px;
+            padding: 20px;
+        }
+        .chart-title {
+            text-align: center;
+            font-size: 20px;
+            font-weight: bold;
+            margin-bottom: 20px;
+            color: #2c3e50;
+        }
+        .chart-filter-controls {
+            display: flex;
+            align-items: center;
+            margin-bottom: 15px;
+            background-color: #f8f9fa;
+            padding: 8px;
+            border-radius: 4px;
+        }
+        .chart-filter-group {
+            display: flex;
+            align-items: center;
+        }
+        .chart-filter-group label {
+            margin-right: 10px;
+            font-size: 14px;
+            color: #444;
+        }
+        .chart-filter-group select {
+            padding: 6px 10px;
+            border: 1px solid #ddd;
+            border-radius: 4px;
+            font-size: 14px;
+            min-width: 200px;
+        }
+        .chart-canvas-container {
+            height: 500px;
+            width: 100%;
+        }
+        .chart-footer {
+            display: flex;
+            justify-content: space-between;
+            margin-top: 10px;
+            padding-top: 5px;
+            border-top: 1px solid #e9ecef;
+        }
+        .chart-info {
+            flex: 1;
+        }
+        .chart-description {
+            margin-top: 0;
+            padding: 2px;
+            font-size: 10px;
+        }
+        .chart-additional-info {
+            margin-top: 2px;
+            padding: 2px;
+            font-size: 10px;
+            color: #6c757d;
+        }
+        .chart-date {
+            font-size: 12px;
+            color: #6c757d;
+            margin-left: 15px;
+        }
+        .custom-legend {
+            display: flex;
+            flex-wrap: wrap;
+            gap: 8px;
+            padding: 10px;
+            margin-bottom: 10px;
+        }
+        .legend-item {
+            display: flex;
+            align-items: center;
+            gap: 4px;
+            padding: 4px 8px;
+            border-radius: 4px;
+            cursor: pointer;
+        }
+        .hidden {
+            display: none;
+        }
+"""
+
+FORMAT_JS = r"""
+            // Format number in Indian format (e.g., 1,00,000)
+            function formatIndianNumber(num) {
+                if (num === null || num === undefined || isNaN(num)) return '0';
+
+                // Handle negative numbers
+                let isNegative = false;
+                if (num < 0) {
+                    isNegative = true;
+                    num = Math.abs(num);
+                }
+
+                let formattedNumber;
+
+                // For numbers less than 1,000, no special formatting needed
+                if (num < 1000) {
+                    formattedNumber = num.toString();
+                } else {
+                    // Split at the decimal point, keep the last 3 integer digits
+                    // and put commas after every 2 digits before them
+                    const parts = num.toString().split('.');
+                    const integerPart = parts[0];
+                    const lastThree = integerPart.substring(integerPart.length - 3);
+                    const remaining = integerPart.substring(0, integerPart.length - 3);
+
+                    let formattedRemaining = '';
+                    if (remaining) {
+                        formattedRemaining = remaining.replace(/\B(?=(\d{2})+(?!\d))/g, ',');
+                    }
+
+                    formattedNumber = formattedRemaining ? formattedRemaining + ',' + lastThree : lastThree;
+                    if (parts.length > 1) {
+                        formattedNumber += '.' + parts[1];
+                    }
+                }
+
+                if (isNegative) {
+                    formattedNumber = '-' + formattedNumber;
+                }
+
+                return formattedNumber;
+            }
+"""
+
+# Unpacks the data payload into the two views the page works with
+PAYLOAD_JS = """
+            // Copy of the full data for the chart, or just the labels in indices
+            function deriveView(full, indices) {
+                if (!indices) return JSON.parse(JSON.stringify(full));
+                const view = JSON.parse(JSON.stringify({
+                    ...full,
+                    labels: [],
+                    datasets: full.datasets.map(dataset => ({...dataset, data: []}))
+                }));
+                view.labels = indices.map(i => full.labels[i]);
+                view.datasets.forEach((dataset, d) => {
+                    dataset.data = indices.map(i => full.datasets[d].data[i]);
+                });
+                return view;
+            }
+"""
+
+DECOMPRESS_JS = """
+            // Payload embedded as base64 of its gzip
+            async function decodePayload(encoded) {
+                const bytes = Uint8Array.from(atob(encoded), c => c.charCodeAt(0));
+                const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+                return JSON.parse(await new Response(stream).text());
+            }
+"""
+
+PERCENTAGE_JS = """
+            // Store original data for percentage calculations
+            const originalData = JSON.parse(JSON.stringify(chartData));
+
+            // Function to recalculate percentages when toggling legend items
+            function recalculatePercentages(chart) {
+                // Get indices of visible datasets
+                const visibleDatasets = [];
+                chart.data.datasets.forEach((dataset, index) => {
+                    if (!chart.getDatasetMeta(index).hidden) {
+                        visibleDatasets.push(index);
+                    }
+                });
+
+                // Calculate totals for each data point using only visible datasets
+                const totals = Array(chart.data.labels.length).fill(0);
+                visibleDatasets.forEach(datasetIndex => {
+                    originalData.datasets[datasetIndex].data.forEach((value, index) => {
+                        totals[index] += Math.abs(parseFloat(value) || 0);
+                    });
+                });
+
+                // Update percentages for visible datasets
+                chart.data.datasets.forEach((dataset, datasetIndex) => {
+                    if (!chart.getDatasetMeta(datasetIndex).hidden) {
+                        dataset.data = originalData.datasets[datasetIndex].data.map((value, index) => {
+                            return totals[index] ? (Math.abs(parseFloat(value) || 0) / totals[index]) * 100 : 0;
+                        });
+                    }
+                });
+
+                chart.update();
+            }
+"""
+
+FILTER_JS = """
+            // Add the filter's values (payload.filterValues) to its select
+            function fillFilterOptions(values, selectedIndex) {
+                const select = document.getElementById('chartFilter');
+                values.forEach((value, i) => {
+                    select.add(new Option(value, value, false, i === selectedIndex));
+                });
+            }
+
+            // Function to filter chart data based on selected value
+            function filterChartData() {
+                const filterValue = document.getElementById('chartFilter').value;
+                const chart = window.myChart;
+
+                if (!chart || !chart.data) return;
+
+                // Store current dataset visibility
+                const visibility = [];
+                chart.data.datasets.forEach((dataset, index) => {
+                    visibility.push(!chart.getDatasetMeta(index).hidden);
+                });
+
+                // Reset to full data or filter based on selection
+                if (!filterValue) {
+                    chart.data.labels = fullChartData.labels;
+                    chart.data.datasets.forEach((dataset, i) => {
+                        dataset.data = fullChartData.datasets[i].data;
+                    });
+                } else {
+                    // Show only the first label matching the selected value
+                    const selectedIndex = fullChartData.labels.findIndex(label => String(label) === filterValue);
+                    if (selectedIndex !== -1) {
+                        chart.data.labels = [fullChartData.labels[selectedIndex]];
+                        chart.data.datasets.forEach((dataset, i) => {
+                            dataset.data = [fullChartData.datasets[i].data[selectedIndex]];
+                        });
+                    }
+                }
+
+                // Restore dataset visibility
+                chart.data.datasets.forEach((dataset, index) => {
+                    chart.getDatasetMeta(index).hidden = !visibility[index];
+                });
+
+                // For percentage stacked bar charts, recalculate percentages
+                if (typeof recalculatePercentages === 'function') {
+                    recalculatePercentages(chart);
+                } else {
+                    chart.update();
+                }
+            }
+            // The select's onchange handler looks it up globally
+            window.filterChartData = filterChartData;
+"""
+
+PERCENT_TOOLTIP_JS = """
+            options.plugins.tooltip.callbacks.label = function(context) {
+                let label = context.dataset.label || '';
+                if (label) {
+                    label += ': ';
+                }
+                if (context.parsed.y !== null) {
+                    label += context.parsed.y.toFixed(1) + '%';
+                }
+                return label;
+            };
+"""
+
+SLICE_TOOLTIP_JS = """
+            options.plugins.tooltip.callbacks.label = function(context) {
+                let label = context.label || '';
+                if (label) {
+                    label += ': ';
+                }
+                label += formatIndianNumber(context.raw);
+                return label;
+            };
+"""
+
+VALUE_TOOLTIP_JS = """
+            options.plugins.tooltip.callbacks.label = function(context) {
+                let label = context.dataset.label || '';
+                if (label) {
+                    label += ': ';
+                }
+                if (context.parsed.y !== null) {
+                    label += formatIndianNumber(context.parsed.y);
+                }
+                return label;
+            };
+"""
+
+LEGEND_JS = """
+            // Create custom legend
+            const legendContainer = document.createElement('div');
+            legendContainer.className = 'custom-legend';
+            document.querySelector('.chart-canvas-container').insertBefore(legendContainer, document.getElementById('myChart'));
+
+            // Create legend items with checkboxes
+            chartData.datasets.forEach((dataset, index) => {
+                const legendItem = document.createElement('div');
+                legendItem.className = 'legend-item';
+                legendItem.style.backgroundColor = dataset.backgroundColor + '15';
+                legendItem.style.border = '1px solid ' + dataset.backgroundColor + '40';
+
+                const checkbox = document.createElement('input');
+                checkbox.type = 'checkbox';
+                checkbox.checked = {{ legend_checked }};
+                checkbox.style.cursor = 'pointer';
+                checkbox.style.marginRight = '6px';
+
+                const label = document.createElement('span');
+                label.textContent = dataset.label || `Dataset ${index + 1}`;
+                label.style.color = dataset.backgroundColor;
+                label.style.cursor = 'pointer';
+
+                legendItem.appendChild(checkbox);
+                legendItem.appendChild(label);
+
+                // Add click handlers
+                [checkbox, label, legendItem].forEach(element => {
+                    element.addEventListener('click', (e) => {
+                        if (e.target !== checkbox) {
+                            checkbox.checked = !checkbox.checked;
+                        }
+
+                        const meta = window.myChart.getDatasetMeta(index);
+                        meta.hidden = !checkbox.checked;
+
+                        // Update legend item appearance
+                        legendItem.style.backgroundColor = checkbox.checked ?
+                            dataset.backgroundColor + '15' :
+                            '#f5f5f5';
+                        label.style.color = checkbox.checked ?
+                            dataset.backgroundColor :
+                            '#999';
+
+                        {{ legend_update }}
+                    });
+                });
+
+                legendContainer.appendChild(legendItem);
+            });
+"""
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>{{ title }}</title>
+    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+    <link href="https://fonts.googleapis.com/css?family=Lato" rel="stylesheet">
+    <style>{{ style }}    </style>
+</head>
+<body>
+    <div class="chart-container">
+        <div class="chart-title">{{ title }}</div>
+        {{ filter_controls }}
+        <div class="chart-canvas-container">
+            <canvas id="myChart"></canvas>
+        </div>
+
+        <div class="chart-footer">
+            <div class="chart-info">
+                <div class="chart-description">{{ description }}</div>
+                <div class="chart-additional-info">{{ additional_info }}</div>
+            </div>
+            <div class="chart-date">{{ date }}</div>
+        </div>
+    </div>
+
+    <script>
+        // Initialize chart when the page loads
+        document.addEventListener('DOMContentLoaded', async function() {
+            const ctx = document.getElementById('myChart').getContext('2d');
+            {{ functions_js }}
+            // Chart data: the full data, and the current view derived from it
+            const payload = {{ payload }};
+            const fullChartData = payload.data;
+            const chartData = payload.view || deriveView(fullChartData, payload.viewIndices);
+            {{ filter_init_js }}{{ chart_js }}
+            // Chart options
+            const options = {{ options }};
+
+            // Ensure tooltip callbacks are properly configured
+            if (!options.plugins) options.plugins = {};
+            if (!options.plugins.tooltip) options.plugins.tooltip = {};
+            if (!options.plugins.tooltip.callbacks) options.plugins.tooltip.callbacks = {};
+            {{ tooltip_js }}
+            // Remove vertical grid lines
+            if (!options.scales) options.scales = {};
+            if (!options.scales.x) options.scales.x = {};
+            if (!options.scales.x.grid) options.scales.x.grid = {};
+            options.scales.x.grid.display = false;
+
+            // Create chart
+            window.myChart = new Chart(ctx, {
+                type: {{ chart_kind }},
+                data: chartData,
+                options: options
+            });
+            {{ legend_js }}{{ init_js }}
+        });
+    </script>
+</body>
+</html>"""
+
+FILTER_CONTROLS = """
+        <div class="chart-filter-controls">
+            <div class="chart-filter-group">
+                <label for="chartFilter">Filter by {{ column }}:</label>
+                <select id="chartFilter" onchange="filterChartData()">
+                    <option value="">All Values</option>
+                </select>
+            </div>
+        </div>
+        """
+
+FILTER_CONTROLS_TEMPLATE = CompiledTemplate(FILTER_CONTROLS)
+
+# Slots of the page that are filled in per export
+EXPORT_SLOTS = ['title', 'filter_controls', 'description', 'additional_info', 'date', 'payload', 'options']
+
+
+# The page for a chart type with everything static filled in. Only the
+# per-export slots (EXPORT_SLOTS and the legend's initial state) are left.
+@lru_cache(maxsize=64)
+def page_template(chart_type, with_filter, compressed):
+    functions_js = FORMAT_JS + PAYLOAD_JS
+    if compressed:
+        functions_js += DECOMPRESS_JS
+    filter_init_js = ''
+    if with_filter:
+        functions_js += FILTER_JS
+        filter_init_js = 'fillFilterOptions(payload.filterValues, payload.selectedFilter);\n'
+
+    if chart_type == 'percentStackedBar':
+        tooltip_js = PERCENT_TOOLTIP_JS
+        legend_update = 'recalculatePercentages(window.myChart);'
+        init_js = """
+            // Initialize percentage stacked bar chart
+            setTimeout(function() { recalculatePercentages(window.myChart); }, 50);
+"""
+        chart_js = PERCENTAGE_JS
+    else:
+        tooltip_js = SLICE_TOOLTIP_JS if chart_type in ['pie', 'doughnut', 'polarArea'] else VALUE_TOOLTIP_JS
+        legend_update = 'window.myChart.update();'
+        init_js = ''
+        chart_js = ''
+
+    chart_kind = 'bar' if chart_type in ['stackedBar', 'percentStackedBar', 'horizontalBar'] else chart_type
+    legend_js = LEGEND_JS.replace('{{ legend_update }}', legend_update)
+
+    # Fill the static slots now and keep the rest as slots
+    page = CompiledTemplate(PAGE).render(
+        style=STYLE,
+        functions_js=functions_js,
+        filter_init_js=filter_init_js,
+        chart_js=chart_js,
+        tooltip_js=tooltip_js,
+        chart_kind=script_json(chart_kind),
+        legend_js=legend_js,
+        init_js=init_js,
+        **{name: '{{ %s }}' % name for name in EXPORT_SLOTS}
+    )
+    return CompiledTemplate(page)
+
+
+# JSON that is safe inside a <script> element
+def script_json(value):
+    return dumps(value).replace('</', '<\\/')
+
+
+# First index of every label, or None if they can't be keys
+def label_positions(labels):
+    positions = {}
+    try:
+        for i, label in enumerate(labels):
+            positions.setdefault(label, i)
+    except TypeError:
+        return None
+    return positions
+
+
+# Indices of the full data's labels that make up the view, if the view is just
+# a selection of them with the same datasets
+def view_indices(chart_data, full_data):
+    if not isinstance(chart_data, dict) or not isinstance(full_data, dict):
+        return None
+    if set(chart_data) != set(full_data) or any(chart_data[key] != full_data[key] for key in chart_data if key not in ('labels', 'datasets')):
+        return None
+
+    labels, datasets = chart_data.get('labels'), chart_data.get('datasets')
+    full_labels, full_datasets = full_data.get('labels'), full_data.get('datasets')
+    if not all(isinstance(value, list) for value in (labels, datasets, full_labels, full_datasets)) or len(datasets) != len(full_datasets):
+        return None
+
+    positions = label_positions(full_labels)
+    if positions is None:
+        return None
+    try:
+        indices = [positions[label] for label in labels]
+    except (KeyError, TypeError):
+        return None
+
+    for dataset, full in zip(datasets, full_datasets):
+        if not isinstance(dataset, dict) or not isinstance(full, dict) or set(dataset) != set(full):
+            return None
+        if any(dataset[key] != full[key] for key in dataset if key != 'data'):
+            return None
+        values, full_values = dataset.get('data'), full.get('data')
+        if not isinstance(values, list) or not isinstance(full_values, list):
+            return None
+        if any(i >= len(full_values) for i in indices) or values != [full_values[i] for i in indices]:
+            return None
+    return indices
+
+
+# The single data payload embedded in the page (see the top of the file)
+def compact_payload(chart_data, full_data=None):
+    if full_data is None or full_data == chart_data:
+        return {'data': chart_data}
+    indices = view_indices(chart_data, full_data)
+    if indices is not None:
+        return {'data': full_data, 'viewIndices': indices}
+    return {'data': full_data, 'view': chart_data}
+
+
+# The payload as a script expression: a JSON literal, or a call unpacking its
+# gzip when compress is True, or 'auto' and the JSON is at least compress_min_bytes
+def payload_expression(payload, compress='auto', compress_min_bytes=512 * 1024):
+    text = script_json(payload)
+    if compress == 'auto':
+        compress = len(text) >= compress_min_bytes
+    if not compress:
+        return text, False
+    encoded = base64.b64encode(gzip.compress(text.encode('utf-8'), compresslevel=GZIP_LEVEL)).decode('ascii')
+    return f'await decodePayload("{encoded}")', True
+
+
+def render_chart_page(chart_type, chart_data, chart_options, full_data=None, title='Excel Data Chart',
+                      description='source', additional_info='comment', filter_column='', filter_values=None,
+                      selected_filter='', visible_datasets=None, compress='auto', compress_min_bytes=512 * 1024):
+    payload = compact_payload(chart_data, full_data)
+
+    # The filter's options are added by the page from the payload
+    with_filter = bool(filter_column and filter_values)
+    filter_controls = ''
+    if with_filter:
+        payload['filterValues'] = filter_values
+        payload['selectedFilter'] = next((i for i, value in enumerate(filter_values) if value == selected_filter), -1)
+        filter_controls = FILTER_CONTROLS_TEMPLATE.render(column=html.escape(str(filter_column)))
+
+    if chart_type == 'percentStackedBar' and visible_datasets:
+        legend_checked = f'{dumps([int(i) for i in visible_datasets])}.includes(index)'
+    else:
+        legend_checked = 'true'
+
+    payload, compressed = payload_expression(payload, compress, compress_min_bytes)
+    template = page_template(chart_type, with_filter, compressed)
+    return template.render(
+        title=html.escape(str(title)),
+        filter_controls=filter_controls,
+        description=html.escape(str(description)),
+        additional_info=html.escape(str(additional_info)),
+        date=datetime.now().strftime('%-m/%-d/%Y'),
+        payload=payload,
+        options=script_json(chart_options if chart_options is not None else {}),
+        legend_checked=legend_checked
+    )
@@ -0,0 +1,516 @@
+import math
+from xml.sax.saxutils import escape
+
+try:
+    import cairosvg
+except ImportError:
+    cairosvg = None
+
+# Server-side chart images (/render_chart). A chart's data, as the chart
+# routes build it for Chart.js, is drawn straight to SVG here, so no browser or
+# plotting library is needed:
+#
+#   bar, stackedBar, percentStackedBar, line   category x axis, value y axis
+#   scatter, bubble                            value x and y axes
+#   pie, doughnut                              slices sized by value
+#   polarArea                                  equal slices, radius by value
+#   radar                                      one spoke per label
+#
+# The layout follows Chart.js' defaults: legend on top, grid lines behind the
+# data, no vertical grid lines and numbers in the Indian format used by the
+# exported pages. PNG output is the same SVG rasterized with cairosvg, when that
+# is installed.
+
+MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+FONT = 'Lato, Arial, sans-serif'
+FONT_SIZE = 12
+TITLE_SIZE = 16
+CHAR_WIDTH = 0.6  # Average glyph width as a share of the font size, for layout
+TEXT_COLOR = '#666666'
+TITLE_COLOR = '#2c3e50'
+GRID_COLOR = '#e5e5e5'
+AXIS_COLOR = '#c8c8c8'
+DEFAULT_COLOR = '#1a4570'
+PADDING = 16
+SWATCH = 12
+
+CATEGORY_CHARTS = ['bar', 'stackedBar', 'percentStackedBar', 'line']
+POINT_CHARTS = ['scatter', 'bubble']
+SLICE_CHARTS = ['pie', 'doughnut']
+
+
+def available_formats():
+    return ['svg', 'png'] if cairosvg is not None else ['svg']
+
+
+def render(chart_data, chart_type, image_format='svg', width=800, height=500, title=None, scale=1):
+    svg = render_svg(chart_data, chart_type, width, height, title)
+    if image_format == 'png':
+        if cairosvg is None:
+            raise RuntimeError('PNG output needs cairosvg installed')
+        return cairosvg.svg2png(bytestring=svg.encode('utf-8'), scale=scale)
+    return svg.encode('utf-8')
+
+
+def render_svg(chart_data, chart_type, width=800, height=500, title=None):
+    svg = Svg(width, height)
+    chart_data = chart_data or {}
+    datasets = [dataset for dataset in chart_data.get('datasets') or [] if isinstance(dataset, dict)]
+    labels = list(chart_data.get('labels') or [])
+
+    top = PADDING
+    if title:
+        svg.text(width / 2, top + TITLE_SIZE, fit(str(title), width - 2 * PADDING, TITLE_SIZE),
+                 size=TITLE_SIZE, anchor='middle', color=TITLE_COLOR, weight='bold')
+        top += TITLE_SIZE + 12
+
+    # Slice charts have a legend entry per label, the others one per series
+    if chart_type in SLICE_CHARTS or chart_type == 'polarArea':
+        colors = slice_colors(datasets[0] if datasets else {}, len(labels))
+        entries = [(label_text(label), color) for label, color in zip(labels, colors)]
+    else:
+        entries = [(str(dataset.get('label') or f'Dataset {i + 1}'), series_color(dataset)) for i, dataset in enumerate(datasets)]
+    top = svg.legend(entries, top, width)
+
+    area = (PADDING, top, width - PADDING, height - PADDING)
+    if not has_values(datasets):
+        svg.text(width / 2, (area[1] + area[3]) / 2, 'No data', anchor='middle')
+    elif chart_type in POINT_CHARTS:
+        draw_points(svg, datasets, chart_type, area)
+    elif chart_type in SLICE_CHARTS:
+        draw_slices(svg, datasets[0], labels, chart_type, area)
+    elif chart_type == 'polarArea':
+        draw_polar_area(svg, datasets[0], labels, area)
+    elif chart_type == 'radar':
+        draw_radar(svg, datasets, labels, area)
+    else:
+        draw_categories(svg, datasets, labels, chart_type, area)
+    return svg.render()
+
+
+class Svg:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.parts = [f'<rect width="{width}" height="{height}" fill="#ffffff"/>']
+
+    def render(self):
+        return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+                f'viewBox="0 0 {self.width} {self.height}" font-family="{FONT}" font-size="{FONT_SIZE}">'
+                + ''.join(self.parts) + '</svg>')
+
+    def rect(self, x, y, width, height, fill, stroke=None):
+        border = f' stroke="{attr(stroke)}" stroke-width="1"' if stroke else ''
+        self.parts.append(f'<rect x="{num(x)}" y="{num(y)}" width="{num(width)}" height="{num(height)}" fill="{attr(fill)}"{border}/>')
+
+    def line(self, x1, y1, x2, y2, color, width=1):
+        self.parts.append(f'<line x1="{num(x1)}" y1="{num(y1)}" x2="{num(x2)}" y2="{num(y2)}" stroke="{attr(color)}" stroke-width="{width}"/>')
+
+    def polyline(self, points, color, width=2):
+        coords = ' '.join(f'{num(x)},{num(y)}' for x, y in points)
+        self.parts.append(f'<polyline points="{coords}" fill="none" stroke="{attr(color)}" stroke-width="{width}" stroke-linejoin="round"/>')
+
+    def polygon(self, points, fill, stroke, width=1):
+        coords = ' '.join(f'{num(x)},{num(y)}' for x, y in points)
+        self.parts.append(f'<polygon points="{coords}" fill="{attr(fill)}" stroke="{attr(stroke)}" stroke-width="{width}"/>')
+
+    def circle(self, x, y, r, fill, stroke=None):
+        border = f' stroke="{attr(stroke)}" stroke-width="1"' if stroke else ''
+        self.parts.append(f'<circle cx="{num(x)}" cy="{num(y)}" r="{num(r)}" fill="{attr(fill)}"{border}/>')
+
+    def path(self, d, fill, stroke=None, width=1):
+        border = f' stroke="{attr(stroke)}" stroke-width="{width}"' if stroke else ''
+        self.parts.append(f'<path d="{d}" fill="{attr(fill)}"{border}/>')
+
+    def text(self, x, y, text, size=FONT_SIZE, anchor='start', color=TEXT_COLOR, weight=None):
+        bold = f' font-weight="{weight}"' if weight else ''
+        font = f' font-size="{size}"' if size != FONT_SIZE else ''
+        self.parts.append(f'<text x="{num(x)}" y="{num(y)}" text-anchor="{anchor}" fill="{color}"{font}{bold}>{escape(text)}</text>')
+
+    # Legend entries laid out in centered rows from top, using at most a third
+    # of the height (entries past that are left out); returns where it ends
+    def legend(self, entries, top, width):
+        if not entries:
+            return top
+        rows = [[]]
+        row_width = 0
+        for text, color in entries:
+            text = fit(text, width / 2, FONT_SIZE)
+            item_width = SWATCH + 6 + text_width(text) + 14
+            if rows[-1] and row_width + item_width > width - 2 * PADDING:
+                rows.append([])
+                row_width = 0
+            rows[-1].append((text, color, item_width))
+            row_width += item_width
+
+        for row in rows[:max(1, int(self.height / 3 // (SWATCH + 8)))]:
+            x = (width - sum(item[2] for item in row) + 14) / 2
+            for text, color, item_width in row:
+                self.rect(x, top, SWATCH, SWATCH, color)
+                self.text(x + SWATCH + 6, top + SWATCH - 2, text)
+                x += item_width
+            top += SWATCH + 8
+        return top + 4
+
+
+def draw_categories(svg, datasets, labels, chart_type, area):
+    left, top, right, bottom = area
+    count = max([len(labels)] + [len(values_of(dataset)) for dataset in datasets])
+    series = [[number(value) for value in values_of(dataset)[:count]] for dataset in datasets]
+    series = [values + [None] * (count - len(values)) for values in series]
+
+    if chart_type == 'percentStackedBar':
+        lo, hi = 0.0, 100.0
+    elif chart_type == 'stackedBar':
+        positive = [sum(max(values[i] or 0, 0) for values in series) for i in range(count)]
+        negative = [sum(min(values[i] or 0, 0) for values in series) for i in range(count)]
+        lo, hi = min(negative + [0]), max(positive + [0])
+    else:
+        present = [value for values in series for value in values if value is not None]
+        lo, hi = min(present + [0]), max(present + [0])
+
+    ticks = nice_ticks(lo, hi)
+    tick_labels = tick_texts(ticks, '%' if chart_type == 'percentStackedBar' else '')
+    left += max(text_width(text) for text in tick_labels) + 8
+    bottom -= FONT_SIZE + 8
+    y_of = linear(ticks[0], ticks[-1], bottom, top)
+
+    for tick, text in zip(ticks, tick_labels):
+        y = y_of(tick)
+        svg.line(left, y, right, y, AXIS_COLOR if tick == 0 else GRID_COLOR)
+        svg.text(left - 6, y + 4, text, anchor='end')
+
+    band = (right - left) / count
+    centers = [left + band * (i + 0.5) for i in range(count)]
+    draw_category_labels(svg, labels, centers, band, bottom)
+
+    if chart_type == 'line':
+        for dataset, values in zip(datasets, series):
+            color = series_color(dataset)
+            # A gap (empty value) breaks the line, as spanGaps: false does in Chart.js
+            run = []
+            for x, value in zip(centers, values):
+                if value is None:
+                    if len(run) > 1:
+                        svg.polyline(run, color)
+                    run = []
+                else:
+                    run.append((x, y_of(value)))
+            if len(run) > 1:
+                svg.polyline(run, color)
+            if count <= 100:
+                for x, value in zip(centers, values):
+                    if value is not None:
+                        svg.circle(x, y_of(value), 3, color)
+        return
+
+    group = band * 0.8
+    if chart_type == 'bar':
+        bar = group / len(series) * 0.9
+        for j, (dataset, values) in enumerate(zip(datasets, series)):
+            fill, stroke = fill_color(dataset), series_color(dataset)
+            for i, value in enumerate(values):
+                if value is None:
+                    continue
+                x = centers[i] - group / 2 + group / len(series) * j + (group / len(series) - bar) / 2
+                y0, y1 = y_of(max(value, 0)), y_of(min(value, 0))
+                svg.rect(x, y0, bar, y1 - y0, fill, stroke)
+        return
+
+    # Stacked bars: positive values stack up from zero, negative ones down
+    bar = group * 0.9
+    positive = [0.0] * count
+    negative = [0.0] * count
+    for dataset, values in zip(datasets, series):
+        fill, stroke = fill_color(dataset), series_color(dataset)
+        for i, value in enumerate(values):
+            if not value:
+                continue
+            stack = positive if value > 0 else negative
+            start, end = stack[i], stack[i] + value
+            stack[i] = end
+            y0, y1 = y_of(max(start, end)), y_of(min(start, end))
+            svg.rect(centers[i] - bar / 2, y0, bar, y1 - y0, fill, stroke)
+
+
+# Label under each category, skipping labels so the shown ones don't overlap
+def draw_category_labels(svg, labels, centers, band, bottom):
+    if not labels:
+        return
+    texts = [label_text(label) for label in labels]
+    widest = max(text_width(text) for text in texts) + 8
+    step = max(1, math.ceil(widest / band)) if band > 0 else len(texts)
+    for i in range(0, min(len(texts), len(centers)), step):
+        svg.text(centers[i], bottom + FONT_SIZE + 6, fit(texts[i], band * step - 4, FONT_SIZE), anchor='middle')
+
+
+def draw_points(svg, datasets, chart_type, area):
+    left, top, right, bottom = area
+    points = []
+    for dataset in datasets:
+        points.append([(number(point.get('x')), number(point.get('y')), number(point.get('r')))
+                       for point in values_of(dataset) if isinstance(point, dict)])
+    present = [(x, y) for series in points for x, y, _ in series if x is not None and y is not None]
+    x_ticks = nice_ticks(min(x for x, _ in present), max(x for x, _ in present))
+    y_ticks = nice_ticks(min(y for _, y in present), max(y for _, y in present))
+
+    y_labels = tick_texts(y_ticks)
+    left += max(text_width(text) for text in y_labels) + 8
+    bottom -= FONT_SIZE + 8
+    x_of = linear(x_ticks[0], x_ticks[-1], left, right)
+    y_of = linear(y_ticks[0], y_ticks[-1], bottom, top)
+
+    for tick, text in zip(y_ticks, y_labels):
+        svg.line(left, y_of(tick), right, y_of(tick), GRID_COLOR)
+        svg.text(left - 6, y_of(tick) + 4, text, anchor='end')
+    svg.line(left, bottom, left, top, AXIS_COLOR)
+    x_labels = tick_texts(x_ticks)
+    step = max(1, math.ceil((max(text_width(text) for text in x_labels) + 8) / ((right - left) / max(len(x_ticks) - 1, 1))))
+    for tick, text in list(zip(x_ticks, x_labels))[::step]:
+        svg.text(x_of(tick), bottom + FONT_SIZE + 6, text, anchor='middle')
+
+    for dataset, series in zip(datasets, points):
+        fill, stroke = fill_color(dataset), series_color(dataset)
+        for x, y, r in series:
+            if x is None or y is None:
+                continue
+            radius = (r if r is not None and r >= 0 else 10) if chart_type == 'bubble' else 3
+            svg.circle(x_of(x), y_of(y), radius, fill, stroke)
+
+
+def draw_slices(svg, dataset, labels, chart_type, area):
+    cx, cy, radius = center_of(area)
+    values = [max(number(value) or 0, 0) for value in values_of(dataset)]
+    colors = slice_colors(dataset, len(values))
+    total = sum(values)
+    inner = radius * 0.5 if chart_type == 'doughnut' else 0
+
+    angle = -math.pi / 2
+    for value, color in zip(values, colors):
+        if value <= 0 or total <= 0:
+            continue
+        sweep = value / total * 2 * math.pi
+        svg.path(sector_path(cx, cy, inner, radius, angle, angle + sweep), color, '#ffffff')
+        angle += sweep
+
+
+def draw_polar_area(svg, dataset, labels, area):
+    cx, cy, radius = center_of(area)
+    values = [max(number(value) or 0, 0) for value in values_of(dataset)]
+    colors = slice_colors(dataset, len(values))
+    ticks = nice_ticks(0, max(values + [0]))
+    r_of = linear(0, ticks[-1], 0, radius)
+
+    sweep = 2 * math.pi / len(values) if values else 0
+    for i, (value, color) in enumerate(zip(values, colors)):
+        if value > 0:
+            start = -math.pi / 2 + i * sweep
+            svg.path(sector_path(cx, cy, 0, r_of(value), start, start + sweep), with_alpha(color, 0.7), '#ffffff')
+
+    for tick, text in list(zip(ticks, tick_texts(ticks)))[1:]:
+        svg.circle(cx, cy, r_of(tick), 'none', GRID_COLOR)
+        svg.text(cx, cy - r_of(tick) + 4, text, size=10, anchor='middle')
+
+
+def draw_radar(svg, datasets, labels, area):
+    cx, cy, radius = center_of(area)
+    radius -= FONT_SIZE + 4
+    count = max([len(labels)] + [len(values_of(dataset)) for dataset in datasets])
+    if count < 3:
+        # A radar needs at least three spokes; fewer draw as a line chart would
+        return draw_categories(svg, datasets, labels, 'line', area)
+
+    series = [[number(value) for value in values_of(dataset)[:count]] for dataset in datasets]
+    present = [value for values in series for value in values if value is not None]
+    ticks = nice_ticks(min(present + [0]), max(present + [0]))
+    r_of = linear(ticks[0], ticks[-1], 0, radius)
+
+    def point(i, r):
+        angle = -math.pi / 2 + 2 * math.pi * i / count
+        return cx + r * math.cos(angle), cy + r * math.sin(angle)
+
+    for tick in ticks[1:]:
+        svg.polygon([point(i, r_of(tick)) for i in range(count)], 'none', GRID_COLOR)
+    for i in range(count):
+        x, y = point(i, radius)
+        svg.line(cx, cy, x, y, GRID_COLOR)
+        lx, ly = point(i, radius + 8)
+        anchor = 'middle' if abs(lx - cx) < 1 else ('start' if lx > cx else 'end')
+        text = label_text(labels[i]) if i < len(labels) else ''
+        svg.text(lx, ly + 4, fit(text, radius, FONT_SIZE), anchor=anchor)
+    for tick, text in list(zip(ticks, tick_texts(ticks)))[1:]:
+        svg.text(cx, cy - r_of(tick) + 4, text, size=10, anchor='middle')
+
+    for dataset, values in zip(datasets, series):
+        stroke = series_color(dataset)
+        points = [point(i, r_of(value if value is not None else ticks[0])) for i, value in enumerate(values)]
+        svg.polygon(points, fill_color(dataset, 0.2), stroke, 2)
+
+
+def center_of(area):
+    left, top, right, bottom = area
+    return (left + right) / 2, (top + bottom) / 2, max(min(right - left, bottom - top) / 2 - 4, 1)
+
+
+# SVG path of a ring sector (a pie slice when inner is 0)
+def sector_path(cx, cy, inner, outer, start, end):
+    if end - start >= 2 * math.pi - 1e-9:
+        # A full circle can't be one arc; draw it as two halves
+        middle = start + math.pi
+        return sector_path(cx, cy, inner, outer, start, middle) + sector_path(cx, cy, inner, outer, middle, end)
+
+    large = 1 if end - start > math.pi else 0
+    x1, y1 = cx + outer * math.cos(start), cy + outer * math.sin(start)
+    x2, y2 = cx + outer * math.cos(end), cy + outer * math.sin(end)
+    d = f'M{num(x1)},{num(y1)}A{num(outer)},{num(outer)} 0 {large} 1 {num(x2)},{num(y2)}'
+    if inner > 0:
+        x3, y3 = cx + inner * math.cos(end), cy + inner * math.sin(end)
+        x4, y4 = cx + inner * math.cos(start), cy + inner * math.sin(start)
+        d += f'L{num(x3)},{num(y3)}A{num(inner)},{num(inner)} 0 {large} 0 {num(x4)},{num(y4)}Z'
+    else:
+        d += f'L{num(cx)},{num(cy)}Z'
+    return d
+
+
+# Function mapping values in [lo, hi] linearly onto [start, end]
+def linear(lo, hi, start, end):
+    span = (hi - lo) or 1
+    return lambda value: start + (value - lo) / span * (end - start)
+
+
+# Round tick values covering lo..hi, about count of them
+def nice_ticks(lo, hi, count=8):
+    if lo == hi:
+        lo, hi = (min(lo, 0), max(hi, 0)) if lo else (0, 1)
+    step = nice_step((hi - lo) / max(count - 1, 1))
+    first = math.floor(lo / step) * step
+    last = math.ceil(hi / step) * step
+    ticks = []
+    value = first
+    while value <= last + step / 2:
+        ticks.append(round(value, 10))
+        value += step
+    return ticks
+
+
+def nice_step(raw):
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for factor in (1, 2, 2.5, 5, 10):
+        if raw <= factor * magnitude:
+            return factor * magnitude
+    return 10 * magnitude
+
+
+def has_values(datasets):
+    for dataset in datasets:
+        for value in values_of(dataset):
+            if isinstance(value, dict):
+                if number(value.get('x')) is not None and number(value.get('y')) is not None:
+                    return True
+            elif number(value) is not None:
+                return True
+    return False
+
+
+# A dataset's data as a list (the chart routes leave NumPy arrays in place)
+def values_of(dataset):
+    data = dataset.get('data')
+    return [] if data is None else list(data)
+
+
+# Float value of a data point, or None for empty and non-numeric values
+def number(value):
+    if value is None or isinstance(value, str):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+# Tick labels with enough decimals to tell small steps apart
+def tick_texts(ticks, suffix=''):
+    step = ticks[1] - ticks[0] if len(ticks) > 1 else 1
+    decimals = min(10, 1 - math.floor(math.log10(step))) if step < 1 else 2
+    return [format_number(tick, decimals) + suffix for tick in ticks]
+
+
+# Indian number format (1,00,000), as in the exported chart pages
+def format_number(value, decimals=2):
+    text = f'{abs(value):.{decimals}f}'.rstrip('0').rstrip('.')
+    integer, _, fraction = text.partition('.')
+    if len(integer) > 3:
+        head, tail = integer[:-3], integer[-3:]
+        groups = []
+        while len(head) > 2:
+            groups.insert(0, head[-2:])
+            head = head[:-2]
+        integer = ','.join(([head] if head else []) + groups + [tail])
+    text = integer + ('.' + fraction if fraction else '')
+    return '-' + text if value < 0 and text != '0' else text
+
+
+def label_text(label):
+    if label is None:
+        return ''
+    if isinstance(label, float) and label.is_integer():
+        return str(int(label))
+    return str(label)
+
+
+def text_width(text, size=FONT_SIZE):
+    return len(text) * size * CHAR_WIDTH
+
+
+# Text shortened with an ellipsis to fit width
+def fit(text, width, size=FONT_SIZE):
+    limit = int(width / (size * CHAR_WIDTH))
+    if len(text) <= limit:
+        return text
+    return text[:max(limit - 1, 0)] + '…' if limit > 1 else ''
+
+
+def series_color(dataset):
+    color = dataset.get('borderColor')
+    if not isinstance(color, str) or color == 'white':
+        color = dataset.get('backgroundColor')
+    return color if isinstance(color, str) else DEFAULT_COLOR
+
+
+def fill_color(dataset, alpha=None):
+    color = dataset.get('backgroundColor')
+    color = color if isinstance(color, str) else series_color(dataset)
+    return with_alpha(color, alpha) if alpha is not None else color
+
+
+# One color per slice: the dataset's list of colors, repeated if it's short
+def slice_colors(dataset, count):
+    colors = dataset.get('backgroundColor')
+    if isinstance(colors, str):
+        colors = [colors]
+    if not colors:
+        colors = [DEFAULT_COLOR]
+    return [colors[i % len(colors)] for i in range(count)]
+
+
+# A hex or rgb()/rgba() color with its alpha set
+def with_alpha(color, alpha):
+    color = color.strip()
+    if color.startswith('#') and len(color) in (4, 7):
+        digits = color[1:] if len(color) == 7 else ''.join(c * 2 for c in color[1:])
+        r, g, b = (int(digits[i:i + 2], 16) for i in (0, 2, 4))
+        return f'rgba({r}, {g}, {b}, {alpha})'
+    if color.startswith('rgb'):
+        parts = [part.strip() for part in color[color.index('(') + 1:color.rindex(')')].split(',')]
+        return f"rgba({', '.join(parts[:3])}, {alpha})"
+    return color
+
+
+def num(value):
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+
+def attr(value):
+    return escape(str(value), {'"': '&quot;'})
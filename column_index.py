@@ -0,0 +1,129 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+# Per-column indexes, written next to a sheet's columns when it is stored (see
+# columnar_store). Each low-cardinality column gets:
+#
+#   uniques          its distinct non-empty values, in order of first appearance
+#   codes            for every row, the position of its value in uniques (-1 if empty)
+#   order, offsets   row positions grouped by value: the rows holding uniques[i]
+#                    are order[offsets[i]:offsets[i + 1]], in ascending order
+#
+# An equality filter then compares the value against the few uniques (with the
+# same pandas comparison the column would use) and takes the matching rows'
+# positions, instead of comparing every row. Distinct values of any subset of
+# rows come from their integer codes rather than from hashing the cells.
+
+MAX_DISTINCT = 65536
+INDEX_NAME = 'index.pkl'
+
+
+class ColumnIndex:
+    def __init__(self, uniques, codes, order, offsets):
+        self.uniques = uniques
+        self.codes = codes
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def nbytes(self):
+        return (int(self.uniques.memory_usage(deep=True)) + self.codes.nbytes +
+                self.order.nbytes + self.offsets.nbytes)
+
+    # Sorted positions of the rows whose value == value
+    def rows_equal_to(self, value):
+        matches = np.flatnonzero((pd.Series(self.uniques) == value).to_numpy())
+        if len(matches) == 1:
+            code = matches[0]
+            return np.asarray(self.order[self.offsets[code]:self.offsets[code + 1]], dtype=np.int64)
+        rows = [self.order[self.offsets[code]:self.offsets[code + 1]] for code in matches]
+        return np.sort(np.concatenate(rows)).astype(np.int64) if rows else np.empty(0, dtype=np.int64)
+
+    # Distinct non-empty values of the given rows (a slice or positions; all rows
+    # by default) in order of first appearance, like series.dropna().unique()
+    def distinct_values(self, rows=None):
+        codes = self.codes if rows is None else self.codes[rows]
+        codes = pd.unique(codes[codes >= 0])
+        return self.uniques.take(codes).tolist()
+
+
+# Column name -> ColumnIndex for the indexed columns of one sheet
+class SheetIndex(dict):
+    @property
+    def nbytes(self):
+        return sum(index.nbytes for index in self.values())
+
+
+# Index a column if it has few enough distinct values (at most half its rows)
+def build_index(series):
+    codes, uniques = pd.factorize(series)
+    if len(uniques) > min(MAX_DISTINCT, len(series) // 2):
+        return None
+    return sorted_index(uniques, codes)
+
+
+# The index of a column that gained rows at the end, from its index before and the
+# new rows' values: the same as build_index(series) without factorizing the
+# earlier rows again
+def extend_index(index, series, start):
+    new_codes, new_uniques = pd.factorize(series.iloc[start:])
+    positions = index.uniques.get_indexer(new_uniques)
+    added = positions < 0
+    uniques = index.uniques.append(new_uniques[added])
+    if len(uniques) > min(MAX_DISTINCT, len(series) // 2):
+        return None
+
+    positions[added] = np.arange(len(index.uniques), len(uniques))
+    codes = np.full(len(new_codes), -1, dtype=np.int32)
+    present = new_codes >= 0
+    codes[present] = positions[new_codes[present]]
+    return sorted_index(uniques, np.concatenate([index.codes, codes]))
+
+
+def sorted_index(uniques, codes):
+    codes = codes.astype(np.int32)
+    order = np.argsort(codes, kind='stable').astype(np.int32)
+    offsets = np.searchsorted(codes[order], np.arange(len(uniques) + 1)).astype(np.int64)
+    return ColumnIndex(uniques, codes, order, offsets)
+
+
+# Index every column of a sheet. With previous (the sheet directory of an earlier
+# version of it and its row count), the rows after those are new and columns
+# indexed then are extended instead of indexed again.
+def write_indexes(df, sheet_path, previous=None):
+    previous_indexes = read_indexes(previous[0], df.columns) if previous else {}
+
+    uniques = {}
+    for i in range(df.shape[1]):
+        previous_index = previous_indexes.get(df.columns[i])
+        if previous_index is not None:
+            index = extend_index(previous_index, df.iloc[:, i], previous[1])
+        else:
+            index = build_index(df.iloc[:, i])
+        if index is None:
+            continue
+        for part in ('codes', 'order', 'offsets'):
+            np.save(os.path.join(sheet_path, f'idx_{i}_{part}.npy'), getattr(index, part))
+        uniques[i] = index.uniques
+
+    with open(os.path.join(sheet_path, INDEX_NAME), 'wb') as f:
+        pickle.dump(uniques, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# Load the indexes of a stored sheet; sheets stored without them get an empty one
+def read_indexes(sheet_path, columns):
+    sheet_index = SheetIndex()
+    index_path = os.path.join(sheet_path, INDEX_NAME)
+    if not os.path.exists(index_path):
+        return sheet_index
+
+    with open(index_path, 'rb') as f:
+        uniques = pickle.load(f)
+
+    for i, column_uniques in uniques.items():
+        parts = [np.load(os.path.join(sheet_path, f'idx_{i}_{part}.npy'), mmap_mode='r')
+                 for part in ('codes', 'order', 'offsets')]
+        sheet_index[columns[i]] = ColumnIndex(column_uniques, *parts)
+    return sheet_index
@@ -0,0 +1,333 @@
+import os
+import shutil
+import uuid
+import pickle
+import numpy as np
+import pandas as pd
+import column_index
+import compact_dtypes
+import rollup_cube
+import upload_store
+import excel_reader
+
+# Sheets are converted once at upload time into an .npy-per-column layout next
+# to the workbook:
+#
+#   uploads/report.xlsx.columns/
+#       manifest.pkl          source mtime/size, Excel reader used, sheet names
+#                             -> directories, column types, memory before/after
+#                             compacting, whether every sheet is done
+#       sheet_0/meta.pkl      column names, per-column file names, categories
+#       sheet_0/col_0.npy     one array per column
+#       sheet_0/index.pkl     per-column indexes (see column_index)
+#       sheet_0/rollups/      pre-aggregated sums, built on demand (see rollup_cube)
+#
+# Conversion normally runs sheet by sheet in ingestion worker processes (see
+# ingest.py): the manifest is written first and each sheet is added to it as
+# soon as it is ready, so finished sheets can be served while others are still
+# being parsed.
+#
+# Numeric and datetime columns are loaded with mmap_mode='r', so every worker
+# process reading the same sheet shares the page cache instead of holding its
+# own copy. Columns are stored in compact types (see compact_dtypes): text
+# columns with few distinct values as categorical codes, which are memory-mapped
+# the same way, and integers in the narrowest type that holds them. Other object
+# (text/mixed) columns can't be memory-mapped and are stored as pickled object
+# arrays, which still loads far faster than re-parsing XML.
+#
+# A workbook uploaded as a new version of an earlier one (see
+# upload_store.previous_upload) is converted incrementally where it can be: a
+# sheet that only gained rows at the bottom is built from the earlier version's
+# stored columns plus its new rows alone, its indexes and rollups extended rather
+# than rebuilt (see appended_sheet). Every other sheet is parsed in full.
+
+SIDECAR_SUFFIX = '.columns'
+MANIFEST_NAME = 'manifest.pkl'
+META_NAME = 'meta.pkl'
+
+
+def sidecar_dir(filepath):
+    return filepath + SIDECAR_SUFFIX
+
+
+def _source_signature(filepath):
+    stat = os.stat(filepath)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _write_pickle(path, obj):
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _write_manifest(filepath, manifest):
+    # Replace the manifest atomically so readers never see a partial one
+    manifest_path = os.path.join(sidecar_dir(filepath), MANIFEST_NAME)
+    staging = f'{manifest_path}.tmp-{uuid.uuid4().hex}'
+    _write_pickle(staging, manifest)
+    os.replace(staging, manifest_path)
+
+
+# Column names with their pandas dtypes, recorded in the manifest
+def column_types(df):
+    return [{'name': col, 'dtype': str(dtype)} for col, dtype in df.dtypes.items()]
+
+
+# Write a single DataFrame as one .npy file per column, in compact types. With
+# previous (the sheet directory of an earlier version of the sheet and its row
+# count), the rows after those are new, and the earlier version's indexes and
+# rollups are extended. Returns the bytes the sheet's columns hold before and
+# after compacting.
+def write_sheet(df, sheet_path, previous=None):
+    os.makedirs(sheet_path, exist_ok=True)
+
+    compacted = compact_dtypes.compact_frame(df)
+    column_files = []
+    categories = {}
+    for i in range(compacted.shape[1]):
+        values = compacted.iloc[:, i].array
+        if isinstance(values, pd.Categorical):
+            # Codes in the file, categories in the meta
+            categories[i] = values.categories
+            values = values.codes
+        else:
+            values = compacted.iloc[:, i].to_numpy()
+        col_file = f'col_{i}.npy'
+        np.save(os.path.join(sheet_path, col_file), values, allow_pickle=values.dtype == object)
+        column_files.append(col_file)
+
+    column_index.write_indexes(df, sheet_path, previous)
+    if previous:
+        rollup_cube.extend_rollups(previous[0], sheet_path, df.iloc[previous[1]:])
+
+    _write_pickle(os.path.join(sheet_path, META_NAME), {
+        'columns': df.columns,
+        'files': column_files,
+        'categories': categories,
+        'rows': len(df)
+    })
+    return {'before': compact_dtypes.frame_bytes(df), 'after': compact_dtypes.frame_bytes(compacted)}
+
+
+# Read a stored sheet. With columns given, only those columns' files are opened
+# (in sheet order; names the sheet doesn't have are left out).
+def read_sheet_dir(sheet_path, columns=None):
+    meta = _read_pickle(os.path.join(sheet_path, META_NAME))
+
+    positions = range(len(meta['files']))
+    if columns is not None:
+        wanted = set(columns)
+        positions = [i for i, col in enumerate(meta['columns']) if col in wanted]
+
+    categories = meta.get('categories', {})
+    arrays = {}
+    for i in positions:
+        path = os.path.join(sheet_path, meta['files'][i])
+        try:
+            arrays[i] = np.load(path, mmap_mode='r')
+        except ValueError:
+            # Object arrays are pickled and can't be memory-mapped
+            arrays[i] = np.load(path, allow_pickle=True)
+        if i in categories:
+            # The codes stay memory-mapped (they were checked when written)
+            arrays[i] = pd.Categorical.from_codes(arrays[i], categories=categories[i], validate=False)
+
+    # copy=False keeps each column backed by its memory map
+    df = pd.DataFrame(arrays, index=pd.RangeIndex(meta['rows']), copy=False)
+    df.columns = meta['columns'][list(positions)]
+    return df
+
+
+# Convert every sheet of an uploaded workbook. The workbook is parsed once for
+# all sheets (but those appended to since previous_filepath, an earlier version of
+# it); a sheet that can't be stored is skipped and later read straight from the
+# workbook instead. Returns the sheet names in workbook order.
+def convert_workbook(filepath, previous_filepath=None):
+    appended = {}
+    if previous_filepath is None:
+        sheets = excel_reader.read_excel(filepath, sheet_name=None)
+    else:
+        sheet_names = upload_store.read_sheet_names(filepath)
+        for sheet_name in sheet_names:
+            sheet = appended_sheet(filepath, sheet_name, previous_filepath)
+            if sheet is not None:
+                appended[sheet_name] = sheet
+        remaining = [sheet_name for sheet_name in sheet_names if sheet_name not in appended]
+        parsed = excel_reader.read_excel(filepath, sheet_name=remaining) if remaining else {}
+        sheets = {sheet_name: appended[sheet_name][0] if sheet_name in appended else parsed[sheet_name]
+                  for sheet_name in sheet_names}
+
+    target = sidecar_dir(filepath)
+    staging = f'{target}.tmp-{uuid.uuid4().hex}'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    sheet_dirs = {}
+    sheet_types = {}
+    sheet_memory = {}
+    for i, (sheet_name, df) in enumerate(sheets.items()):
+        sheet_path = os.path.join(staging, f'sheet_{i}')
+        try:
+            memory = write_sheet(df, sheet_path, appended[sheet_name][1] if sheet_name in appended else None)
+            sheet_dirs[sheet_name] = f'sheet_{i}'
+            sheet_types[sheet_name] = column_types(df)
+            sheet_memory[sheet_name] = memory
+        except Exception:
+            shutil.rmtree(sheet_path, ignore_errors=True)
+
+    _write_pickle(os.path.join(staging, MANIFEST_NAME), {
+        'source': _source_signature(filepath),
+        'reader': excel_reader.default_engine,
+        'sheet_names': list(sheets.keys()),
+        'sheets': sheet_dirs,
+        'types': sheet_types,
+        'memory': sheet_memory,
+        'complete': True
+    })
+
+    # Swap the finished directory into place so readers never see a partial one
+    remove_sidecars(filepath)
+    os.rename(staging, target)
+
+    return list(sheets.keys())
+
+
+# Start a sheet-by-sheet conversion: an empty manifest listing the sheet names
+def begin_workbook(filepath, sheet_names):
+    remove_sidecars(filepath)
+    os.makedirs(sidecar_dir(filepath))
+    _write_manifest(filepath, {
+        'source': _source_signature(filepath),
+        'reader': excel_reader.default_engine,
+        'sheet_names': list(sheet_names),
+        'sheets': {},
+        'types': {},
+        'memory': {},
+        'complete': False
+    })
+
+
+# Parse and store a single sheet (only its new rows if it was appended to since
+# previous_filepath). Runs in an ingestion worker process, so it only writes the
+# sheet's own directory; the parent adds it to the manifest.
+def convert_sheet(filepath, sheet_name, sheet_index, previous_filepath=None):
+    appended = appended_sheet(filepath, sheet_name, previous_filepath) if previous_filepath else None
+    if appended is not None:
+        df, previous = appended
+    else:
+        df, previous = excel_reader.read_excel(filepath, sheet_name=sheet_name), None
+
+    sheet_dir = f'sheet_{sheet_index}'
+    sheet_path = os.path.join(sidecar_dir(filepath), sheet_dir)
+    staging = f'{sheet_path}.tmp-{uuid.uuid4().hex}'
+    try:
+        memory = write_sheet(df, staging, previous)
+        os.rename(staging, sheet_path)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    sheet_info = {'dir': sheet_dir, 'rows': len(df), 'types': column_types(df), 'memory': memory}
+    if previous:
+        sheet_info['appendedRows'] = len(df) - previous[1]
+    return sheet_info
+
+
+# A sheet that only gained rows at the bottom since previous_filepath, an earlier
+# version of its workbook: the earlier version's stored rows followed by the new
+# ones, exactly as parsing the whole sheet would give them. Returns (df, previous)
+# with previous the earlier sheet's directory and row count, or None when the
+# sheet has to be parsed in full: it isn't stored for the earlier version, changed
+# in any other way, or its new rows would change a column's type.
+def appended_sheet(filepath, sheet_name, previous_filepath):
+    manifest = load_manifest(previous_filepath)
+    if manifest is None or sheet_name not in manifest['sheets'] or manifest.get('reader') not in ('auto', 'stream'):
+        return None
+
+    sheet_path = os.path.join(sidecar_dir(previous_filepath), manifest['sheets'][sheet_name])
+    stored = read_sheet_dir(sheet_path)
+    types = manifest.get('types', {}).get(sheet_name)
+    if types is not None:
+        # Back to the types the rows were parsed with, as the new rows have
+        stored = compact_dtypes.restore(stored, types)
+    try:
+        new_rows = excel_reader.read_appended_rows(filepath, previous_filepath, sheet_name, len(stored))
+    except Exception:
+        return None
+    if new_rows is None or list(new_rows.columns) != list(stored.columns):
+        return None
+
+    if len(new_rows) == 0:
+        df = stored
+    elif list(new_rows.dtypes) == list(stored.dtypes):
+        df = pd.concat([stored, new_rows], ignore_index=True)
+    else:
+        return None
+    return df, (sheet_path, len(stored))
+
+
+# Record a sheet written by convert_sheet in the manifest. Callers serialize
+# updates to the same workbook.
+def add_sheet(filepath, sheet_name, sheet_info):
+    manifest = _read_pickle(os.path.join(sidecar_dir(filepath), MANIFEST_NAME))
+    manifest['sheets'][sheet_name] = sheet_info['dir']
+    manifest['types'][sheet_name] = sheet_info['types']
+    manifest.setdefault('memory', {})[sheet_name] = sheet_info['memory']
+    _write_manifest(filepath, manifest)
+
+
+# Mark a sheet-by-sheet conversion as finished (sheets that failed are left out
+# and read straight from the workbook instead)
+def finish_workbook(filepath):
+    manifest = _read_pickle(os.path.join(sidecar_dir(filepath), MANIFEST_NAME))
+    manifest['complete'] = True
+    _write_manifest(filepath, manifest)
+
+
+def load_manifest(filepath):
+    manifest_path = os.path.join(sidecar_dir(filepath), MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    manifest = _read_pickle(manifest_path)
+
+    # Ignore sidecars left over from an older version of the workbook
+    if manifest['source'] != _source_signature(filepath):
+        return None
+    return manifest
+
+
+# Returns the directory of a stored sheet and its recorded column types, or None
+# if it has no up-to-date sidecar
+def stored_sheet(filepath, sheet_name):
+    manifest = load_manifest(filepath)
+    if manifest is None or sheet_name not in manifest['sheets']:
+        return None
+    sheet_path = os.path.join(sidecar_dir(filepath), manifest['sheets'][sheet_name])
+    return sheet_path, manifest.get('types', {}).get(sheet_name)
+
+
+# Returns the sheet (or only the given columns) as a DataFrame, or None if it
+# has no up-to-date sidecar
+def read_sheet(filepath, sheet_name, columns=None):
+    stored = stored_sheet(filepath, sheet_name)
+    if stored is None:
+        return None
+    return read_sheet_dir(stored[0], columns)
+
+
+# Returns the column indexes of a stored sheet, or None if it has no up-to-date sidecar
+def read_sheet_index(filepath, sheet_name):
+    stored = stored_sheet(filepath, sheet_name)
+    if stored is None:
+        return None
+    meta = _read_pickle(os.path.join(stored[0], META_NAME))
+    return column_index.read_indexes(stored[0], meta['columns'])
+
+
+def remove_sidecars(filepath):
+    shutil.rmtree(sidecar_dir(filepath), ignore_errors=True)
@@ -0,0 +1,111 @@
+import sys
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype
+
+# Compact column types for stored sheets, chosen once when a sheet is ingested
+# (see columnar_store.write_sheet). A parsed sheet has an object column (an
+# 8-byte pointer per cell) for every text column and int64 for whole numbers:
+#
+#   text columns with at most half as many distinct values as rows (and at most
+#   MAX_CATEGORIES) become categoricals: 1-4 byte codes, which unlike object
+#   arrays can be memory-mapped and shared between processes like numeric columns
+#   integer columns are stored in the narrowest integer type that holds them
+#
+# Only text columns that convert back exactly are compacted: every non-empty
+# cell a str and every empty one NaN (a categorical of a mixed column would
+# merge 1, 1.0 and True into one value). Float columns are left as they are,
+# since float32 sums round differently; bool and datetime columns are compact
+# already. pyarrow-backed strings aren't used either: their empty cells are
+# pd.NA rather than NaN, which would change what the responses hold.
+#
+# The chart code treats a categorical as the object column it replaces: groupbys
+# use observed=True (only the values present, in the same sorted order as object
+# keys) and text y-axes are summed through as_object.
+
+MAX_CATEGORIES = 65536
+INT_TYPES = (np.int8, np.int16, np.int32)
+
+
+# The compact form of a column (a Categorical or a narrower integer array), or
+# None if it is kept as it is
+def compact_column(series):
+    values = series.to_numpy()
+    if values.dtype == object:
+        return compact_text(values)
+    if values.dtype.kind == 'i' and len(values):
+        low, high = values.min(), values.max()
+        for int_type in INT_TYPES:
+            if np.dtype(int_type).itemsize >= values.dtype.itemsize:
+                break
+            info = np.iinfo(int_type)
+            if info.min <= low and high <= info.max:
+                return values.astype(int_type)
+    return None
+
+
+def compact_text(values):
+    if infer_dtype(values, skipna=True) != 'string':
+        return None
+    categorical = pd.Categorical(values)
+    if len(categorical.categories) > min(MAX_CATEGORIES, len(values) // 2):
+        return None
+    if not all(type(value) is str for value in categorical.categories):
+        return None
+    if not all(isinstance(value, float) for value in values[categorical.codes < 0]):
+        return None
+    return categorical
+
+
+# A frame with every column that can be compacted replaced by its compact form
+def compact_frame(df):
+    columns = {}
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        compact = compact_column(series)
+        columns[i] = series.array if compact is None else compact
+    compacted = pd.DataFrame(columns, index=df.index, copy=False)
+    compacted.columns = df.columns
+    return compacted
+
+
+# The bytes a frame's columns hold, counting each distinct object of a column
+# once: parsed text cells repeat the same string objects, which
+# memory_usage(deep=True) counts again for every cell
+def frame_bytes(df):
+    total = 0
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i].array
+        if isinstance(values, pd.Categorical):
+            total += values.codes.nbytes + object_bytes(values.categories.to_numpy())
+            continue
+        values = np.asarray(values)
+        total += values.nbytes
+        if values.dtype == object:
+            total += object_bytes(values)
+    return total
+
+
+def object_bytes(values):
+    return sum(sys.getsizeof(value) for value in {id(value): value for value in values}.values())
+
+
+# df with its categorical columns among columns turned back into object columns,
+# for operations that treat the two differently (e.g. summing text, which joins
+# the strings of an object column and raises on a categorical)
+def as_object(df, columns):
+    categorical = {col: object for col in columns if isinstance(col, (str, int, float))
+                   and col in df.columns and isinstance(df[col].dtype, pd.CategoricalDtype)}
+    return df.astype(categorical) if categorical else df
+
+
+# A stored sheet with the column types it was parsed with (column_types, as
+# recorded by columnar_store.column_types), e.g. to add newly parsed rows to it
+def restore(df, column_types):
+    dtypes = {i: column['dtype'] for i, column in enumerate(column_types) if str(df.dtypes.iloc[i]) != column['dtype']}
+    if not dtypes:
+        return df
+    restored = df.copy(deep=False)
+    for i, dtype in dtypes.items():
+        restored.isetitem(i, df.iloc[:, i].astype(dtype))
+    return restored
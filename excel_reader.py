@@ -0,0 +1,365 @@
+import io
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
+
+try:
+    from pandas.io.excel._base import BaseExcelReader
+    from openpyxl.cell.text import Text
+    from openpyxl.reader.excel import ExcelReader
+    from openpyxl.styles.stylesheet import apply_stylesheet
+    from openpyxl.utils.datetime import from_excel, from_ISO8601
+except ImportError:
+    BaseExcelReader = None
+
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+# Every workbook read goes through read_excel(), which tries the configured
+# engine and falls back to the next one if it fails:
+#
+#   stream     reads the worksheet XML with ElementTree.iterparse and converts
+#              cells straight to the values pandas' openpyxl reader produces, so
+#              frames are identical to openpyxl's. It skips openpyxl's cell
+#              objects, and the read-only worksheet's scan of every sheet for its
+#              size when a workbook has no <dimension> element.
+#   openpyxl   pd.read_excel's default engine for .xlsx
+#   calamine   pd.read_excel(engine='calamine') with python-calamine installed.
+#              Faster still, but it converts cells itself, so it is only used
+#              when configured explicitly.
+#
+# "auto" (the default) tries stream, then openpyxl. Workbooks that aren't zip
+# packages (.xls) always go to pd.read_excel's own engine choice (xlrd).
+# The stream engine plugs into pandas' reader base class, so header handling and
+# type inference are pandas' own.
+#
+# read_appended_rows() reads only the rows a worksheet gained at the bottom since
+# an earlier version of the workbook. It compares the sheet's rows XML (header
+# row included) byte for byte against the earlier version's, along with the shared
+# strings and date styles those bytes refer to, and parses just the header and
+# what follows.
+
+ENGINES = ('stream', 'openpyxl', 'calamine')
+AUTO_ORDER = ('stream', 'openpyxl')
+
+default_engine = 'auto'
+
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+ROW_TAG = f'{SHEET_NS}row'
+VALUE_TAG = f'{SHEET_NS}v'
+INLINE_STRING_TAG = f'{SHEET_NS}is'
+
+SHEET_DATA_TAG = re.compile(rb'<([\w.-]+:)?sheetData\b[^>]*>')
+FIRST_ROW_TAG = re.compile(rb'\s*<([\w.-]+:)?row\b([^>]*)>')
+FIRST_ROW_NUMBER = re.compile(rb'\sr="1"')
+
+
+def available_engines():
+    engines = []
+    if BaseExcelReader is not None:
+        engines.append('stream')
+    engines.append('openpyxl')
+    if python_calamine is not None:
+        engines.append('calamine')
+    return engines
+
+
+def set_default_engine(engine):
+    global default_engine
+    if engine != 'auto' and engine not in ENGINES:
+        raise ValueError(f"Unknown Excel reader '{engine}', expected auto or one of {', '.join(ENGINES)}")
+    default_engine = engine
+
+
+def engine_order(engine=None):
+    engine = engine or default_engine
+    order = AUTO_ORDER if engine == 'auto' else (engine, 'openpyxl')
+    available = available_engines()
+    return [name for name in dict.fromkeys(order) if name in available]
+
+
+# Drop-in for pd.read_excel(filepath, sheet_name=...): one sheet's DataFrame, or
+# a dict of all of them for sheet_name=None
+def read_excel(filepath, sheet_name=0, engine=None):
+    if not zipfile.is_zipfile(filepath):
+        return pd.read_excel(filepath, sheet_name=sheet_name)
+
+    engines = engine_order(engine)
+    for i, name in enumerate(engines):
+        try:
+            return read_with_engine(filepath, sheet_name, name)
+        except Exception:
+            # Errors from the last engine (usually openpyxl) are the ones reported
+            if i == len(engines) - 1:
+                raise
+
+
+def read_with_engine(filepath, sheet_name, engine):
+    if engine != 'stream':
+        return pd.read_excel(filepath, sheet_name=sheet_name, engine=engine)
+
+    reader = StreamingXlsxReader(filepath)
+    try:
+        return reader.parse(sheet_name=sheet_name)
+    finally:
+        reader.close()
+
+
+# The rows of a worksheet a later version of the workbook added at the bottom, as a
+# DataFrame under the sheet's header, or None if the sheet changed in any other way
+# since previous_filepath (or isn't read by the stream engine). stored_rows is the
+# number of rows pandas read from the earlier version.
+def read_appended_rows(filepath, previous_filepath, sheet_name, stored_rows):
+    if engine_order()[:1] != ['stream'] or not (zipfile.is_zipfile(filepath) and zipfile.is_zipfile(previous_filepath)):
+        return None
+
+    previous = XlsxBook(previous_filepath)
+    try:
+        reader = StreamingXlsxReader(filepath)
+    except Exception:
+        previous.close()
+        raise
+
+    try:
+        book = reader.book
+        if sheet_name not in previous.sheets or sheet_name not in book.sheets or not same_cell_values(previous, book):
+            return None
+
+        previous_xml = previous.archive.read(previous.sheets[sheet_name])
+        xml = book.archive.read(book.sheets[sheet_name])
+        previous_span, span = rows_span(previous_xml), rows_span(xml)
+        if previous_span is None or span is None:
+            return None
+
+        previous_rows = previous_xml[previous_span[0]:previous_span[1]]
+        header_end = header_row_end(previous_rows)
+        start = span[0]
+        if header_end is None or span[1] - start < len(previous_rows) or not xml.startswith(previous_rows, start):
+            return None
+
+        # Parse the sheet with every earlier row but the header cut out
+        book.sheets[sheet_name] = AppendedRows(xml[:start + header_end] + xml[start + len(previous_rows):], stored_rows)
+        return reader.parse(sheet_name=sheet_name)
+    finally:
+        reader.close()
+        previous.close()
+
+
+# Whether cells stored the same way read as the same values in both workbooks: the
+# earlier one's shared strings are still at the same positions, and the date styles
+# and date epoch are the same
+def same_cell_values(previous, book):
+    return (previous.epoch == book.epoch and
+            previous.date_formats == book.date_formats and
+            previous.timedelta_formats == book.timedelta_formats and
+            len(book.shared_strings) >= len(previous.shared_strings) and
+            book.shared_strings[:len(previous.shared_strings)] == previous.shared_strings[:])
+
+
+# Byte range of the rows inside a worksheet's <sheetData> element, or None if it
+# has none
+def rows_span(xml):
+    match = SHEET_DATA_TAG.search(xml)
+    if match is None or match.group(0).endswith(b'/>'):
+        return None
+    end = xml.rfind(b'</' + (match.group(1) or b'') + b'sheetData>')
+    return (match.end(), end) if end >= match.end() else None
+
+
+# Length of the first row element in a worksheet's rows, or None unless it is row 1
+def header_row_end(rows):
+    match = FIRST_ROW_TAG.match(rows)
+    if match is None or not FIRST_ROW_NUMBER.search(match.group(2)):
+        return None
+    if match.group(2).endswith(b'/'):
+        return match.end()
+    end = rows.find(b'</' + (match.group(1) or b'') + b'row>', match.end())
+    return end + len(match.group(1) or b'') + 6 if end >= 0 else None
+
+
+# A worksheet's XML with the rows of an earlier version cut out. Later rows are
+# numbered as if the earlier version's stored rows were the only rows before them.
+class AppendedRows:
+    def __init__(self, xml, skipped_rows):
+        self.xml = xml
+        self.skipped_rows = skipped_rows
+
+    def open(self):
+        return io.BytesIO(self.xml)
+
+
+# The parts of a workbook the stream engine needs: sheet names and paths, shared
+# strings, which styles are dates, and the date epoch. Loaded with openpyxl's own
+# readers, minus its worksheets.
+class XlsxBook:
+    def __init__(self, handle):
+        reader = ExcelReader(handle, read_only=True, data_only=True, keep_links=False)
+        reader.read_manifest()
+        reader.read_strings()
+        reader.read_workbook()
+        apply_stylesheet(reader.archive, reader.wb)
+
+        self.archive = reader.archive
+        self.shared_strings = reader.shared_strings
+        self.epoch = reader.wb.epoch
+        self.date_formats = reader.wb._date_formats
+        self.timedelta_formats = reader.wb._timedelta_formats
+
+        # Worksheets in workbook order, like openpyxl's (chart sheets are left out)
+        self.sheets = {}
+        for sheet, rel in reader.parser.find_sheets():
+            if rel.target in reader.valid_files and 'chartsheet' not in rel.Type:
+                self.sheets[sheet.name] = rel.target
+
+    def close(self):
+        self.archive.close()
+
+
+if BaseExcelReader is not None:
+    class StreamingXlsxReader(BaseExcelReader):
+        @property
+        def _workbook_class(self):
+            return XlsxBook
+
+        def load_workbook(self, filepath_or_buffer, engine_kwargs):
+            return XlsxBook(filepath_or_buffer)
+
+        @property
+        def sheet_names(self):
+            return list(self.book.sheets)
+
+        def get_sheet_by_name(self, name):
+            self.raise_if_bad_sheet_by_name(name)
+            return self.book.sheets[name]
+
+        def get_sheet_by_index(self, index):
+            self.raise_if_bad_sheet_by_index(index)
+            return list(self.book.sheets.values())[index]
+
+        # Rows of cell values as pandas' OpenpyxlReader.get_sheet_data returns
+        # them: missing rows empty, trailing empty cells and rows trimmed, then
+        # every row padded to the same width with ''
+        def get_sheet_data(self, sheet, file_rows_needed=None):
+            data = []
+            last_row_with_data = -1
+            row_counter = 0
+            # Sheets with earlier rows cut out come as AppendedRows, others by path
+            appended = isinstance(sheet, AppendedRows)
+            skipped_rows = sheet.skipped_rows if appended else 0
+            source = sheet.open() if appended else self.book.archive.open(sheet)
+
+            with source:
+                for _, element in ET.iterparse(source):
+                    if element.tag != ROW_TAG:
+                        continue
+
+                    row_number = element.get('r')
+                    if row_number:
+                        row_number = int(float(row_number))
+                        if row_number > 1:
+                            row_number -= skipped_rows
+                    else:
+                        row_number = row_counter + 1
+                    if row_number <= row_counter:
+                        element.clear()
+                        continue
+                    while row_counter < row_number - 1:
+                        data.append([])
+                        row_counter += 1
+                    row_counter = row_number
+
+                    row = self._convert_row(element)
+                    element.clear()
+
+                    while row and isinstance(row[-1], str) and row[-1] == '':
+                        row.pop()
+                    if row:
+                        last_row_with_data = len(data)
+                    data.append(row)
+                    if file_rows_needed is not None and len(data) >= file_rows_needed:
+                        break
+
+            data = data[:last_row_with_data + 1]
+
+            if data:
+                max_width = max(len(row) for row in data)
+                if min(len(row) for row in data) < max_width:
+                    data = [row + (max_width - len(row)) * [''] for row in data]
+            return data
+
+        # Values of a row's cells by column, like openpyxl's read-only rows: the
+        # last cell sets the width and gaps are empty
+        def _convert_row(self, element):
+            cells = []
+            column = 0
+            for cell in element:
+                reference = cell.get('r')
+                column = column_number(reference) if reference else column + 1
+                cells.append((column, self._convert_cell(cell)))
+            if not cells:
+                return []
+
+            width = cells[-1][0]
+            if len(cells) == width and all(column == i + 1 for i, (column, _) in enumerate(cells)):
+                return [value for _, value in cells]
+
+            row = [''] * width
+            for column, value in cells:
+                if 1 <= column <= width:
+                    row[column - 1] = value
+            return row
+
+        # Cell value as openpyxl reads it (data_only), then as pandas' openpyxl
+        # reader converts it: empty cells are '', errors NaN and integral numbers int
+        def _convert_cell(self, cell):
+            data_type = cell.get('t', 'n')
+
+            if data_type == 'inlineStr':
+                child = cell.find(INLINE_STRING_TAG)
+                return Text.from_tree(child).content if child is not None else ''
+
+            text = cell.findtext(VALUE_TAG)
+            if not text:
+                return ''
+
+            if data_type == 'n':
+                value = float(text) if ('.' in text or 'E' in text or 'e' in text) else int(text)
+                style_id = cell.get('s')
+                style_id = int(style_id) if style_id else 0
+                if style_id in self.book.date_formats:
+                    try:
+                        return from_excel(value, self.book.epoch, timedelta=style_id in self.book.timedelta_formats)
+                    except (OverflowError, ValueError):
+                        return np.nan
+                integral = int(value)
+                return integral if integral == value else float(value)
+            if data_type == 's':
+                return self.book.shared_strings[int(text)]
+            if data_type == 'b':
+                return bool(int(text))
+            if data_type == 'e':
+                return np.nan
+            if data_type == 'd':
+                return from_ISO8601(text)
+            return text
+else:
+    StreamingXlsxReader = None
+
+
+_column_numbers = {}
+
+
+# Column number (1-based) of a cell reference like "AB12"
+def column_number(reference):
+    letters = reference.rstrip('0123456789')
+    number = _column_numbers.get(letters)
+    if number is None:
+        number = 0
+        for letter in letters.upper():
+            number = number * 26 + ord(letter) - 64
+        _column_numbers[letters] = number
+    return number
@@ -0,0 +1,147 @@
+import os
+import time
+import uuid
+import threading
+from functools import partial
+from concurrent.futures import Future, ProcessPoolExecutor
+import columnar_store
+
+# Background ingestion of uploaded workbooks. Each sheet is parsed and stored in
+# the columnar format by a separate worker process, so a large workbook uses all
+# cores and no request thread waits for it. Progress is tracked per job:
+#
+#   {"jobId": "...", "filename": "...", "status": "running" | "done",
+#    "sheets": [{"name": "Data", "status": "pending" | "ready" | "failed", ...}],
+#    "readySheets": 1, "totalSheets": 2}
+#
+# Ready sheets also report their row count, column types and memory (the bytes
+# their columns hold as parsed and as stored, see compact_dtypes), and
+# appendedRows when only the rows added since the previous version of the
+# workbook were parsed; failed ones their error (they are then read straight
+# from the workbook, as before). Jobs only live in the process that started them.
+
+JOB_HISTORY = 256
+
+
+class IngestJobs:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    @staticmethod
+    def _file_key(filepath):
+        return os.path.abspath(filepath)
+
+    # Start ingesting a workbook and return the job id. A workbook that is
+    # already being ingested keeps its running job. With previous_filepath (an
+    # earlier version of the workbook), sheets that were only appended to are
+    # built from its stored sheets.
+    def submit(self, filepath, filename, sheet_names, previous_filepath=None):
+        file_key = self._file_key(filepath)
+
+        with self._lock:
+            if file_key in self._active:
+                return self._active[file_key]
+
+            columnar_store.begin_workbook(filepath, sheet_names)
+
+            job = {
+                'jobId': uuid.uuid4().hex,
+                'filename': filename,
+                'filepath': filepath,
+                'status': 'running',
+                'sheets': {name: {'name': name, 'status': 'pending'} for name in sheet_names},
+                'started': time.time(),
+                'finished': None
+            }
+            self._jobs[job['jobId']] = job
+            self._active[file_key] = job['jobId']
+            self._prune()
+
+            if not sheet_names:
+                self._finish(job)
+                return job['jobId']
+
+        for i, sheet_name in enumerate(sheet_names):
+            executor = self._get_executor()
+            try:
+                future = executor.submit(columnar_store.convert_sheet, filepath, sheet_name, i, previous_filepath)
+            except Exception as e:
+                # A worker that died breaks the pool; start a new one for later jobs
+                self._reset(executor)
+                future = Future()
+                future.set_exception(e)
+            future.add_done_callback(partial(self._sheet_done, job, sheet_name))
+
+        return job['jobId']
+
+    def _sheet_done(self, job, sheet_name, future):
+        with self._lock:
+            sheet = job['sheets'][sheet_name]
+            try:
+                sheet_info = future.result()
+                columnar_store.add_sheet(job['filepath'], sheet_name, sheet_info)
+                sheet.update(status='ready', rows=sheet_info['rows'], columns=sheet_info['types'], memory=sheet_info['memory'])
+                if 'appendedRows' in sheet_info:
+                    sheet['appendedRows'] = sheet_info['appendedRows']
+            except Exception as e:
+                sheet.update(status='failed', error=str(e))
+
+            if all(s['status'] != 'pending' for s in job['sheets'].values()):
+                self._finish(job)
+
+    def _finish(self, job):
+        try:
+            columnar_store.finish_workbook(job['filepath'])
+        except OSError:
+            pass
+        job['status'] = 'done'
+        job['finished'] = time.time()
+        self._active.pop(self._file_key(job['filepath']), None)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] == 'done']
+        for job_id in finished[:max(0, len(self._jobs) - JOB_HISTORY)]:
+            del self._jobs[job_id]
+
+    # Id of the job still ingesting this sheet, or None if it can be read now
+    def pending_job(self, filepath, sheet_name):
+        with self._lock:
+            job_id = self._active.get(self._file_key(filepath))
+            if job_id is None:
+                return None
+            sheet = self._jobs[job_id]['sheets'].get(sheet_name)
+            return job_id if sheet and sheet['status'] == 'pending' else None
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+
+            sheets = [dict(sheet) for sheet in job['sheets'].values()]
+            finished = job['finished'] or time.time()
+            return {
+                'jobId': job_id,
+                'filename': job['filename'],
+                'status': job['status'],
+                'sheets': sheets,
+                'readySheets': sum(sheet['status'] == 'ready' for sheet in sheets),
+                'totalSheets': len(sheets),
+                'elapsed': round(finished - job['started'], 3)
+            }
@@ -0,0 +1,264 @@
+import os
+import time
+import bisect
+import cProfile
+import uuid
+import random
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+from collections import defaultdict
+
+# Request instrumentation. Every request gets a RequestTimer that the data
+# helpers report into:
+#
+#   queue       waiting for a request slot (serving.RequestLimiter)
+#   parse       reading sheets, column indexes and rollups (cached or not)
+#   filter      applying the row window and filters
+#   aggregate   turning rows into chart data
+#   render      drawing chart images
+#   serialize   building and encoding the response body
+#   compress    gzip/brotli encoding of the body
+#
+# Stage times are exclusive (a parse inside an aggregate counts as parse only),
+# so they add up to at most the request's total. They are sent back in a
+# Server-Timing header and accumulated by Metrics, which renders them with the
+# other counters in the Prometheus text format for /metrics.
+#
+# Chart computations that run in a chart worker process are timed there with
+# run_timed() and their stages merged into the request's timer.
+
+STAGES = ('queue', 'parse', 'filter', 'aggregate', 'render', 'serialize', 'compress')
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_timer = contextvars.ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.rows = 0
+        self._open = []
+
+    def enter(self, name):
+        self._open.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, started, nested = self._open.pop()
+        elapsed = time.perf_counter() - started
+        self.stages[name] += elapsed - nested
+        if self._open:
+            self._open[-1][2] += elapsed
+
+    def merge(self, stages, rows):
+        for name, seconds in stages.items():
+            self.stages[name] += seconds
+        self.rows += rows
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+
+def start_request():
+    timer = RequestTimer()
+    _current_timer.set(timer)
+    return timer
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+def end_request():
+    _current_timer.set(None)
+
+
+# Time a block as one stage of the current request (a no-op outside requests)
+@contextmanager
+def stage(name):
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    timer.enter(name)
+    try:
+        yield
+    finally:
+        timer.exit()
+
+
+# Decorator timing every call of a function as a stage
+def timed_stage(name):
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_rows(count):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.rows += count
+
+
+# Call fn(*args) under a timer of its own and return (result, stages, rows), so
+# stages timed in a worker process can be merged into the request's timer
+def run_timed(fn, *args):
+    timer = RequestTimer()
+    token = _current_timer.set(timer)
+    try:
+        return fn(*args), dict(timer.stages), timer.rows
+    finally:
+        _current_timer.reset(token)
+
+
+def server_timing_header(timer):
+    parts = [f'{name};dur={timer.stages[name] * 1000:.2f}' for name in STAGES if name in timer.stages]
+    parts.append(f'total;dur={timer.total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels, le=repr(float(bound)))} {cumulative}')
+        lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {self.count}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum!r}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(Histogram)
+        self.stage_latency = defaultdict(Histogram)
+        self.bytes_served = defaultdict(int)
+        self.rows_processed = defaultdict(int)
+
+    def observe(self, route, method, status, timer, nbytes):
+        with self._lock:
+            self.requests[(route, method, status)] += 1
+            self.latency[route].observe(timer.total)
+            for name, seconds in timer.stages.items():
+                self.stage_latency[(route, name)].observe(seconds)
+            self.bytes_served[route] += nbytes
+            self.rows_processed[route] += timer.rows
+
+    # Prometheus text exposition of the request metrics plus gauges/counters
+    # from stats() dicts, given as {cache name: stats} for caches and the
+    # request limiter's stats
+    def render(self, cache_stats, limiter_stats):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        with self._lock:
+            family('http_requests_total', 'counter', 'Requests handled, by route, method and status.')
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{format_labels([("route", route), ("method", method), ("status", status)])} {count}')
+
+            family('http_request_duration_seconds', 'histogram', 'Request latency, by route.')
+            for route, histogram in sorted(self.latency.items()):
+                lines.extend(histogram.lines('http_request_duration_seconds', [('route', route)]))
+
+            family('http_request_stage_duration_seconds', 'histogram', 'Time spent in each request stage, by route.')
+            for (route, name), histogram in sorted(self.stage_latency.items()):
+                lines.extend(histogram.lines('http_request_stage_duration_seconds', [('route', route), ('stage', name)]))
+
+            family('http_response_bytes_total', 'counter', 'Response body bytes sent (after compression), by route.')
+            for route, nbytes in sorted(self.bytes_served.items()):
+                lines.append(f'http_response_bytes_total{format_labels([("route", route)])} {nbytes}')
+
+            family('rows_processed_total', 'counter', 'Sheet and rollup rows selected by requests, by route.')
+            for route, rows in sorted(self.rows_processed.items()):
+                lines.append(f'rows_processed_total{format_labels([("route", route)])} {rows}')
+
+        for name, kind, key, help_text in (
+                ('cache_hits_total', 'counter', 'hits', 'Cache lookups answered from the cache.'),
+                ('cache_misses_total', 'counter', 'misses', 'Cache lookups that had to compute the value.'),
+                ('cache_evictions_total', 'counter', 'evictions', 'Entries evicted to stay within the size bound.'),
+                ('cache_hit_ratio', 'gauge', 'hitRate', 'Share of lookups answered from the cache.'),
+                ('cache_entries', 'gauge', 'entries', 'Entries currently cached.'),
+                ('cache_bytes', 'gauge', 'currentBytes', 'Estimated size of the cached entries.'),
+                ('cache_max_bytes', 'gauge', 'maxBytes', 'Size bound of the cache.')):
+            family(name, kind, help_text)
+            for cache, stats in cache_stats.items():
+                lines.append(f'{name}{format_labels([("cache", cache)])} {stats[key]}')
+
+        for name, kind, key, help_text in (
+                ('requests_in_progress', 'gauge', 'active', 'Data requests holding a request slot.'),
+                ('requests_queued', 'gauge', 'queued', 'Data requests waiting for a request slot.'),
+                ('requests_rejected_total', 'counter', 'rejected', 'Data requests turned away after waiting for a slot.')):
+            family(name, kind, help_text)
+            lines.append(f'{name} {limiter_stats[key]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# Opt-in profiling: a sample of requests runs under cProfile, and the stats of
+# those that took longer than threshold seconds are written to directory as
+# <time>-<route>-<ms>-<id>.prof (open them with pstats or snakeviz). Only the request
+# thread is profiled, so run chart computations in it (CHART_WORKERS=0) to see them.
+class SlowRequestProfiler:
+    def __init__(self, threshold, sample_rate, directory):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.directory = directory
+
+    @property
+    def enabled(self):
+        return self.threshold > 0 and self.sample_rate > 0
+
+    def start(self):
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return None
+        return profiler
+
+    def finish(self, profiler, route, duration):
+        profiler.disable()
+        if duration < self.threshold:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'index'
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{int(duration * 1000)}ms-{uuid.uuid4().hex[:8]}.prof')
+        profiler.dump_stats(path)
+        return path
@@ -0,0 +1,207 @@
+import gzip
+import json
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict
+from flask import request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Cache of serialized responses for chart routes, whose result only depends
+# on the request body and the uploaded file. Entries are keyed by a hash of the
+# route, the canonical (key-sorted) request body and the file's mtime/size, and
+# evicted least recently used first once max_bytes is exceeded.
+#
+# Every cached response carries a strong ETag (the hash of its body, plus the
+# content coding for compressed copies), so a client that repeats a request with
+# If-None-Match gets an empty 304. Compressed copies are made on first use and
+# kept with the entry.
+#
+# Only successful results are cached: routes mark the JSON responses they build
+# from one with mark_cacheable, so the body never has to be decoded again to
+# find out (images are only ever sent for a successful result).
+
+MIN_COMPRESS_BYTES = 1024
+
+# Rendered chart images (/render_chart) are cached too; PNGs are already
+# compressed, so they are always sent as they are
+IMAGE_MIMETYPES = {'image/svg+xml', 'image/png'}
+PRECOMPRESSED_MIMETYPES = {'image/png'}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def supported_encodings():
+    return ['br', 'gzip'] if brotli else ['gzip']
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+# Content coding to use for a body of this size, given the client's Accept-Encoding
+def choose_encoding(size):
+    if size < MIN_COMPRESS_BYTES:
+        return None
+    return request.accept_encodings.best_match(supported_encodings())
+
+
+# Compress an ordinary (uncached, fully buffered) response when the client accepts it
+def compress_response(response):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(response.calculate_content_length() or 0)
+    if encoding:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def mark_cacheable(response, cacheable=True):
+    response.cacheable = cacheable
+    return response
+
+
+def cacheable(response):
+    if response.status_code != 200:
+        return False
+    if response.mimetype in IMAGE_MIMETYPES:
+        return True
+    return response.mimetype == 'application/json' and getattr(response, 'cacheable', False)
+
+
+class CachedResponse:
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self.encoded = {}
+
+    @property
+    def nbytes(self):
+        return len(self.body) + sum(len(body) for body in self.encoded.values())
+
+    def etag(self, encoding=None):
+        return f'{self.digest}-{encoding}' if encoding else self.digest
+
+
+class ResponseCache:
+    def __init__(self, max_bytes, version_of):
+        self.max_bytes = max_bytes
+        self.version_of = version_of
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    # Key for the current request, or None if it shouldn't be cached
+    def _make_key(self, data):
+        if self.max_bytes <= 0 or not isinstance(data, dict):
+            return None
+        version = self.version_of(data)
+        if version is None:
+            return None
+        canonical = json.dumps([request.path, data, version], sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def _put(self, key, entry):
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old.nbytes
+            self._entries[key] = entry
+            self.current_bytes += entry.nbytes
+            self._evict()
+
+    def _add_encoding(self, key, entry, encoding):
+        body = compress(entry.body, encoding)
+        with self._lock:
+            if encoding not in entry.encoded:
+                entry.encoded[encoding] = body
+                if self._entries.get(key) is entry:
+                    self.current_bytes += len(body)
+                    self._evict()
+        return entry.encoded[encoding]
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.current_bytes -= entry.nbytes
+            self.evictions += 1
+
+    def _respond(self, key, entry):
+        encoding = None if entry.mimetype in PRECOMPRESSED_MIMETYPES else choose_encoding(len(entry.body))
+        etag = entry.etag(encoding)
+
+        # Either representation's tag proves the client already has this result
+        if request.if_none_match.contains(etag) or request.if_none_match.contains(entry.etag()):
+            with self._lock:
+                self.not_modified += 1
+            response = Response(status=304)
+        else:
+            body = self._add_encoding(key, entry, encoding) if encoding else entry.body
+            response = Response(body, mimetype=entry.mimetype)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    # Decorator for routes whose successful JSON (or image) responses can be reused
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = self._make_key(request.get_json(silent=True))
+            if key is None:
+                return view(*args, **kwargs)
+
+            entry = self._get(key)
+            if entry is None:
+                response = view(*args, **kwargs)
+                if not cacheable(response):
+                    return response
+                entry = CachedResponse(response.get_data(), response.mimetype)
+                self._put(key, entry)
+
+            return self._respond(key, entry)
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'notModified': self.not_modified,
+                'evictions': self.evictions,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'currentBytes': self.current_bytes,
+                'maxBytes': self.max_bytes
+            }
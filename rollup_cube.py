@@ -0,0 +1,183 @@
+import os
+import uuid
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+import compact_dtypes
+
+# Pre-aggregated rollups of a stored sheet, built the first time a chart asks for
+# them and kept next to its columns:
+#
+#   uploads/report.xlsx.columns/sheet_0/rollups/<hash of the group keys>.pkl
+#
+# A rollup holds the sum of every numeric column and the row count for each
+# x-axis label, or for each (filter value, x-axis label) pair. Groups keep the
+# order in which they first appear and include empty labels, so one filter
+# value's slice has one row per label in the same order as the filtered rows
+# would produce them; process_chart_data turns it into the same chart as the
+# raw rows (see process_chart_data_by_filter, which relies on the same property).
+# Key combinations with more than MAX_GROUPS groups are recorded as unavailable
+# and charted from the raw rows.
+#
+# When a sheet only gains rows at the bottom (see columnar_store.appended_sheet),
+# rollups with integer sums carry over with the new rows' sums added. Float sums
+# added up in two parts can differ in the last digit from one pass over all rows,
+# so those rollups are left to be built again the first time they are needed.
+
+MAX_GROUPS = 10000
+ROLLUP_DIR = 'rollups'
+
+
+class Rollup:
+    def __init__(self, keys, sums=None, sizes=None):
+        self.keys = keys
+        self.sums = sums
+        self.sizes = sizes
+
+    @property
+    def available(self):
+        return self.sums is not None
+
+    @property
+    def nbytes(self):
+        if not self.available:
+            return 0
+        return int(self.sums.memory_usage(index=True, deep=True).sum() + self.sizes.memory_usage(index=True))
+
+    # The rollup rows for the whole sheet (filter_value left out) or for the rows
+    # whose filter column == filter_value, as a frame with one row per label, and
+    # the number of sheet rows they cover. None if the value matches more than one
+    # distinct key, which the rollup can't combine exactly.
+    def select(self, *filter_value):
+        sums, sizes = self.sums, self.sizes
+
+        if filter_value:
+            filter_keys = sums.index.get_level_values(0)
+            mask = (pd.Series(filter_keys) == filter_value[0]).to_numpy()
+            if len(pd.unique(filter_keys[mask])) > 1:
+                return None
+            sums, sizes = sums[mask], sizes[mask]
+            if sums.index.nlevels > 1:
+                sums = sums.droplevel(0)
+
+        return keys_to_columns(sums), int(sizes.sum())
+
+
+# Sum columns and count rows per group of keys, with groups in order of first
+# appearance and empty keys kept. Keys are grouped by their factorized codes and
+# mapped back afterwards: grouping on an object column directly would rebuild its
+# labels with inferred types (a mix of 3 and 20.5 comes back as 3.0 and 20.5),
+# unlike df[key].unique(). Returns (sums, sizes), or None with more than
+# max_groups groups. With row_sizes, each row of df counts as that many rows.
+# Categorical columns (see compact_dtypes) are keyed and summed as objects.
+def group_sums(df, keys, columns, max_groups=None, row_sizes=None):
+    df = compact_dtypes.as_object(df, keys + columns)
+    codes, uniques = zip(*(pd.factorize(df[key], use_na_sentinel=False) for key in keys))
+    grouped = df[columns].groupby(list(codes), sort=False)
+    if max_groups is not None and grouped.ngroups > max_groups:
+        return None
+
+    sums = grouped.sum()
+    if row_sizes is None:
+        sizes = grouped.size()
+    else:
+        sizes = pd.Series(row_sizes).groupby(list(codes), sort=False).sum()
+
+    levels = [sums.index.get_level_values(i) for i in range(len(keys))]
+    values = [key_uniques.take(level) for key_uniques, level in zip(uniques, levels)]
+    index = pd.MultiIndex.from_arrays(values, names=keys) if len(keys) > 1 else values[0].rename(keys[0])
+    sums.index = index
+    sizes.index = index
+    return sums, sizes
+
+
+# Turn grouped sums back into a frame with the keys as columns. Like reset_index(),
+# which would also infer new types for object keys.
+def keys_to_columns(sums):
+    frame = sums.reset_index(drop=True)
+    for i, name in enumerate(sums.index.names):
+        frame.insert(i, name, sums.index.get_level_values(i))
+    return frame
+
+
+def build_rollup(df, keys, numeric_columns):
+    grouped = group_sums(df, keys, numeric_columns, MAX_GROUPS)
+    if grouped is None:
+        return Rollup(keys)
+    return Rollup(keys, *grouped)
+
+
+def rollup_file(sheet_path, keys):
+    digest = hashlib.sha1(repr(keys).encode('utf-8')).hexdigest()
+    return os.path.join(sheet_path, ROLLUP_DIR, f'{digest}.pkl')
+
+
+# Load the rollup for these group keys from disk, or build and save it
+def load_or_build(sheet_path, keys, load_frame, numeric_columns):
+    path = rollup_file(sheet_path, keys)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            rollup = pickle.load(f)
+        if rollup.keys == keys:
+            return rollup
+
+    rollup = build_rollup(load_frame(), keys, numeric_columns)
+    save_rollup(path, rollup)
+    return rollup
+
+
+def save_rollup(path, rollup):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging = f'{path}.tmp-{uuid.uuid4().hex}'
+    with open(staging, 'wb') as f:
+        pickle.dump(rollup, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(staging, path)
+
+
+# A rollup of a sheet's earlier rows extended with the rows added after them, or
+# None if its sums can't be extended exactly. New keys come after the earlier
+# ones in order of first appearance, as in a rollup of all rows.
+def extend_rollup(rollup, new_rows):
+    if not rollup.available or len(new_rows) == 0:
+        return rollup
+    if any(dtype.kind not in 'iu' for dtype in rollup.sums.dtypes):
+        return None
+
+    columns = list(rollup.sums.columns)
+    sums, sizes = group_sums(new_rows, rollup.keys, columns)
+    frame = pd.concat([keys_to_columns(rollup.sums), keys_to_columns(sums)], ignore_index=True)
+    row_sizes = np.concatenate([rollup.sizes.to_numpy(), sizes.to_numpy()])
+    grouped = group_sums(frame, rollup.keys, columns, MAX_GROUPS, row_sizes)
+    if grouped is None:
+        return Rollup(rollup.keys)
+    return Rollup(rollup.keys, *grouped)
+
+
+# Carry the rollups stored for an earlier version of a sheet over to the sheet
+# with new_rows appended (see extend_rollup)
+def extend_rollups(previous_path, sheet_path, new_rows):
+    previous_dir = os.path.join(previous_path, ROLLUP_DIR)
+    if not os.path.isdir(previous_dir):
+        return
+
+    for name in os.listdir(previous_dir):
+        if not name.endswith('.pkl'):
+            continue
+        with open(os.path.join(previous_dir, name), 'rb') as f:
+            rollup = pickle.load(f)
+        rollup = extend_rollup(rollup, new_rows)
+        if rollup is not None:
+            save_rollup(rollup_file(sheet_path, rollup.keys), rollup)
+
+
+# Names of the numeric columns in a sheet's recorded column types
+def numeric_columns(column_types):
+    numeric = []
+    for column in column_types:
+        try:
+            if np.dtype(column['dtype']).kind in 'biuf':
+                numeric.append(column['name'])
+        except TypeError:
+            continue
+    return numeric
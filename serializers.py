@@ -0,0 +1,166 @@
+import json
+import uuid
+import decimal
+from datetime import date
+from functools import partial
+import numpy as np
+import pandas as pd
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+from metrics import stage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON encoding for every response (installed as the app's JSON provider, so
+# jsonify() goes through it). With orjson installed, NumPy arrays and scalars
+# are written straight from their buffers and NaN becomes null, so routes can
+# hand over DataFrame columns and records without cleaning them first. Without
+# orjson the json module is used, with NaN replaced by None beforehand.
+# Dates keep Flask's HTTP date format and keys are sorted, as with the default
+# provider.
+
+ORJSON_OPTIONS = (
+    orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if orjson else 0
+)
+
+# Column-oriented response format, sent to clients that ask for it with
+#   Accept: application/vnd.chartgen.columnar+json
+# (or "format": "columnar" in the request body):
+#
+#   {"success": true, ..., "format": "columnar",
+#    "data": [{"name": "Year", "type": "int", "values": [2011, 2012, ...]},
+#             {"name": "District", "type": "string", "values": ["Pune", null, ...]}]}
+#
+# Column names are sent once instead of once per row, numeric columns are plain
+# typed arrays and an empty cell is a single null. The body is produced by a
+# generator a chunk of rows at a time, so no list-of-records copy of the sheet
+# is ever built.
+
+COLUMNAR_MIMETYPE = 'application/vnd.chartgen.columnar+json'
+STREAM_CHUNK_ROWS = 10000
+
+
+def wants_columnar(request, data=None):
+    if data and data.get('format') == 'columnar':
+        return True
+    best = request.accept_mimetypes.best_match([COLUMNAR_MIMETYPE, 'application/json'])
+    return best == COLUMNAR_MIMETYPE
+
+
+def json_default(value, format_date=http_date):
+    if value is pd.NaT:
+        return None
+    if isinstance(value, np.ndarray):
+        return array_to_list(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, date):
+        return format_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# The columnar format sends dates as ISO 8601 strings
+iso_json_default = partial(json_default, format_date=lambda value: value.isoformat())
+
+
+# Arrays orjson can't write natively (object, string, datetime) or any array
+# when orjson isn't installed
+def array_to_list(values):
+    if values.dtype.kind in 'biu':
+        return values.tolist()
+    if values.dtype.kind == 'M':
+        values = pd.DatetimeIndex(values.ravel()).to_numpy(dtype=object).reshape(values.shape)
+    mask = pd.isna(values)
+    values = values.astype(object)
+    values[mask] = None
+    return values.tolist()
+
+
+# Replace float NaN with None in plain Python containers (json module fallback only)
+def replace_nan(obj):
+    if isinstance(obj, float):
+        return None if obj != obj else obj
+    if isinstance(obj, dict):
+        return {key: replace_nan(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [replace_nan(value) for value in obj]
+    return obj
+
+
+def dumps(obj, indent=False, sort_keys=False):
+    if orjson:
+        options = ORJSON_OPTIONS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        if sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=json_default, option=options).decode()
+    return json.dumps(
+        replace_nan(obj),
+        default=json_default,
+        indent=2 if indent else None,
+        separators=None if indent else (',', ':'),
+        sort_keys=sort_keys
+    )
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with stage('serialize'):
+            return dumps(obj, indent=bool(kwargs.get('indent')), sort_keys=self.sort_keys)
+
+
+def column_type(series):
+    kind = series.dtype.kind
+    if kind in 'iu':
+        return 'int'
+    if kind == 'f':
+        return 'float'
+    if kind == 'b':
+        return 'bool'
+    if kind == 'M':
+        return 'datetime'
+    return 'string'
+
+
+# Encode one chunk of a column as the comma-separated body of a JSON array
+def encode_column_chunk(series, col_type):
+    if col_type in ('int', 'bool'):
+        values = series.tolist()
+    else:
+        values = series.to_numpy(dtype=object)
+        values[series.isna().to_numpy()] = None
+        values = values.tolist()
+    return json.dumps(values, default=iso_json_default)[1:-1]
+
+
+def iter_columnar_json(df, fields):
+    header = {'format': 'columnar', **fields}
+    yield json.dumps(header, default=iso_json_default)[:-1] + ', "data": ['
+
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        col_type = column_type(series)
+
+        prefix = ', ' if i else ''
+        yield f'{prefix}{{"name": {json.dumps(series.name, default=iso_json_default)}, "type": "{col_type}", "values": ['
+
+        for start in range(0, len(series), STREAM_CHUNK_ROWS):
+            chunk = encode_column_chunk(series.iloc[start:start + STREAM_CHUNK_ROWS], col_type)
+            if chunk:
+                yield (', ' if start else '') + chunk
+        yield ']}'
+
+    yield ']}'
+
+
+# Stream df (plus any extra top-level fields) in the columnar format
+def columnar_response(df, **fields):
+    return Response(iter_columnar_json(df, fields), mimetype=COLUMNAR_MIMETYPE)
@@ -0,0 +1,116 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Load control for serving the app to many users at once (see wsgi.py):
+#
+#   RequestLimiter  caps how many data requests run at the same time; the rest
+#                   wait for a free slot, and give up with a 503 after queue_timeout
+#   ChartWorkers    runs chart computations in a pool of worker processes, so the
+#                   request threads only wait on them and pandas work on one
+#                   request doesn't hold up the others. Results that take longer
+#                   than timeout are abandoned and reported as timed out; if the
+#                   computation already started, later ones go to a fresh pool
+#                   while the old one finishes it and shuts down.
+#
+# Chart workers are started with "spawn" rather than forked from the threaded
+# server, where another thread could be holding a lock (e.g. the sheet cache's)
+# at the moment of the fork. Each worker keeps its own parsed-sheet cache.
+
+
+# Raised by ChartWorkers.run for a result that took longer than the timeout.
+# (future.result() raises concurrent.futures.TimeoutError, which is only the
+# builtin TimeoutError from Python 3.11 on.)
+class ChartTimeout(Exception):
+    pass
+
+
+class RequestLimiter:
+    def __init__(self, max_concurrent, queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+
+    # Wait for a free slot; False if none came free within queue_timeout
+    def acquire(self):
+        if self._slots is None:
+            return True
+
+        with self._lock:
+            self.queued += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.queued -= 1
+            if acquired:
+                self.active += 1
+            else:
+                self.rejected += 1
+        return acquired
+
+    def release(self):
+        if self._slots is None:
+            return
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self.active,
+                'queued': self.queued,
+                'rejected': self.rejected,
+                'maxConcurrent': self.max_concurrent
+            }
+
+
+class ChartWorkers:
+    def __init__(self, max_workers, timeout):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    # Call fn(*args) in a worker process and return its result. fn must be a
+    # module-level function. Without workers it runs in the calling thread (and
+    # isn't timed out). Raises ChartTimeout when the result takes too long.
+    def run(self, fn, *args):
+        if self.max_workers <= 0:
+            return fn(*args)
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker that died breaks the pool; start a new one
+            self._reset(executor)
+            executor = self._get_executor()
+            future = executor.submit(fn, *args)
+
+        try:
+            return future.result(timeout=self.timeout or None)
+        except FutureTimeoutError:
+            if not future.cancel():
+                self._reset(executor)
+            raise ChartTimeout()
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
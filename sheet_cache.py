@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+
+# In-process LRU cache of parsed sheets (and their column indexes), so the data
+# routes don't re-read the workbook on every request. Entries are keyed by
+# (file, sheet, mtime, size), which means an overwritten upload never serves
+# stale data even if nobody calls invalidate(). DataFrames handed out by the
+# cache are shared between requests and must be treated as read-only.
+class SheetCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _file_key(filepath):
+        return os.path.abspath(filepath)
+
+    def _make_key(self, filepath, sheet_name):
+        stat = os.stat(filepath)
+        return (self._file_key(filepath), sheet_name, stat.st_mtime_ns, stat.st_size)
+
+    def get(self, filepath, sheet_name, loader):
+        key = self._make_key(filepath, sheet_name)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Parse outside the lock so a slow workbook doesn't block other sheets.
+        # A loader that returns None has nothing to cache.
+        df = loader()
+        if df is None:
+            return None
+        nbytes = self._sizeof(df)
+
+        # Don't let a single oversized sheet flush the whole cache
+        if nbytes > self.max_bytes:
+            return df
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (df, nbytes)
+                self.current_bytes += nbytes
+                self._evict()
+        return df
+
+    @staticmethod
+    def _sizeof(value):
+        # DataFrames, or anything else that reports its own nbytes (e.g. sheet indexes)
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(index=True, deep=True).sum())
+        return int(value.nbytes)
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.current_bytes -= nbytes
+            self.evictions += 1
+
+    def invalidate(self, filepath):
+        file_key = self._file_key(filepath)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == file_key]:
+                _, nbytes = self._entries.pop(key)
+                self.current_bytes -= nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'currentBytes': self.current_bytes,
+                'maxBytes': self.max_bytes
+            }
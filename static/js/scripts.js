@@ -30,6 +30,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const downloadImageBtn = document.getElementById('downloadImageBtn');
     const downloadCodeBtn = document.getElementById('downloadCodeBtn');
     const copyDataBtn = document.getElementById('copyDataBtn');
+    const chartDownsampleNote = document.getElementById('chartDownsampleNote');
+    const dataPreviewTable = document.getElementById('dataPreviewTable');
+    const dataPreviewStatus = document.getElementById('dataPreviewStatus');
     
     // Add this after the DOM elements declarations at the top
 
@@ -51,13 +54,30 @@ document.addEventListener('DOMContentLoaded', function() {
         '#e6e770', '#4d83c5', '#d3a037', '#779c51', '#b2d571'
     ];
     
+    // Largest number of points per series requested for line charts; the server
+    // downsamples bigger charts so the browser stays responsive
+    const maxChartPoints = 2000;
+    
+    // Number of sheet rows fetched per page for the data preview table
+    const previewPageSize = 100;
+    
+    // Milliseconds between retries while an uploaded sheet is still being processed
+    const ingestPollInterval = 500;
+    
+    // Number of chart responses kept for revalidation with If-None-Match
+    const chartResponseCacheSize = 50;
+    
     // State variables
     let currentFileName = '';
     let currentSheetName = '';
     let sheetData = [];
+    let previewRows = [];
+    let totalSheetRows = 0;
+    let loadingPreviewPage = false;
     let columns = [];
     let currentChart = null;
     let selectedChartType = '';
+    const chartResponses = new Map();
     
     // File upload handling
     excelFileInput.addEventListener('change', function(e) {
@@ -103,6 +123,44 @@ document.addEventListener('DOMContentLoaded', function() {
         uploadFile(file);
     });
     
+    // Function to POST a chart request, sending the ETag of the last identical
+    // request's response so the server can answer 304 instead of resending it
+    function postChartRequest(url, payload) {
+        const body = JSON.stringify(payload);
+        const cacheKey = url + body;
+        const cached = chartResponses.get(cacheKey);
+        const headers = {
+            'Content-Type': 'application/json',
+        };
+        if (cached) {
+            headers['If-None-Match'] = cached.etag;
+        }
+        
+        return fetch(url, {
+            method: 'POST',
+            headers: headers,
+            body: body
+        })
+        .then(response => {
+            if (response.status === 304 && cached) {
+                // Parse again so callers never share (and modify) one object
+                return JSON.parse(cached.text);
+            }
+            return response.text().then(text => {
+                const data = JSON.parse(text);
+                const etag = response.headers.get('ETag');
+                chartResponses.delete(cacheKey);
+                if (etag && data.success) {
+                    chartResponses.set(cacheKey, { etag: etag, text: text });
+                    if (chartResponses.size > chartResponseCacheSize) {
+                        chartResponses.delete(chartResponses.keys().next().value);
+                    }
+                }
+                return data;
+            });
+        });
+    }
+    
     // Function to upload the file to the server
     function uploadFile(file) {
         const formData = new FormData();
@@ -157,6 +215,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // Load data from selected sheet
     function loadSheetData() {
         loadingIndicator.classList.remove('hidden');
+        const requestedSheet = currentSheetName;
         
         fetch('/get_sheet_data', {
             method: 'POST',
@@ -165,20 +224,33 @@ document.addEventListener('DOMContentLoaded', function() {
             },
             body: JSON.stringify({
                 filename: currentFileName,
-                sheet: currentSheetName
+                sheet: currentSheetName,
+                offset: 0,
+                limit: previewPageSize
             })
         })
         .then(response => response.json())
         .then(data => {
+            // The sheet is still being processed after upload; try again shortly
+            if (data.status === 'pending') {
+                if (requestedSheet === currentSheetName) {
+                    setTimeout(loadSheetData, ingestPollInterval);
+                }
+                return;
+            }
+            
             loadingIndicator.classList.add('hidden');
             
             if (data.success) {
                 columns = data.columns;
                 sheetData = data.data;
+                previewRows = data.data;
+                totalSheetRows = data.totalRows;
                 
                 // Update row count
-                endRowInput.value = data.rowCount + 1; // +1 for header row
+                endRowInput.value = data.totalRows + 1; // +1 for header row
                 
+                renderPreviewTable();
                 populateColumnSelectors();
                 populateFilterColumns();
                 chartTypeSelection.classList.remove('hidden');
@@ -193,6 +265,93 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Render the data preview table with the rows fetched so far
+    function renderPreviewTable() {
+        const table = document.createElement('table');
+        const headerRow = table.createTHead().insertRow();
+        columns.forEach(column => {
+            const th = document.createElement('th');
+            th.textContent = column;
+            headerRow.appendChild(th);
+        });
+        table.createTBody();
+        
+        dataPreviewTable.innerHTML = '';
+        dataPreviewTable.appendChild(table);
+        dataPreviewTable.scrollTop = 0;
+        appendPreviewRows(previewRows);
+    }
+    
+    // Append rows to the data preview table
+    function appendPreviewRows(rows) {
+        const tbody = dataPreviewTable.querySelector('tbody');
+        rows.forEach(row => {
+            const tr = tbody.insertRow();
+            columns.forEach(column => {
+                tr.insertCell().textContent = row[column] !== null ? row[column] : '';
+            });
+        });
+        dataPreviewStatus.textContent = `Showing ${previewRows.length} of ${totalSheetRows} rows`;
+    }
+    
+    // Fetch the next page of rows when the preview table is scrolled near the bottom
+    dataPreviewTable.addEventListener('scroll', function() {
+        const nearBottom = this.scrollTop + this.clientHeight >= this.scrollHeight - 50;
+        if (!nearBottom || loadingPreviewPage || previewRows.length >= totalSheetRows) return;
+        
+        loadingPreviewPage = true;
+        const requestedSheet = currentSheetName;
+        
+        fetch('/get_sheet_data', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                filename: currentFileName,
+                sheet: currentSheetName,
+                offset: previewRows.length,
+                limit: previewPageSize
+            })
+        })
+        .then(response => response.json())
+        .then(data => {
+            loadingPreviewPage = false;
+            
+            // Ignore pages that arrive after the user switched sheets
+            if (data.success && requestedSheet === currentSheetName) {
+                previewRows = previewRows.concat(data.data);
+                appendPreviewRows(data.data);
+            }
+        })
+        .catch(error => {
+            loadingPreviewPage = false;
+            console.error('Error:', error);
+        });
+    });
+    
+    // Fetch the distinct values of a column from the server
+    function fetchColumnValues(column) {
+        return fetch('/column_values', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                filename: currentFileName,
+                sheet: currentSheetName,
+                column: column
+            })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error);
+            }
+            return data.values;
+        });
+    }
+    
     // Populate column selectors
     function populateColumnSelectors() {
         // Clear existing options
@@ -336,17 +495,22 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Load filter values for selected column
     function loadFilterValues(column) {
-        // Get unique values for the column
-        const uniqueValues = [...new Set(sheetData.map(row => row[column]).filter(val => val !== null))];
-        
-        // Clear and populate the filter value select
-        filterValueSelect.innerHTML = '<option value="">All Values</option>';
-        
-        uniqueValues.forEach(value => {
-            const option = document.createElement('option');
-            option.value = value;
-            option.textContent = value;
-            filterValueSelect.appendChild(option);
+        // Get unique values for the column from the server, since only part of the sheet is loaded
+        fetchColumnValues(column)
+        .then(uniqueValues => {
+            // Clear and populate the filter value select
+            filterValueSelect.innerHTML = '<option value="">All Values</option>';
+            
+            uniqueValues.forEach(value => {
+                const option = document.createElement('option');
+                option.value = value;
+                option.textContent = value;
+                filterValueSelect.appendChild(option);
+            });
+        })
+        .catch(error => {
+            console.error('Error:', error);
+            alert('Error loading filter values. Please try again.');
         });
     }
     
@@ -412,8 +576,12 @@ document.addEventListener('DOMContentLoaded', function() {
     filterColumn2Select.addEventListener('change', function() {
         if (this.value) {
             // Get unique values for this column
-            const uniqueValues = [...new Set(sheetData.map(row => row[this.value]).filter(val => val !== null))];
-            populateChartFilterValues(uniqueValues);
+            fetchColumnValues(this.value)
+            .then(uniqueValues => populateChartFilterValues(uniqueValues))
+            .catch(error => {
+                console.error('Error:', error);
+                alert('Error loading chart filter values. Please try again.');
+            });
         } else {
             // Clear chart filter dropdown
             chartFilterValue.innerHTML = '<option value="">All Values</option>';
@@ -472,25 +640,19 @@ document.addEventListener('DOMContentLoaded', function() {
         // Generate the chart
         loadingIndicator.classList.remove('hidden');
         
-        fetch('/generate_chart', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                filename: currentFileName,
-                sheet: currentSheetName,
-                xAxis: xAxis,
-                yAxes: yAxes,
-                chartType: selectedChartType,
-                startRow: parseInt(startRowInput.value),
-                endRow: parseInt(endRowInput.value),
-                filterColumn: filterColumnSelect.value,
-                filterValue: filterValueSelect.value,
-                chartFilterColumn: filterColumn2Select.value
-            })
+        postChartRequest('/generate_chart', {
+            filename: currentFileName,
+            sheet: currentSheetName,
+            xAxis: xAxis,
+            yAxes: yAxes,
+            chartType: selectedChartType,
+            startRow: parseInt(startRowInput.value),
+            endRow: parseInt(endRowInput.value),
+            filterColumn: filterColumnSelect.value,
+            filterValue: filterValueSelect.value,
+            chartFilterColumn: filterColumn2Select.value,
+            maxPoints: maxChartPoints
         })
-        .then(response => response.json())
         .then(data => {
             loadingIndicator.classList.add('hidden');
             
@@ -500,6 +662,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 
                 // Create chart
                 createChart(data.chartData, data.chartType);
+                updateDownsampleNote(data.downsampling);
                 
                 // Scroll to chart
                 chartDisplay.scrollIntoView({ behavior: 'smooth' });
@@ -523,6 +686,16 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
+    // Show or hide the note telling the user the chart was downsampled
+    function updateDownsampleNote(downsampling) {
+        if (downsampling) {
+            chartDownsampleNote.textContent = `Showing ${downsampling.returnedPoints.toLocaleString()} of ${downsampling.originalPoints.toLocaleString()} points (downsampled for display).`;
+            chartDownsampleNote.classList.remove('hidden');
+        } else {
+            chartDownsampleNote.classList.add('hidden');
+        }
+    }
+    
     // Create chart with Chart.js
     function createChart(chartData, chartType) {
         // Clean up existing custom legend if any
@@ -968,32 +1141,26 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         
         // Send request to apply filter
-        fetch('/apply_chart_filter', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                filename: currentFileName,
-                sheet: currentSheetName,
-                xAxis: xAxisSelect.value,
-                yAxes: Array.from(document.querySelectorAll('.y-axis-item')).map(item => {
-                    return {
-                        column: item.querySelector('.y-axis-select').value,
-                        color: item.querySelector('.series-color').value
-                    };
-                }),
-                chartType: selectedChartType,
-                startRow: parseInt(startRowInput.value),
-                endRow: parseInt(endRowInput.value),
-                filterColumn: filterColumnSelect.value,
-                filterValue: filterValueSelect.value,
-                chartFilterColumn: filterColumn2Select.value,
-                chartFilterValue: filterValue,
-                visibleDatasets: visibleDatasets // Pass visible datasets for percentage calculation
-            })
+        postChartRequest('/apply_chart_filter', {
+            filename: currentFileName,
+            sheet: currentSheetName,
+            xAxis: xAxisSelect.value,
+            yAxes: Array.from(document.querySelectorAll('.y-axis-item')).map(item => {
+                return {
+                    column: item.querySelector('.y-axis-select').value,
+                    color: item.querySelector('.series-color').value
+                };
+            }),
+            chartType: selectedChartType,
+            startRow: parseInt(startRowInput.value),
+            endRow: parseInt(endRowInput.value),
+            filterColumn: filterColumnSelect.value,
+            filterValue: filterValueSelect.value,
+            chartFilterColumn: filterColumn2Select.value,
+            chartFilterValue: filterValue,
+            visibleDatasets: visibleDatasets, // Pass visible datasets for percentage calculation
+            maxPoints: maxChartPoints
         })
-        .then(response => response.json())
         .then(data => {
             // Remove loading message
             document.body.removeChild(loadingMessage);
@@ -1001,6 +1168,7 @@ document.addEventListener('DOMContentLoaded', function() {
             if (data.success) {
                 // Update chart with filtered data
                 updateChart(data.chartData);
+                updateDownsampleNote(data.downsampling);
                 
                 // If it's a percentage stacked bar and we have hidden datasets, recalculate
                 if (selectedChartType === 'percentStackedBar' && currentChart) {
@@ -1085,10 +1253,6 @@ document.addEventListener('DOMContentLoaded', function() {
         // Pre-generate filtered data for each filter option
         const preFilteredData = {};
         
-        // Track the number of fetch operations and completions
-        let fetchCount = 0;
-        let completedFetches = 0;
-        
         // Only process if there are filter options
         if (chartFilterColumn && chartFilterOptions.length > 0) {
             // Save current chart data and state
@@ -1099,65 +1263,49 @@ document.addEventListener('DOMContentLoaded', function() {
                 currentVisibility.push(!currentChart.getDatasetMeta(i).hidden);
             });
             
-            // Process each filter option sequentially for more reliable results
-            const processFilterOptions = async () => {
-                // Create an array of promises for fetch operations
-                const fetchPromises = [];
-                
-                for (const filterOption of chartFilterOptions) {
-                    if (!filterOption) {
-                        // Skip empty option (All Values)
-                        continue;
-                    }
-                    
-                    // Create a promise for this fetch operation
-                    const fetchPromise = fetch('/apply_chart_filter', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({
-                            filename: currentFileName,
-                            sheet: currentSheetName,
-                            xAxis: xAxisSelect.value,
-                            yAxes: Array.from(document.querySelectorAll('.y-axis-item')).map(item => {
-                                return {
-                                    column: item.querySelector('.y-axis-select').value,
-                                    color: item.querySelector('.series-color').value
-                                };
-                            }),
-                            chartType: selectedChartType,
-                            startRow: parseInt(startRowInput.value),
-                            endRow: parseInt(endRowInput.value),
-                            filterColumn: filterColumnSelect.value,
-                            filterValue: filterValueSelect.value,
-                            chartFilterColumn: chartFilterColumn,
-                            chartFilterValue: filterOption
-                        })
-                    })
-                    .then(response => response.json())
-                    .then(data => {
-                        if (data.success) {
-                            // Store the filtered data
-                            preFilteredData[filterOption] = data.chartData;
-                        }
-                        completedFetches++;
-                        
-                        // Update the loading message to show progress
-                        loadingDiv.textContent = `Preparing chart data... (${completedFetches}/${fetchCount})`;
+            // Fetch chart data for every filter option in a single request
+            const processFilterOptions = () => {
+                return fetch('/apply_chart_filter_batch', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        filename: currentFileName,
+                        sheet: currentSheetName,
+                        xAxis: xAxisSelect.value,
+                        yAxes: Array.from(document.querySelectorAll('.y-axis-item')).map(item => {
+                            return {
+                                column: item.querySelector('.y-axis-select').value,
+                                color: item.querySelector('.series-color').value
+                            };
+                        }),
+                        chartType: selectedChartType,
+                        startRow: parseInt(startRowInput.value),
+                        endRow: parseInt(endRowInput.value),
+                        filterColumn: filterColumnSelect.value,
+                        filterValue: filterValueSelect.value,
+                        chartFilterColumn: chartFilterColumn,
+                        maxPoints: maxChartPoints
                     })
-                    .catch(error => {
-                        console.error('Error pre-filtering data for ' + filterOption, error);
-                        completedFetches++;
-                        loadingDiv.textContent = `Preparing chart data... (${completedFetches}/${fetchCount})`;
-                    });
-                    
-                    fetchPromises.push(fetchPromise);
-                    fetchCount++;
-                }
-                
-                // Wait for all fetch operations to complete
-                return Promise.all(fetchPromises);
+                })
+                .then(response => response.json())
+                .then(data => {
+                    if (data.success) {
+                        // Store the filtered data for each option shown in the dropdown
+                        data.results.forEach(result => {
+                            const filterOption = String(result.value);
+                            if (filterOption && chartFilterOptions.includes(filterOption)) {
+                                preFilteredData[filterOption] = result.chartData;
+                            }
+                        });
+                    } else {
+                        console.error('Error pre-filtering data:', data.error);
+                    }
+                })
+                .catch(error => {
+                    console.error('Error pre-filtering data', error);
+                });
             };
             
             // Execute the fetch operations and then generate the HTML
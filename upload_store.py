@@ -0,0 +1,200 @@
+import os
+import uuid
+import hashlib
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+import pandas as pd
+
+# Uploads are stored under the SHA-256 of their contents:
+#
+#   uploads/3f5a...c9e1.xlsx          the workbook
+#   uploads/3f5a...c9e1.xlsx.columns/ its converted sheets (see columnar_store)
+#
+# The stored name is what the client gets back as "filename", so uploading the
+# same workbook twice (under any name, by anyone) reuses the stored copy and
+# its converted sheets, and two different workbooks with the same name can no
+# longer overwrite each other.
+#
+# Since a stored copy can be shared by several uploads, each upload holds a
+# reference to it (one file each, so processes can add and drop them without a
+# shared lock):
+#
+#   uploads/.refs/3f5a...c9e1.xlsx/<uuid>
+#
+# and deleting an upload drops its reference; the workbook and its converted
+# sheets are only removed with the last one. Taking a reference and linking the
+# stored copy, and dropping the last reference and removing it, each happen
+# under one lock, so an identical upload never gets a stored copy that a
+# concurrent delete is about to remove. The lock is per process, which is all
+# the app runs uploads in (see WEB_WORKERS in wsgi.py).
+#
+# The last upload under each original name is remembered:
+#
+#   uploads/.versions/report.xlsx     "3f5a...c9e1.xlsx"
+#
+# so a changed workbook uploaded under the same name again can be converted as a
+# new version of it (see columnar_store.appended_sheet).
+
+CHUNK_SIZE = 1024 * 1024
+
+WORKBOOK_PATH = 'xl/workbook.xml'
+WORKBOOK_RELS_PATH = 'xl/_rels/workbook.xml.rels'
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_ID = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+WORKSHEET_REL_TYPE = '/worksheet'
+VERSIONS_DIR = '.versions'
+REFS_DIR = '.refs'
+
+_store_lock = threading.Lock()
+
+
+# Copy an upload stream to disk a chunk at a time while hashing it, then move it
+# to its content-addressed name unless an identical upload is already stored,
+# and add the upload's reference to it. Returns (filename, filepath, is_new).
+def save_upload(stream, upload_folder, extension):
+    digest = hashlib.sha256()
+    incoming = os.path.join(upload_folder, f'.incoming-{uuid.uuid4().hex}')
+
+    try:
+        with open(incoming, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+
+        filename = f'{digest.hexdigest()}.{extension}'
+        filepath = os.path.join(upload_folder, filename)
+
+        # link() never replaces an existing file, so concurrent identical uploads
+        # keep the first copy (and its mtime, which the converted sheets check)
+        with _store_lock:
+            add_reference(upload_folder, filename)
+            try:
+                os.link(incoming, filepath)
+                is_new = True
+            except FileExistsError:
+                is_new = False
+    finally:
+        if os.path.exists(incoming):
+            os.remove(incoming)
+
+    return filename, filepath, is_new
+
+
+def add_reference(upload_folder, filename):
+    refs = os.path.join(upload_folder, REFS_DIR, filename)
+    os.makedirs(refs, exist_ok=True)
+    open(os.path.join(refs, uuid.uuid4().hex), 'w').close()
+
+
+# Drop one upload's reference to a stored workbook. Returns True if it was the
+# last one (workbooks stored before uploads were counted have none), meaning the
+# workbook can be removed.
+def release_reference(upload_folder, filename):
+    refs = os.path.join(upload_folder, REFS_DIR, filename)
+    while True:
+        try:
+            names = os.listdir(refs)
+        except FileNotFoundError:
+            return True
+        for name in names:
+            try:
+                os.remove(os.path.join(refs, name))
+                break
+            except FileNotFoundError:
+                # Dropped by a concurrent delete; take another one
+                continue
+        else:
+            if names:
+                continue
+
+        # Fails while another upload still holds a reference (or if a concurrent
+        # delete already removed the directory)
+        try:
+            os.rmdir(refs)
+        except OSError:
+            return False
+        return True
+
+
+# Drop one upload's reference to a stored workbook and, if it was the last,
+# remove the workbook, the version entries naming it and what remove_related
+# (called with its path) removes along with it, such as its converted sheets.
+# Returns True if the workbook was removed.
+def release_upload(upload_folder, filename, remove_related):
+    filepath = os.path.join(upload_folder, filename)
+    with _store_lock:
+        if not release_reference(upload_folder, filename):
+            return False
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        remove_related(filepath)
+        forget_versions(upload_folder, filename)
+    return True
+
+
+# Forget the original file names whose last upload was this stored workbook,
+# once it is removed
+def forget_versions(upload_folder, filename):
+    versions = os.path.join(upload_folder, VERSIONS_DIR)
+    try:
+        names = os.listdir(versions)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(versions, name)
+        try:
+            with open(path) as f:
+                if f.read().strip() != filename:
+                    continue
+            os.remove(path)
+        except OSError:
+            continue
+
+
+# Path of the last upload stored under this original file name, or None if there
+# is none (or it has since been deleted)
+def previous_upload(upload_folder, original_filename):
+    try:
+        with open(os.path.join(upload_folder, VERSIONS_DIR, original_filename)) as f:
+            filename = f.read().strip()
+    except OSError:
+        return None
+    filepath = os.path.join(upload_folder, filename)
+    return filepath if filename and os.path.isfile(filepath) else None
+
+
+# Remember the stored name of the latest upload under an original file name
+def record_upload(upload_folder, original_filename, filename):
+    versions = os.path.join(upload_folder, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    path = os.path.join(versions, original_filename)
+    staging = f'{path}.tmp-{uuid.uuid4().hex}'
+    with open(staging, 'w') as f:
+        f.write(filename)
+    os.replace(staging, path)
+
+
+# Read the sheet names of a workbook from its xl/workbook.xml manifest without
+# touching any sheet data. Like pandas, only worksheets are listed (chart sheets
+# are skipped). Workbooks that aren't zip packages (.xls) are opened with pandas.
+def read_sheet_names(filepath):
+    if not zipfile.is_zipfile(filepath):
+        with pd.ExcelFile(filepath) as workbook:
+            return workbook.sheet_names
+
+    with zipfile.ZipFile(filepath) as package:
+        workbook = ET.fromstring(package.read(WORKBOOK_PATH))
+        relationships = ET.fromstring(package.read(WORKBOOK_RELS_PATH))
+
+    rel_types = {rel.get('Id'): rel.get('Type', '') for rel in relationships.iter(f'{REL_NS}Relationship')}
+
+    sheet_names = []
+    for sheet in workbook.iter(f'{MAIN_NS}sheet'):
+        if rel_types.get(sheet.get(REL_ID), '').endswith(WORKSHEET_REL_TYPE):
+            sheet_names.append(sheet.get('name'))
+    return sheet_names
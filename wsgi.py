@@ -0,0 +1,110 @@
+import os
+
+# Production entry point. `python app.py` runs Flask's single-process debug
+# server; this serves the same app with a real WSGI server:
+#
+#   python wsgi.py                 gunicorn if installed, else waitress, else
+#                                  werkzeug's threaded server
+#   gunicorn -c wsgi.py wsgi:app   the same settings under gunicorn's own CLI
+#
+# Everything is configured through environment variables:
+#
+#   HOST, PORT                 address to listen on (127.0.0.1:8000)
+#   WEB_WORKERS                server processes (1). Keep this at 1 unless the
+#                              processes share a sticky load balancer: upload
+#                              ingestion jobs and all caches live in the process
+#                              that served the request.
+#   WEB_THREADS                request threads per server process (16). Threads
+#                              mostly wait on chart workers, ingestion and disk,
+#                              so there can be many more than cores. Werkzeug's
+#                              server starts a thread per request instead.
+#   CHART_WORKERS              processes computing /generate_chart,
+#                              /apply_chart_filter and /apply_chart_filter_batch
+#                              results (one per core). 0 computes them in the
+#                              request thread, as the debug server does.
+#   REQUEST_TIMEOUT            seconds a chart computation may take before the
+#                              request gets a 504 (60). Also the worker timeout
+#                              given to gunicorn and waitress.
+#   MAX_CONCURRENT_REQUESTS    data (POST) requests handled at once (two per
+#                              core); others queue for a free slot
+#   REQUEST_QUEUE_TIMEOUT      seconds a queued request waits before a 503 with
+#                              Retry-After (30)
+#   INGEST_WORKERS             processes converting uploaded sheets (one per core)
+#   SHEET_CACHE_MAX_BYTES      parsed sheets kept in memory per process (512 MB).
+#                              Chart workers each have their own cache, so the
+#                              total can reach (1 + CHART_WORKERS) times this.
+#   RESPONSE_CACHE_MAX_BYTES   serialized chart responses kept (64 MB, 0 disables)
+#   IMAGE_CACHE_MAX_BYTES      rendered /render_chart images kept (64 MB, 0 disables)
+#   ROLLUP_CUBE                0 to always chart from the raw rows
+#   EXCEL_READER               engine reading workbooks: auto (stream, falling
+#                              back to openpyxl), stream, openpyxl or calamine
+#   EXPORT_COMPRESS_MIN_BYTES  chart data from this size (512 KB) is embedded
+#                              gzipped in /download_chart_code pages
+#   PROFILE_SLOW_REQUESTS      write cProfile stats of requests slower than this
+#                              many seconds to PROFILE_DIR (0, off)
+#   PROFILE_SAMPLE_RATE        share of requests profiled while that is on (1.0)
+#   PROFILE_DIR                where the .prof files go (profiles)
+#
+# Per-stage timings come back on every response as a Server-Timing header, and
+# GET /metrics serves request latencies, cache hit rates, bytes served and rows
+# processed in the Prometheus text format.
+#
+# Under load, start from CHART_WORKERS = cores and MAX_CONCURRENT_REQUESTS at
+# about twice that: requests then queue in front of the workers instead of
+# piling up on them, and cached responses, status polls and static files (which
+# aren't limited) stay fast. Lower SHEET_CACHE_MAX_BYTES if memory is tight.
+
+CPU_COUNT = os.cpu_count() or 1
+
+os.environ.setdefault('CHART_WORKERS', str(CPU_COUNT))
+os.environ.setdefault('MAX_CONCURRENT_REQUESTS', str(2 * CPU_COUNT))
+
+from app import app  # noqa: E402 (the settings above are read at import)
+
+host = os.environ.get('HOST', '127.0.0.1')
+port = int(os.environ.get('PORT', 8000))
+web_workers = int(os.environ.get('WEB_WORKERS', 1))
+web_threads = int(os.environ.get('WEB_THREADS', 16))
+request_timeout = app.config['REQUEST_TIMEOUT']
+
+# gunicorn settings, read when started as `gunicorn -c wsgi.py wsgi:app`
+bind = f'{host}:{port}'
+workers = web_workers
+threads = web_threads
+worker_class = 'gthread'
+timeout = int(request_timeout) + 30
+
+
+def serve():
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        BaseApplication = None
+
+    if BaseApplication is not None:
+        class Server(BaseApplication):
+            def load_config(self):
+                for key in ('bind', 'workers', 'threads', 'worker_class', 'timeout'):
+                    self.cfg.set(key, globals()[key])
+
+            def load(self):
+                return app
+
+        Server().run()
+        return
+
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        waitress_serve = None
+
+    if waitress_serve is not None:
+        waitress_serve(app, host=host, port=port, threads=web_threads, channel_timeout=timeout)
+        return
+
+    from werkzeug.serving import run_simple
+    run_simple(host, port, app, threaded=True)
+
+
+if __name__ == '__main__':
+    serve()